@@ -2,56 +2,157 @@
     Program execution file.
 """
 #%% Import packages
+import time
+IMPORT_START = time.perf_counter()      # startup timing
 import config as config                 # configurables file
 import os, sys
 import datetime as dt
 import asyncio
+import logging
+import imaplib
 import smtplib
+from concurrent.futures import ThreadPoolExecutor
+import RH.Reports.APP_imports as imports    # deferred heavy imports (pandas, numpy, jinja2, robin_stocks)
 import RH.Reports.RH_functions as rh    # robinhood processes
 import RH.Reports.APP_functions as app  # application processes
 import RH.Process_routes as routes      # routes
-import RH.Log.logger as logger
- 
+import RH.Process_dispatch as dispatch  # command dispatcher
+import RH.Process_journal as journaling # executed-command journal
+import RH.Reports.Log.logger as logger
+IMPORT_TIME = time.perf_counter() - IMPORT_START
+
+
+def initial_connect(concurrent=True):
+    """ Log in to Robinhood, IMAP and SMTP before the event loop starts.
+        + concurrent: all three logins at once -- startup waits for the slowest,
+          not the sum (config.settings['startup']['mode'] == 'fast')
+        + Returns (e_client, e_server, {service: seconds}); raises if any login fails
+    """
+    def timed(call):
+        start = time.perf_counter()
+        return call(), time.perf_counter() - start
+
+    logins = {
+        'robinhood':lambda: rh.app().connect_robinhood(),
+        'imap':lambda: app.email_server().connect_gmail(),
+        'smtp':lambda: app.email_server().connect_smtp(),
+    }
+    with ThreadPoolExecutor(max_workers=len(logins) if concurrent else 1) as pool:
+        futures = {name:pool.submit(timed, login) for name, login in logins.items()}
+    results = {name:future.result() for name, future in futures.items()}     # re-raises a failed login
+    timings = {name:result[1] for name, result in results.items()}
+    return results['imap'][0], results['smtp'][0], timings
+
 
 async def rh_login():
-    """ Login to Robinhood every 15-minutes.
+    """ Keep the Robinhood session valid.
+        Sleeps until the token is due for refresh (or a 401 flags it), then
+        renews off the event loop -- refresh token first, full login only as fallback.
+        Session metrics (logins, refreshes, 401s, latencies) are logged after each renewal.
     """
-    timer = 60 * 15     # 15 minutes
+    check = config.settings['robinhood']['check_interval']
     while True:
-        await asyncio.sleep(timer)
-        rh.app().connect_robinhood()        # connect to rH
+        await asyncio.sleep(max(1, min(check, rh.SESSION.seconds_to_refresh())))
+        if rh.SESSION.valid():
+            continue
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, rh.SESSION.ensure)    # renew off the event loop
+            logging.getLogger('APP').info('RH SESSION -- {}'.format(rh.SESSION.metrics()))
+        except Exception as error:
+            logging.getLogger('APP').exception('RH SESSION -- renewal failed: {}'.format(error))
+            await asyncio.sleep(check)      # back off before trying again
 
-async def email_connect(e_client, e_server):
-    """ Refreshes email client and server objects.
+async def email_connect(connections):
+    """ Keeps email connections live.
+        Every 'check_interval' seconds, NOOP the IMAP and SMTP sessions and replace
+        a dead one off the event loop -- before a command or the mail loop needs it.
     """
-    timer = 60 * 15     # 15 minutes
+    timer = config.settings['mail']['check_interval']
     while True:
         await asyncio.sleep(timer)
-        e_client = app.email_server().connect_gmail()
-        e_server = app.email_server().connect_smtp()
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, connections.check)
+        except Exception as error:
+            logging.getLogger('APP').exception('EMAIL -- connection check failed: {}'.format(error))
 
-async def process_mail(e_client, e_server):
+async def process_mail(connections, dispatcher=None, journal=None):
     """ Processes email. 
         Routes are defined in "Process_routes.py"
+        Listener mode (IDLE push or adaptive poll) is set in config.settings['mail']
+        Commands run on 'dispatcher' thread pool, so mail keeps flowing while they execute
+        'journal' makes sure a text is never executed twice, even across restarts
+        'connections' (email_connections) owns the IMAP/SMTP sessions; a replaced IMAP
+        session is picked up here and the inbox reselected
     """
+    loop = asyncio.get_event_loop()
+    generation = None
+
+    async def reconnect(stale):
+        'Replace the dead IMAP session off the event loop; pause if that fails too'
+        try:
+            await loop.run_in_executor(None, connections.reconnect, 'imap', stale)
+        except Exception as error:
+            logging.getLogger('APP').exception('EMAIL -- IMAP reconnect failed: {}'.format(error))
+            await asyncio.sleep(config.settings['mail']['poll_max'])
+
+    def read(sync):
+        'Blocking IMAP read, run on the executor'
+        with connections.imap_lock:
+            return sync.get_new_mail()
+
     while True:
-        await asyncio.sleep(0.1)
+        # New IMAP session (first pass, or replaced) -> rebuild listener and sync on it
+        if generation != connections.generation:
+            generation = connections.generation
+            e_client = connections.imap()
+            listener = app.mail_listener(e_client, inbox_name='Inbox', lock=connections.imap_lock)
+            sync = app.mail_sync(e_client, inbox_name='Inbox')
 
-        # Try to read message. If error, reconnect and try again.
+        # Read new mail. If the connection is dead, replace it and read again;
+        # any other failure (e.g. an unexpected response) is logged and retried after a pause
         try:
-            UNREAD_MSG = app.email_server().get_unread_mail(e_client=e_client, inbox_name='Inbox')
-        except Exception as e:
-            # Refresh connection and read msg again
-            e_client = app.email_server().connect_gmail()
-            e_server = app.email_server().connect_smtp()
-            UNREAD_MSG = app.email_server().get_unread_mail(e_client=e_client, inbox_name='Inbox')
-
-        # Process message
-        routes.PROCESS_UNREAD_MSG(
-            unread_email=UNREAD_MSG, 
-            email_client=e_client,
-            email_server=e_server,
-        )
+            if listener.broken:
+                raise ConnectionError('IDLE connection lost')
+            UNREAD_MSG = await loop.run_in_executor(None, read, sync)
+        except (imaplib.IMAP4.abort, OSError, ConnectionError):
+            await reconnect(e_client)
+            continue
+        except Exception as error:
+            logging.getLogger('APP').exception('EMAIL -- reading new mail failed: {}'.format(error))
+            await asyncio.sleep(config.settings['mail']['poll_max'])
+            continue
+
+        # Process message. A dead connection leaves the batch uncommitted: it is read
+        # again on the new session and the journal skips commands already started.
+        # Any other failure is logged and the high-water mark still advances, so a
+        # failing text is never re-read in a loop
+        try:
+            with connections.imap_lock:
+                routes.PROCESS_UNREAD_MSG(
+                    unread_email=UNREAD_MSG, 
+                    email_client=e_client,
+                    email_server=connections,
+                    dispatcher=dispatcher,
+                    journal=journal,
+                )
+        except (imaplib.IMAP4.abort, OSError, ConnectionError) as error:
+            logging.getLogger('APP').warning('EMAIL -- connection lost while routing mail: {!r}'.format(error))
+            await reconnect(e_client)
+            continue
+        except Exception as error:
+            logging.getLogger('APP').exception('EMAIL -- routing new mail failed: {}'.format(error))
+        sync.commit(UNREAD_MSG)
+
+        # Wait for new mail
+        listener.update(new_mail=len(UNREAD_MSG))
+        await listener.wait()
+
+        # Connection check found IMAP busy in IDLE -- probe it now that IDLE returned
+        if connections.probe_due:
+            try:
+                await loop.run_in_executor(None, connections.probe)
+            except Exception as error:
+                logging.getLogger('APP').exception('EMAIL -- IMAP probe failed: {}'.format(error))
 
 
 if __name__=='__main__':
@@ -62,19 +163,33 @@ if __name__=='__main__':
     LOGGER = logger.log()               # initialize class
     LOG = LOGGER.log                    # log 
     LOG.info('Log initialized')
+    DISPATCH = dispatch.scheduler()     # runs commands off the event loop, CANCEL first
+    JOURNAL = journaling.command_journal()  # replays executed commands from disk
 
     # Async processes
     try:
-        # Initial load
-        rh.app().connect_robinhood()
-        e_client = app.email_server().connect_gmail()
-        e_server = app.email_server().connect_smtp()
+        # Initial load -- 'fast' defers heavy imports and logs in concurrently
+        FAST = config.settings['startup']['mode'] == 'fast'
+        if not FAST:
+            imports.preload()
+        e_client, e_server, CONNECT_TIMES = initial_connect(concurrent=FAST)
+        STARTUP = '{now} -- [STARTUP] mode {mode} | imports {imports:.3f}s (deferred loaded: {deferred}) | connect {connect} | ready in {ready:.3f}s'.format(
+            now=app.now(),
+            mode=config.settings['startup']['mode'],
+            imports=IMPORT_TIME,
+            deferred=', '.join('{} {:.3f}s'.format(name, sec) for name, sec in imports.IMPORT_TIMES.items()) or 'none',
+            connect=', '.join('{} {:.3f}s'.format(name, sec) for name, sec in CONNECT_TIMES.items()),
+            ready=time.perf_counter() - IMPORT_START,
+        )
+        print(STARTUP)
+        LOG.info(STARTUP)
+        EMAIL = app.email_connections(e_client, e_server)   # owns IMAP/SMTP from here on
 
         # Create tasks
         APP = asyncio.get_event_loop()                      # scheduler
         APP.create_task(rh_login())                         # refresh RH connection
-        APP.create_task(email_connect(e_client, e_server))  # refresh email connections
-        APP.create_task(process_mail(e_client, e_server))
+        APP.create_task(email_connect(EMAIL))               # keep email connections live
+        APP.create_task(process_mail(EMAIL, DISPATCH, JOURNAL))
 
         # Launch tasks
         APP.run_forever()
@@ -86,6 +201,8 @@ if __name__=='__main__':
         LOG.exception('ERROR --{}'.format(error))
 
     # Close application
+    DISPATCH.shutdown(wait=False)   # drop queued commands
+    JOURNAL.close()
     APP.close()     # close out
     LOG.info('Closing log')
     LOGGER.close()
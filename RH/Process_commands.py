@@ -0,0 +1,217 @@
+''' Command matcher
+    + Compiles the command table in config.py once, at startup, into a token trie
+    + match() reads the words of a text once and returns every route whose
+      trigger appears as whole words -- 'O' matches "LIMIT BUY O" but not
+      "OPEN" or "CRYPTO"; 'CANCEL ALL' needs both words, in order
+    + Cost per message depends on text length, not on how many commands are defined
+    + parse_orders() turns an order text into compact order_commands (one per
+      leg), once, for every route to reuse; malformed texts raise command_error
+      with a message fit to text back to the user
+'''
+#%%
+import config as config              # application configurables file
+import math
+import re
+
+TOKEN = re.compile(r'[A-Z0-9]+')     # words of an upper-cased text
+
+#%% Matcher
+class command_matcher:
+    ''' Token trie over all command triggers
+        + Route names are the keys of config.commands; nested groups are
+          dotted, e.g. 'instruments.options'
+    '''
+    END = None      # trie key holding the routes that end at a node
+
+    def __init__(self, commands=config.commands):
+        self.trie = {}
+        self.depth = 0      # longest trigger, in words
+        for route, triggers in self.flatten(commands):
+            for trigger in triggers:
+                words = TOKEN.findall(trigger.upper())
+                if not words:
+                    continue
+                node = self.trie
+                for word in words:
+                    node = node.setdefault(word, {})
+                node.setdefault(self.END, set()).add(route)
+                self.depth = max(self.depth, len(words))
+
+    @staticmethod
+    def flatten(commands, prefix=''):
+        'Yield (route, triggers) from nested command table'
+        for key, value in commands.items():
+            if isinstance(value, dict):
+                yield from command_matcher.flatten(value, prefix + key + '.')
+            else:
+                yield prefix + key, value
+
+    def match(self, text):
+        'Return set of routes whose triggers appear in text as whole words'
+        words = TOKEN.findall(text.upper())
+        matched = set()
+        for i in range(len(words)):
+            node = self.trie
+            for word in words[i:i + self.depth]:
+                node = node.get(word)
+                if node is None:
+                    break
+                if self.END in node:
+                    matched |= node[self.END]
+        return matched
+
+
+MATCHER = command_matcher()     # compiled once at startup
+
+
+#%% Order grammar
+class command_error(ValueError):
+    'Malformed command text; str(error) is sent back to the user'
+
+
+class order_command:
+    ''' Parsed order text
+            [Type] [Side] [Instrument]          LIMIT BUY E
+            [Quantity] [Symbol] [Price]         10 AAPL MAX 0.3
+        + type:       'LIMIT'
+        + side:       'BUY' | 'SELL'
+        + instrument: 'equities' | 'options' | 'crypto' (config.commands['instruments'])
+        + quantity:   float
+        + symbol:     upper-case ticker
+        + price_mode: 'MAX' | 'MIN' -- 'price' is pct above/below market (0.3 == 0.3%)
+                      'LIMIT'       -- 'price' is the limit price
+    '''
+    __slots__ = ('type', 'side', 'instrument', 'quantity', 'symbol', 'price_mode', 'price')
+
+    def __init__(self, type, side, instrument, quantity, symbol, price_mode, price):
+        self.type = type
+        self.side = side
+        self.instrument = instrument
+        self.quantity = quantity
+        self.symbol = symbol
+        self.price_mode = price_mode
+        self.price = price
+
+    def limit_price(self, mkt_price):
+        'Limit price given current market price'
+        if self.price_mode == 'MAX':
+            return mkt_price * (1 + self.price / 100)
+        if self.price_mode == 'MIN':
+            return mkt_price * (1 - self.price / 100)
+        return self.price
+
+    def __repr__(self):
+        return 'order_command({})'.format(', '.join(
+            '{}={!r}'.format(name, getattr(self, name)) for name in self.__slots__
+        ))
+
+
+ORDER_TYPES = {'LIMIT'}
+SIDES = {'BUY', 'SELL'}
+PRICE_MODES = {'MAX', 'MIN'}
+INSTRUMENTS = {
+    word.upper():name
+    for name, words in config.commands['instruments'].items()
+    for word in words
+}
+
+def number(text, field, where=''):
+    'Parse positive, finite number or raise command_error naming the field (and line, see parse_leg)'
+    try:
+        value = float(text)
+    except ValueError:
+        raise command_error('{} must be a number, got "{}"{}'.format(field, text, where)) from None
+    if not math.isfinite(value):                            # float() accepts NAN / INF / INFINITY
+        raise command_error('{} must be a number, got "{}"{}'.format(field, text, where))
+    if value <= 0:
+        raise command_error('{} must be above 0, got "{}"{}'.format(field, text, where))
+    return value
+
+def parse_orders(text):
+    ''' Parse order text into one order_command per leg.
+            LIMIT BUY E             header, once
+            10 AAPL MAX 0.3         one leg per line (up to settings['orders']['batch_max_legs'])
+            5 MSFT MIN 0.2
+        + Line 2 must be a leg; later lines are legs when they have the leg shape
+          (see looks_like_leg) -- the first line that does not ends the order
+          (carrier footers, signatures). Blank lines are ignored.
+    '''
+    lines = [line.split() for line in text.upper().splitlines() if line.strip()]
+    if len(lines) < 2:
+        raise command_error('Order needs 2 lines: "LIMIT BUY E" then "10 AAPL MAX 0.3"')
+
+    header = lines[0]
+    if len(header) != 3:
+        raise command_error('Line 1 must be [Type] [Side] [Instrument], got "{}"'.format(' '.join(header)))
+    type, side, instrument = header
+    if type not in ORDER_TYPES:
+        raise command_error('Order type must be one of {}, got "{}"'.format('/'.join(sorted(ORDER_TYPES)), type))
+    if side not in SIDES:
+        raise command_error('Side must be BUY or SELL, got "{}"'.format(side))
+    if instrument not in INSTRUMENTS:
+        raise command_error('Unknown instrument "{}" -- use one of {}'.format(instrument, '/'.join(sorted(INSTRUMENTS))))
+
+    legs = [lines[1]]
+    for detail in lines[2:]:
+        if not looks_like_leg(detail):
+            break
+        legs.append(detail)
+    max_legs = config.settings['orders']['batch_max_legs']
+    if len(legs) > max_legs:
+        raise command_error('At most {} orders per text, got {}'.format(max_legs, len(legs)))
+
+    orders = [parse_leg(detail, line + 2) for line, detail in enumerate(legs)]
+    for order in orders:
+        order.type, order.side, order.instrument = type, side, INSTRUMENTS[instrument]
+    return orders
+
+SEGMENT = re.compile(r'\d+ OF \d+')     # carrier split-text marker, e.g. "1 of 2"
+
+def numeric(text):
+    'True if text parses as a number'
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+def looks_like_leg(detail):
+    ''' Leg-shaped line: [Quantity] [Symbol], then optionally [Price] or MAX|MIN [Pct]
+        + Symbol starts with a letter -- "555 123 4567" is not a leg
+        + Carrier split-text markers ("1 of 2") are not legs
+    '''
+    if not 2 <= len(detail) <= 4 or SEGMENT.fullmatch(' '.join(detail)):
+        return False
+    if not numeric(detail[0]) or not detail[1][:1].isalpha():
+        return False
+    if len(detail) == 2 or detail[2] in PRICE_MODES:
+        return True
+    return len(detail) == 3 and numeric(detail[2])
+
+def parse_leg(detail, line=2):
+    'One [Quantity] [Symbol] MAX|MIN [Pct] or [Quantity] [Symbol] [Price] line'
+    where = '' if line == 2 else ' (line {})'.format(line)
+    if len(detail) == 3 and detail[2] in PRICE_MODES:
+        raise command_error('{} needs a pct, e.g. "{} {} {} 0.3"{}'.format(detail[2], *detail, where))
+    if len(detail) == 4 and detail[2] in PRICE_MODES:       # 10 AAPL MAX 0.3
+        price_mode, price = detail[2], number(detail[3], 'Pct', where)
+        if price_mode == 'MIN' and price >= 100:            # limit would be 0 or negative
+            raise command_error('MIN pct must be below 100, got "{}"{}'.format(detail[3], where))
+    elif len(detail) == 3:                                  # 10 AAPL 187.50
+        price_mode, price = 'LIMIT', number(detail[2], 'Limit price', where)
+    else:
+        raise command_error('Line {} must be [Quantity] [Symbol] MAX|MIN [Pct] or [Quantity] [Symbol] [Price], got "{}"'.format(line, ' '.join(detail)))
+
+    return order_command(
+        type=None,
+        side=None,
+        instrument=None,
+        quantity=number(detail[0], 'Quantity', where),
+        symbol=detail[1],
+        price_mode=price_mode,
+        price=price,
+    )
+
+def parse_order(text):
+    'First leg of an order text (see parse_orders)'
+    return parse_orders(text)[0]
@@ -0,0 +1,166 @@
+''' Application process dispatcher
+    + Runs routed commands on a bounded thread pool so robin_stocks HTTP calls
+      and SMTP sends never block the asyncio loop (mail listener, login refresh)
+    + The mail loop keeps ingesting messages while commands run
+    + Tracks in-flight commands
+    + scheduler: priority classes (cancel -> order -> report) with reserved
+      slots per class, so time-to-cancel is bounded whatever is queued
+'''
+#%%
+import config as config              # application configurables file
+import RH.Reports.APP_functions as app  # custom functions
+import asyncio
+import collections
+import itertools
+import logging
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+
+LOG = logging.getLogger('APP')
+
+#%% Dispatcher
+class dispatcher:
+    ''' Executor-backed command dispatcher
+        + submit() returns immediately with an asyncio future
+        + in_flight maps job id to {'name', 'submitted'} until the command finishes
+    '''
+    def __init__(self, max_workers=config.settings['dispatch']['max_workers']):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='route')
+        self.in_flight = {}
+        self.job_ids = itertools.count(1)
+
+    def submit(self, name, function, args=None, route_class=None):
+        'Run function(args) on the pool through app.function_timer(); route_class is ignored'
+        loop = asyncio.get_event_loop()
+        job_id = next(self.job_ids)
+        self.in_flight[job_id] = {'name':name, 'submitted':dt.datetime.now()}
+        future = loop.run_in_executor(self.pool, app.function_timer, [function], args)
+        future.add_done_callback(lambda f: self.done(job_id, f))
+        return future
+
+    def done(self, job_id, future):
+        'Report finished command and drop it from in_flight'
+        job = self.in_flight.pop(job_id)
+        if future.cancelled():
+            LOG.warning('[{}] Command cancelled'.format(job['name']))
+        elif future.exception() is not None:
+            LOG.error('[{}] Command failed -- {!r}'.format(job['name'], future.exception()))
+        else:
+            print('{now} -- [{name}] Executed command [Runtime: {runtime}] [Wall: {wall}] [In flight: {n}]'.format(
+                now=app.now(),
+                name=job['name'],
+                runtime=future.result(),
+                wall=dt.datetime.now() - job['submitted'],
+                n=len(self.in_flight),
+            ))
+
+    def shutdown(self, wait=True):
+        'Stop accepting commands; by default wait for in-flight commands'
+        self.pool.shutdown(wait=wait)
+
+
+#%% Priority scheduler
+class scheduler(dispatcher):
+    ''' Priority command scheduler
+        + Each command belongs to a class from config.settings['dispatch']['classes'],
+          listed highest priority first: cancel, order, report
+        + Each class has reserved slots ('max_workers') that lower classes never take,
+          so a CANCEL never waits behind a slow CURRENT HOLDINGS report
+        + A class may also borrow an idle slot of any lower class (a burst of cancels
+          spills onto free report slots, never the reverse)
+        + A freed slot goes to the highest-priority job waiting that may use it --
+          a queued CANCEL starts before reports queued earlier
+        + Within a class, commands start in arrival order
+        + stats() returns queue depth, running count and wait times per class;
+          logged at INFO after every command
+        + tasks holds every queued/running job task -- callers may drop the one
+          submit() returns, and asyncio keeps only weak references to tasks
+    '''
+    def __init__(self, classes=config.settings['dispatch']['classes']):
+        super().__init__(max_workers=sum(c['max_workers'] for c in classes.values()))
+        self.classes = list(classes)                                # highest priority first
+        self.free = {name:c['max_workers'] for name, c in classes.items()}     # idle reserved slots
+        self.waiting = {name:collections.deque() for name in classes}          # futures of queued jobs
+        self.tasks = set()                                          # job tasks until they finish
+        self.counters = {
+            name:{'queued':0, 'running':0, 'done':0, 'wait_total':0.0, 'wait_max':0.0}
+            for name in classes
+        }
+
+    def submit(self, name, function, args=None, route_class='report'):
+        'Queue function(args) in route_class; returns asyncio task resolving to the finished future'
+        job_id = next(self.job_ids)
+        self.in_flight[job_id] = {'name':name, 'class':route_class, 'submitted':dt.datetime.now()}
+        self.counters[route_class]['queued'] += 1
+        task = asyncio.ensure_future(self.run(job_id, function, args))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    # Slots
+    def usable(self, route_class):
+        'Classes whose slots route_class may run on: its own, then every lower class'
+        return self.classes[self.classes.index(route_class):]
+
+    async def acquire(self, route_class):
+        'Wait for a slot; returns the class that owns it'
+        for owner in self.usable(route_class):
+            if self.free[owner]:
+                self.free[owner] -= 1
+                return owner
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiting[route_class].append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():            # slot handed over just before cancel
+                self.release(waiter.result())
+            raise
+
+    def release(self, owner):
+        'Hand the slot to the highest-priority queued job that may use it, else free it'
+        for route_class in self.classes[:self.classes.index(owner) + 1]:
+            queue = self.waiting[route_class]
+            while queue:
+                waiter = queue.popleft()
+                if not waiter.done():                               # skip cancelled waits
+                    waiter.set_result(owner)
+                    return
+        self.free[owner] += 1
+
+    async def run(self, job_id, function, args):
+        'Wait for a free slot for the job class, then run it on the pool'
+        job = self.in_flight[job_id]
+        counter = self.counters[job['class']]
+        owner = await self.acquire(job['class'])
+        try:
+            wait = (dt.datetime.now() - job['submitted']).total_seconds()
+            counter['queued'] -= 1
+            counter['running'] += 1
+            counter['wait_total'] += wait
+            counter['wait_max'] = max(counter['wait_max'], wait)
+            loop = asyncio.get_event_loop()
+            future = loop.run_in_executor(self.pool, app.function_timer, [function], args)
+            try:
+                await asyncio.wait([future])
+            finally:
+                counter['running'] -= 1
+                counter['done'] += 1
+        finally:
+            self.release(owner)
+        self.done(job_id, future)
+        LOG.info('[SCHEDULER] {}'.format(self.stats()))
+        return future
+
+    def stats(self):
+        'Queue depth, running count and wait times (seconds) per class'
+        return {
+            name:{
+                'queued':c['queued'],
+                'running':c['running'],
+                'done':c['done'],
+                'wait_avg':round(c['wait_total'] / c['done'], 4) if c['done'] else 0.0,
+                'wait_max':round(c['wait_max'], 4),
+            }
+            for name, c in self.counters.items()
+        }
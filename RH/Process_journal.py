@@ -0,0 +1,96 @@
+''' Command journal
+    + Append-only record of every routed command, keyed on the email's
+      Message-ID and the route name
+    + A command is recorded as 'started' (durably, on disk) before it runs, then
+      'done' or 'failed' -- a text that was already started is never run again,
+      even after a crash, a restart or a reconnect that re-reads the inbox
+    + SQLite in WAL mode with synchronous=FULL; the latest status of every
+      command is replayed into a dict on startup, so lookups are O(1)
+'''
+#%%
+import os
+import hashlib
+import sqlite3
+import threading
+import datetime as dt
+
+JOURNAL_PATH = os.path.join(os.getcwd(),'RH','Reports','Log','journal.sqlite')   # journal file
+
+#%% Journal key
+def journal_key(mail):
+    'Message-ID of mail_record; hash of sender, time and text if the header is missing'
+    if mail.message_id:
+        return mail.message_id.strip()
+    digest = hashlib.sha1('{}|{}|{}'.format(mail.sender, mail.datetime, mail.body).encode()).hexdigest()
+    return 'sha1:' + digest
+
+#%% Journal
+class command_journal:
+    ''' Append-only command journal
+        + claim(): record 'started' and return True, or False if already seen
+        + finish(): record 'done' / 'failed'
+        + tracked(): wrap a route function so it claims and finishes itself
+    '''
+    def __init__(self, path=JOURNAL_PATH):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=FULL')        # fsync each commit
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS journal ('
+            'seq INTEGER PRIMARY KEY AUTOINCREMENT, message_id TEXT, route TEXT, '
+            'status TEXT, at TEXT, detail TEXT)'
+        )
+        self.db.commit()
+        self.index = self.replay()
+
+    def replay(self):
+        'Latest status of every (message_id, route), in journal order'
+        index = {}
+        for message_id, route, status in self.db.execute('SELECT message_id, route, status FROM journal ORDER BY seq'):
+            index[(message_id, route)] = status
+        return index
+
+    def append(self, message_id, route, status, detail=None):
+        'Write one record; returns once it is on disk'
+        self.db.execute(
+            'INSERT INTO journal (message_id, route, status, at, detail) VALUES (?, ?, ?, ?, ?)',
+            (message_id, route, status, dt.datetime.now().isoformat(), detail),
+        )
+        self.db.commit()
+        self.index[(message_id, route)] = status
+
+    def status(self, message_id, route):
+        'Latest status, or None if never seen'
+        return self.index.get((message_id, route))
+
+    def claim(self, message_id, route):
+        'Record command as started; False if it was already started (or finished) before'
+        with self.lock:
+            if (message_id, route) in self.index:
+                return False
+            self.append(message_id, route, 'started')
+            return True
+
+    def finish(self, message_id, route, error=None):
+        'Record outcome of a claimed command'
+        with self.lock:
+            if error is None:
+                self.append(message_id, route, 'done')
+            else:
+                self.append(message_id, route, 'failed', detail=repr(error))
+
+    def tracked(self, message_id, route, function):
+        'Wrap function(*args) so its outcome is journaled'
+        def run(*args):
+            try:
+                result = function(*args)
+            except Exception as error:
+                self.finish(message_id, route, error)
+                raise
+            self.finish(message_id, route)
+            return result
+        return run
+
+    def close(self):
+        self.db.close()
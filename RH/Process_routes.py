@@ -9,12 +9,64 @@
 import config as config              # application configurables file
 import RH.Reports.RH_functions as rh    # custom rh functions
 import RH.Reports.APP_functions as app  # custom functions
+import RH.Process_commands as commands  # command matcher and parser
+from RH.Process_journal import journal_key
 import datetime as dt
-import email
+import functools
+
+#%% Route runner
+def SKIPPED(name, journal, message_id):
+    'Report a command the journal has already seen'
+    print('{now} -- [{name}] Skipped -- already executed for {id} ({status})'.format(
+        now=app.now(),
+        name=name,
+        id=message_id,
+        status=journal.status(message_id, name),
+    ))
+
+def CLAIMED(name, function, journal, message_id):
+    ''' Wrap function so the journal claim runs with it, on the dispatcher pool
+        + The claim is an fsync'd SQLite commit -- kept off the event loop
+        + Still claimed before the command runs; a repeat is skipped, not run
+    '''
+    tracked = journal.tracked(message_id, name, function)
+    def run(*args):
+        if not journal.claim(message_id, name):
+            SKIPPED(name, journal, message_id)
+            return
+        return tracked(*args)
+    return run
+
+def RUN_ROUTE(name, function, args=None, dispatcher=None, route_class='report', journal=None, message_id=None):
+    ''' Execute an application process for a matched route.
+        + Without a dispatcher, runs inline in function_timer() and prints runtime
+        + With a dispatcher (Process_dispatch.py), hands the process to its
+          thread pool and returns immediately
+        + route_class sets scheduler priority: 'cancel' | 'order' | 'report'
+        + With a journal (Process_journal.py), a command already started for
+          this message_id is skipped, and the outcome is recorded; with a
+          dispatcher the claim runs on the pool thread (see CLAIMED)
+    '''
+    if dispatcher is not None:
+        if journal is not None:
+            function = CLAIMED(name, function, journal, message_id)
+        return dispatcher.submit(name, function, args, route_class=route_class)
+    if journal is not None:
+        if not journal.claim(message_id, name):
+            SKIPPED(name, journal, message_id)
+            return
+        function = journal.tracked(message_id, name, function)
+    runtime = app.function_timer(function=[function], args=args)
+    # Print runtime message
+    print('{now} -- [{name}] Executed command [Runtime: {runtime}]'.format(
+        now=app.now(), 
+        name=name,
+        runtime=runtime
+    ))
 
 #%% Routes processor
 #   Map of how texted instructions will be processed
-def PROCESS_UNREAD_MSG(unread_email, email_client, email_server):
+def PROCESS_UNREAD_MSG(unread_email, email_client, email_server, dispatcher=None, journal=None):
     ''' Main process
         + Searches email for unread messages
         + If messages are from phone number defined in 'config.py', process
@@ -27,22 +79,15 @@ def PROCESS_UNREAD_MSG(unread_email, email_client, email_server):
         matches with commands from config.py. If a match is found, mark the
         email as 'READ' and pass the appropraite application process to
         function_timer() to execute. Print total runtime when process is completed.
+        If a dispatcher is given, processes run on its thread pool instead (see RUN_ROUTE).
+        If a journal is given, each command runs at most once per email (Message-ID).
     '''
-    # Read unread email
+    # Read unread email (mail_record objects, parsed once in APP_functions.py)
     for mail in unread_email:
-        
-        # Parse unread mail
-        msg = {
-            'id':       mail['msg_id'],
-            'from':     mail['from'],
-            'date':     mail['datetime'],
-            'subject':  mail['subject'],
-            'body':     email.message_from_string(mail['body'])
-        }
 
         # Verify sender of email to match phone number (defined in config.py file)
         # Proceed if matched, else ignore
-        if msg['from'] == config.user_info['phone_address']:
+        if mail.sender == config.user_info['phone_address']:
             ''' !!! Text message construct:
                 + MARKET COMMANDS FROM PHONE SHOULD BE CONSTRUCTED AS:
                     [Transaction type] [Side] [Instrument]
@@ -52,74 +97,91 @@ def PROCESS_UNREAD_MSG(unread_email, email_client, email_server):
                     Cancell all / Cancel
             '''
 
-            # Fetch user's command from email
-            COMMAND = msg['body'].as_string().upper()     
+            # Fetch user's command from email; match all routes in one pass
+            COMMAND = mail.body.upper()     
+            MATCHED = commands.MATCHER.match(COMMAND)
+            MESSAGE_ID = journal_key(mail)
 
             #=== CURRENT HOLDINGS
-            COMMAND_TRIGGERS = config.commands['current_holdings']
-            if any(trigger in COMMAND for trigger in COMMAND_TRIGGERS):
-                email_client.store(msg['id'], '+FLAGS', '\Seen')    # mark email as read
-                # Run process in function_timer()
-                runtime = app.function_timer(                           
-                    function=[app.app_functions.current_holdings],
-                    args=email_server
+            if 'current_holdings' in MATCHED:
+                email_client.store(mail.msg_id, '+FLAGS', '\Seen')    # mark email as read
+                RUN_ROUTE(
+                    name='CURRENT HOLDINGS',
+                    function=app.app_functions.current_holdings,
+                    args=email_server,
+                    dispatcher=dispatcher,
+                    journal=journal,
+                    message_id=MESSAGE_ID,
+                    route_class='report',
                 )
-                # Print runtime message
-                print('{now} -- [CURRENT HOLDINGS] Executed command [Runtime: {runtime}]'.format(
-                    now=app.now(), 
-                    runtime=runtime
-                )) 
 
             #=== CANCEL ALL ORDERS
-            COMMAND_TRIGGERS = config.commands['cancel_orders']
-            if any(trigger in COMMAND for trigger in COMMAND_TRIGGERS):
-                email_client.store(msg['id'], '+FLAGS', '\Seen')    # mark email as read
-                # Run process in function_timer()
-                runtime = app.function_timer(
-                    function=[app.app_functions.cancel_orders],
-                    args=None
+            if 'cancel_orders' in MATCHED:
+                email_client.store(mail.msg_id, '+FLAGS', '\Seen')    # mark email as read
+                RUN_ROUTE(
+                    name='CANCEL ALL ORDERS',
+                    function=app.app_functions.cancel_orders,
+                    args=email_server,                                  # texts back outcomes
+                    dispatcher=dispatcher,
+                    journal=journal,
+                    message_id=MESSAGE_ID,
+                    route_class='cancel',
                 )
-                # Print runtime message
-                print('{now} -- [CANCEL ALL ORDERS] Executed command [Runtime: {runtime}]'.format(
-                    now=app.now(), 
-                    runtime=runtime
-                ))
 
             #=== LIMIT BUY/SELL ORDER
-            COMMAND_TRIGGERS = config.commands['limit_order']
-            if any(trigger in COMMAND for trigger in COMMAND_TRIGGERS):
-                email_client.store(msg['id'], '+FLAGS', '\Seen')   # mark email as read
+            if 'limit_order' in MATCHED:
+                email_client.store(mail.msg_id, '+FLAGS', '\Seen')   # mark email as read
+
+                # Parse order once (one order_command per leg); every route below reuses ORDERS
+                try:
+                    ORDERS = commands.parse_orders(COMMAND)
+                except commands.command_error as error:
+                    RUN_ROUTE(
+                        name='ORDER REJECTED',
+                        function=functools.partial(app.email_server().send_text, email_server),
+                        args='ORDER REJECTED -- {}'.format(error),
+                        dispatcher=dispatcher,
+                        journal=journal,
+                        message_id=MESSAGE_ID,
+                        route_class='order',
+                    )
+                    ORDERS = None
+                INSTRUMENT = ORDERS[0].instrument if ORDERS else None
 
-                #--- Equity
-                COMMAND_TRIGGERS = config.commands['instruments']['equities']
-                if any(trigger in COMMAND for trigger in COMMAND_TRIGGERS):
-                    # Run process in function_timer()
-                    runtime = app.function_timer(
-                        function=[app.app_functions.equity_limit_order],
-                        args=msg['body']
+                #--- Equity -- every leg placed concurrently, one reply
+                if INSTRUMENT == 'equities':
+                    RUN_ROUTE(
+                        name='STOCK ORDER',
+                        function=functools.partial(app.app_functions.equity_limit_orders, e_server=email_server),
+                        args=ORDERS,
+                        dispatcher=dispatcher,
+                        journal=journal,
+                        message_id=MESSAGE_ID,
+                        route_class='order',
                     )
-                    # Print runtime message
-                    print('{now} -- [STOCK ORDER] Executed command [Runtime: {runtime}]'.format(
-                        now=app.now(), 
-                        runtime=runtime
-                    ))
 
                 #--- Options
-                COMMAND_TRIGGERS = config.commands['instruments']['options']
-                if any(trigger in COMMAND for trigger in COMMAND_TRIGGERS):
+                if INSTRUMENT == 'options':
                     # WIP
                     pass
 
                 #--- Crypto
-                COMMAND_TRIGGERS = config.commands['instruments']['crypto']
-                if any(trigger in COMMAND for trigger in COMMAND_TRIGGERS):
+                if INSTRUMENT == 'crypto':
                     # WIP
                     pass          
             
             #=== ALL OPEN ORDERS
-            COMMAND_TRIGGERS = config.commands['open_orders']
-            if any(trigger in COMMAND for trigger in COMMAND_TRIGGERS):
-                # WIP
-                pass    
+            # 'O' is also the options instrument -- an order text is not an open orders request
+            if 'open_orders' in MATCHED and 'limit_order' not in MATCHED:
+                email_client.store(mail.msg_id, '+FLAGS', '\Seen')    # mark email as read
+                RUN_ROUTE(
+                    name='OPEN ORDERS',
+                    function=app.app_functions.open_orders,
+                    args=email_server,
+                    dispatcher=dispatcher,
+                    journal=journal,
+                    message_id=MESSAGE_ID,
+                    route_class='report',
+                )
 
             #=== CUSTOM COMMAND
@@ -4,20 +4,42 @@
 #%% Import Packages
 import os, sys
 import config as config              # account information
+from RH.Reports.APP_imports import lazy_module
 import RH.Reports.RH_functions as rh    # custom RH functions
+import RH.Reports.RH_marketdata as marketdata   # shared market data
+import RH.Process_commands as commands  # order commands
 
 import datetime as dt
-import pandas as pd
-import robin_stocks as r
+import json
+import re
+import base64
+import quopri
+import itertools
 
+import asyncio
+import contextlib
+import select
+import threading
+import time
 import imaplib
 import smtplib
 import email
+import email.parser
+import email.utils
+import zoneinfo
 from email.mime.text import MIMEText
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.multipart import MIMEMultipart
-from jinja2 import Environment
+jinja2 = lazy_module('jinja2')          # deferred until first report
 
 TEMPLATE_PATH = os.path.join(os.getcwd(),'RH','Reports','report_templates')   # path to html templates
+STATE_PATH = os.path.join(os.getcwd(),'RH','Reports','Log')                    # path to local state files
+MAIL_PARSER = email.parser.BytesParser()   # compat32 policy -- cheapest parse
+try:
+    EASTERN = zoneinfo.ZoneInfo('US/Eastern')
+except zoneinfo.ZoneInfoNotFoundError:      # no tz database (e.g. Windows without tzdata)
+    EASTERN = None                          # astimezone(None) -> local time
+SMTP_LOCK = threading.RLock()   # smtplib sessions are not thread-safe; commands may run concurrently
 
 #%% Runtime timer
 def function_timer(function, args=None):
@@ -37,6 +59,245 @@ def now():
     datetime = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     return datetime
 
+#%% IMAP sequence set
+def sequence_set(ids):
+    "Compress sorted message ids into an IMAP sequence set, e.g. [1,2,3,7] -> b'1:3,7'"
+    ids = sorted(int(id) for id in ids)
+    ranges = []
+    for id in ids:
+        if ranges and id == ranges[-1][1] + 1:
+            ranges[-1][1] = id
+        else:
+            ranges.append([id, id])
+    return ','.join(
+        str(lo) if lo == hi else '{}:{}'.format(lo, hi) for lo, hi in ranges
+    ).encode()
+
+
+#%% IMAP response parsing
+IMAP_TOKEN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+
+def imap_tokens(line):
+    "Split response text into '(' / ')' markers, bytes atoms/strings and None (NIL)"
+    tokens = []
+    for open_, close, quoted, atom in IMAP_TOKEN.findall(line):
+        if open_:
+            tokens.append('(')
+        elif close:
+            tokens.append(')')
+        elif atom:
+            tokens.append(None if atom.upper() == b'NIL' else atom)
+        else:
+            tokens.append(re.sub(rb'\\(.)', rb'\1', quoted))
+    return tokens
+
+def imap_parse(data):
+    ''' Parse imaplib FETCH response data into [(id, {ITEM: value})].
+        Values are bytes, None (NIL) or nested lists; literals ({n} strings),
+        which imaplib returns as (text, literal) tuples, are spliced in place.
+    '''
+    tokens = []
+    for part in data:
+        if isinstance(part, tuple):
+            tokens += imap_tokens(re.sub(rb'\{\d+\}$', b'', part[0].rstrip()))
+            tokens.append(part[1])
+        elif part:
+            tokens += imap_tokens(part)
+
+    # Nest lists
+    stack = [[]]
+    for token in tokens:
+        if token == '(':
+            stack.append([])
+        elif token == ')':
+            closed = stack.pop()
+            stack[-1].append(closed)
+        else:
+            stack[-1].append(token)
+
+    # Pair message id with its item list
+    top, result = stack[0], []
+    for id, items in zip(top[::2], top[1::2]):
+        result.append((id, {items[i].upper():items[i + 1] for i in range(0, len(items) - 1, 2)}))
+    return result
+
+def text_part(structure, path=()):
+    ''' (section, transfer encoding, charset) of first text/plain part in a
+        parsed BODYSTRUCTURE, or None. Single-part messages are section '1'.
+    '''
+    if isinstance(structure[0], list):                              # multipart: parts first, then subtype
+        parts = itertools.takewhile(lambda part: isinstance(part, list), structure)
+        for i, part in enumerate(parts, 1):
+            found = text_part(part, path + (i,))
+            if found is not None:
+                return found
+        return None
+    type, subtype, params = structure[0] or b'', structure[1] or b'', structure[2] or []
+    if type.upper() != b'TEXT' or subtype.upper() != b'PLAIN':
+        return None
+    params = {key.upper():value for key, value in zip(params[::2], params[1::2])}
+    charset = params.get(b'CHARSET')
+    return (
+        '.'.join(str(i) for i in path or (1,)),
+        (structure[5] or b'7BIT').upper(),
+        charset.decode() if charset else 'utf-8',
+    )
+
+def decode_part(raw, encoding, charset):
+    'Decode a (possibly truncated) body part to text'
+    if encoding == b'BASE64':
+        raw = re.sub(rb'\s+', b'', raw)
+        raw = base64.b64decode(raw[:len(raw) // 4 * 4])             # drop partial quantum left by byte cap
+    elif encoding == b'QUOTED-PRINTABLE':
+        raw = quopri.decodestring(raw)
+    try:
+        return raw.decode(charset, 'replace')
+    except LookupError:                                             # unknown charset
+        return raw.decode('utf-8', 'replace')
+
+
+#%% Report templates
+class template_registry:
+    ''' Report templates under TEMPLATE_PATH
+        + Every template is loaded and compiled once, through a FileSystemLoader
+        + Compiled bytecode is cached on disk (system temp dir) so restarts skip compiling
+        + A template is recompiled only when its file's mtime changes
+    '''
+    def __init__(self, path=TEMPLATE_PATH):
+        self.env = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(path),
+            bytecode_cache=jinja2.FileSystemBytecodeCache(),
+            auto_reload=True,       # stat file on use; reload if mtime changed
+            cache_size=-1,          # never evict compiled templates
+        )
+        for name in self.env.list_templates():
+            self.env.get_template(name)
+
+    def render(self, name, **context):
+        'Render template by file name'
+        return self.env.get_template(name).render(**context)
+
+
+_TEMPLATES = None
+_TEMPLATES_LOCK = threading.Lock()
+
+def templates():
+    'Shared template_registry, loaded on first use'
+    global _TEMPLATES
+    with _TEMPLATES_LOCK:
+        if _TEMPLATES is None:
+            _TEMPLATES = template_registry()
+        return _TEMPLATES
+
+
+#%% Holdings report table
+# Summary rows of current_holdings.html: {column: aggregate key}
+SUMMARY_ROWS = {
+    'aggregates':{'pct_change':'daily_change', 'cost':'total_position_cost', 'pos_$':'total_position_value',
+                  'pos_%':'position_pct', 'r_$':'return_$', 'r_%':'return_%'},
+    'cash':{'pos_$':'total_buying_power', 'pos_%':'cash_pct'},
+    'outstanding':{},
+    'total':{'pos_$':'total_portfolio_value'},
+}
+SUMMARY_LABELS = {'aggregates':'---', 'cash':'CASH', 'outstanding':'OUTS', 'total':'TOTAL'}
+
+def holdings_table(holdings, aggregates):
+    ''' Pre-format holdings for current_holdings.html
+        + holdings: holdings_book (RH_holdings.py)
+        + header: column titles
+        + rows: one tuple of strings per position, rounded and formatted in one pass
+        + summary: {row name: tuple of strings} for the aggregate/cash/outstanding/total rows
+        The template only loops over plain tuples -- no per-cell DataFrame indexing.
+    '''
+    columns = list(holdings.columns)
+    rows = holdings.rows(decimals=2)
+    summary = {}
+    for name, mapping in SUMMARY_ROWS.items():
+        cells = [aggregates[mapping[column]] if column in mapping else '' for column in columns]
+        cells[0] = SUMMARY_LABELS[name]
+        summary[name] = tuple(cells)
+    return {
+        'header':[column.replace('_',' ') for column in columns],
+        'rows':rows,
+        'summary':summary,
+    }
+
+
+#%% Text replies
+ASSET_CODES = {'equity':'E', 'options':'O', 'crypto':'C'}
+
+def cancel_reply(result):
+    ''' Compact text for rh.orders.cancel_all_orders() result:
+        summary line, one line per order, then any asset class that could not be listed
+    '''
+    def quantity(value):
+        try:    return '{:g}'.format(float(value))
+        except: return value or ''
+
+    if not result['outcomes'] and not result['list_errors']:
+        return 'CANCEL ALL -- no open orders ({:.2f}s)'.format(result['time_to_flat'])
+    lines = ['CANCEL ALL -- {ok}/{n} canceled, flat in {flat:.2f}s'.format(
+        ok=result['canceled'], n=len(result['outcomes']), flat=result['time_to_flat'],
+    )]
+    for o in result['outcomes']:
+        parts = [
+            'OK' if o['ok'] else 'FAIL',
+            ASSET_CODES.get(o['asset'], o['asset']),
+            o['symbol'] or (o['id'] or '')[:8],
+            o['side'],
+            quantity(o['quantity']),
+            '({})'.format(o['error']) if o['error'] else '',
+        ]
+        lines.append(' '.join(part for part in parts if part))
+    for asset, error in result['list_errors'].items():
+        lines.append('FAIL {} not listed ({})'.format(ASSET_CODES.get(asset, asset), error))
+    return '\n'.join(lines)
+
+
+def open_orders_reply(snapshot):
+    'Compact text for rh.orders.open_orders(): summary line, then one line per order'
+    def number(value):
+        try:    return '{:g}'.format(float(value))
+        except: return value or ''
+
+    lines = ['OPEN ORDERS -- {n} ({latency:.2f}s)'.format(
+        n=len(snapshot['orders']) or 'none', latency=snapshot['latency'],
+    )]
+    for o in snapshot['orders']:
+        parts = [
+            ASSET_CODES.get(o['asset'], o['asset']),
+            o['symbol'] or (o['id'] or '')[:8],
+            o['side'],
+            number(o['quantity']),
+            '@ {}'.format(number(o['price'])) if o['price'] else '',
+            o['type'],
+        ]
+        lines.append(' '.join(part for part in parts if part))
+    for asset, error in snapshot['list_errors'].items():
+        lines.append('FAIL {} not listed ({})'.format(ASSET_CODES.get(asset, asset), error))
+    return '\n'.join(lines)
+
+
+def orders_reply(legs, latency):
+    'Compact text for app_functions.equity_limit_orders(): summary line, then one line per leg'
+    def price(value):
+        return '{:.2f}'.format(value) if value >= 1 else '{:.4f}'.format(value)
+
+    placed = sum(leg['id'] is not None for leg in legs)
+    lines = ['{side} -- {placed}/{n} placed ({latency:.2f}s)'.format(
+        side=legs[0]['order'].side, placed=placed, n=len(legs), latency=latency,
+    )]
+    for leg in legs:
+        ORDER = leg['order']
+        line = '{status} {symbol} {quantity:g}'.format(
+            status='OK' if leg['id'] else 'FAIL', symbol=ORDER.symbol, quantity=ORDER.quantity,
+        )
+        if leg['limit_price'] is not None:
+            line += ' @ {}'.format(price(leg['limit_price']))
+        line += ' id {}'.format(leg['id']) if leg['id'] else ' ({})'.format(leg['error'])
+        lines.append(line)
+    return '\n'.join(lines)
+
 
 # Email server processes
 class email_server:
@@ -63,32 +324,540 @@ class email_server:
         server.login(user=self.email_user, password=self.email_password)    # login and standby for template to send
         return server
     
+    # Send a short plain-text reply
+    def send_text(self, e_server, body, subject='[Robin-Texts]', to=None):
+        'Text the user (phone_address in config.py) unless another address is given'
+        msg = MIMEText(body, 'plain')
+        msg['Subject'] = subject
+        msg['From'] = self.email_bot
+        msg['To'] = to or config.user_info['phone_address']
+        e_server.sendmail(from_addr=self.email_bot, to_addrs=msg['To'], msg=msg.as_string())    # manager serializes sends
+
     # Stop all connections
     # !! Is this necessary?
     def disconnect_all(self, client, server):
         email_server.quit()
         email_client.logout()
 
+    # Wait for server to push new mail (IMAP IDLE -- RFC 2177)
+    def idle(self, e_client, timeout, reply_timeout=config.settings['mail']['idle_reply_timeout']):
+        ''' Enter IDLE on the selected inbox and block until the server
+            announces new mail (EXISTS/RECENT) or 'timeout' seconds pass.
+            Returns True if new mail was announced.
+            + Every read has a 'reply_timeout' socket timeout: a half-open
+              connection raises e_client.abort instead of blocking until TCP gives up
+        '''
+        previous = e_client.sock.gettimeout()
+        e_client.sock.settimeout(reply_timeout)
+        try:
+            return self._idle(e_client, timeout)
+        except TimeoutError:
+            raise e_client.abort('no reply from server in IDLE for {}s'.format(reply_timeout)) from None
+        finally:
+            try:
+                e_client.sock.settimeout(previous)
+            except OSError:
+                pass
+
+    def _idle(self, e_client, timeout):
+        'IDLE exchange; socket timeout is set by idle()'
+        tag = e_client._new_tag()
+        e_client.send(tag + b' IDLE\r\n')
+        response = e_client.readline()
+        if not response:
+            raise e_client.abort('connection closed entering IDLE')
+        if not response.startswith(b'+'):                           # server refused IDLE
+            raise e_client.error('IDLE rejected: {}'.format(response))
+
+        # Wait on socket; server only writes when mailbox changes (or keepalive)
+        new_mail = False
+        deadline = time.monotonic() + timeout
+        while not new_mail:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            pending = getattr(e_client.sock, 'pending', lambda: 0)()  # bytes already decrypted by SSL
+            if not pending and not select.select([e_client.sock], [], [], remaining)[0]:
+                break
+            response = e_client.readline()
+            if not response:                                        # server closed the socket
+                raise e_client.abort('connection closed during IDLE')
+            new_mail = self._announces_mail(response)
+
+        # Leave IDLE; anything the server sent meanwhile is read here
+        e_client.send(b'DONE\r\n')
+        while True:
+            response = e_client.readline()
+            if not response:
+                raise e_client.abort('connection closed during IDLE')
+            if response.startswith(tag):
+                break
+            new_mail = new_mail or self._announces_mail(response)
+        return new_mail
+
+    @staticmethod
+    def _announces_mail(response):
+        "True if untagged response is '* n EXISTS' or '* n RECENT'"
+        return response.startswith(b'*') and response.rstrip().endswith((b'EXISTS', b'RECENT'))
+
     # Fetch unread email from inbox
-    def get_unread_mail(self, e_client, inbox_name):
-        'Selects given inbox of given email client and returns unread emails'
-        e_client.select(inbox_name)                                 # select inbox
+    def get_unread_mail(self, e_client, inbox_name, reselect=True, batch=True):
+        ''' Selects given inbox of given email client and returns unread emails
+            + reselect=False reuses the inbox already selected (see mail_listener)
+            + batch=True fetches all unread emails with a single FETCH command;
+              batch=False fetches one message per round trip
+        '''
+        if reselect:
+            e_client.select(inbox_name)                             # select inbox
         unread_mail = e_client.search(None,'Unseen')[1]             # unread emails
         mail_ids = unread_mail[0].split()                           # email ids
+        if not mail_ids:
+            return []
+
+        start_timer = dt.datetime.now()
+        if batch:
+            result = self.fetch_mail(e_client, mail_ids)
+        else:
+            result = []
+            for id in mail_ids:
+                mail_item = e_client.fetch(id,'(BODY.PEEK[])')                  # get msg from email
+                result.append(self.parse_mail(id, mail_item[1][0][1]))
+        print('{now} -- [MAIL] Fetched {n} message(s) {how} [Latency: {runtime}]'.format(
+            now=now(),
+            n=len(result),
+            how='in batch ({})'.format(config.settings['mail']['fetch']) if batch else 'one per round trip',
+            runtime=dt.datetime.now() - start_timer,
+        ))
+        return result
+
+    # Fetch many messages in one command
+    def fetch_mail(self, e_client, ids, uid=False, mode=None):
+        ''' Fetch given message ids (UIDs if uid=True) and return mail_records
+            + 'full' mode: one FETCH of whole messages, parsed as responses stream in
+            + 'text' mode: see fetch_text()
+            Mode defaults to config.settings['mail']['fetch'].
+        '''
+        mode = mode or config.settings['mail']['fetch']
+        if mode == 'text':
+            return self.fetch_text(e_client, ids, uid=uid)
+        typ, data = self.fetch_command(e_client, uid)(sequence_set(ids).decode(), '(UID BODY.PEEK[])')
         result = []
-        for id in mail_ids:
-            mail_item = e_client.fetch(id,'(BODY.PEEK[])')                        # get msg from email
-            msg = email.message_from_string(mail_item[1][0][1].decode('utf-8'))   # convert to string
-            result.append({
-                'msg_id':id,
-                'datetime':pd.to_datetime(msg['received'].split('\r\n')[-1].strip()).astimezone(tz='US/Eastern'),
-                'from':msg['from'],
-                'to':msg['to'],
-                'subject':msg['subject'],
-                'body':msg.get_payload(),
-            })
+        for id, items in imap_parse(data):
+            if b'BODY[]' not in items:                              # unsolicited FETCH, e.g. '* n FETCH (FLAGS ...)'
+                continue
+            mail = self.parse_mail(id, items[b'BODY[]'])
+            mail.uid = int(items[b'UID'])
+            result.append(mail)
         return result
 
+    # Fetch headers and text only
+    def fetch_text(self, e_client, ids, uid=False, max_bytes=None):
+        ''' Fetch headers and the first text/plain part of each message, capped at
+            'max_bytes' (config.settings['mail']['text_max_bytes']).
+            MMS images and other attachments are never downloaded.
+            + 1 FETCH for BODYSTRUCTURE and headers of all messages
+            + 1 partial FETCH per distinct text section (usually just one)
+        '''
+        max_bytes = max_bytes or config.settings['mail']['text_max_bytes']
+        fetch = self.fetch_command(e_client, uid)
+        typ, data = fetch(sequence_set(ids).decode(), '(UID BODYSTRUCTURE BODY.PEEK[HEADER])')
+
+        heads, sections = {}, {}                                    # uid: (id, header, part) / section: [uid]
+        for id, items in imap_parse(data):
+            if b'BODYSTRUCTURE' not in items:                       # unsolicited FETCH, e.g. '* n FETCH (FLAGS ...)'
+                continue
+            part = text_part(items[b'BODYSTRUCTURE'])
+            heads[items[b'UID']] = (id, items[b'BODY[HEADER]'], part)
+            if part is not None:
+                sections.setdefault(part[0], []).append(items[b'UID'])
+
+        texts = {}
+        for section, uids in sections.items():
+            typ, data = self.fetch_command(e_client, True)(
+                sequence_set(uids).decode(), '(UID BODY.PEEK[{}]<0.{}>)'.format(section, max_bytes)
+            )
+            for id, items in imap_parse(data):
+                if b'UID' in items:
+                    texts[items[b'UID']] = items.get('BODY[{}]<0>'.format(section).encode())
+
+        result = []
+        for key, (id, header, part) in heads.items():
+            body = ''
+            if part is not None and texts.get(key) is not None:
+                body = decode_part(texts[key], encoding=part[1], charset=part[2])
+            mail = self.parse_mail(id, header, body=body)
+            mail.uid = int(key)
+            result.append(mail)
+        return result
+
+    @staticmethod
+    def fetch_command(e_client, uid):
+        'FETCH by UID or by sequence number'
+        if uid:
+            return lambda *args: e_client.uid('FETCH', *args)
+        return e_client.fetch
+
+    # Convert raw message into mail_record
+    def parse_mail(self, id, raw, body=None):
+        ''' Parse raw RFC 822 bytes of message id into a mail_record (single parse, no pandas)
+            + body: text already fetched separately -- 'raw' is then headers only
+        '''
+        msg = MAIL_PARSER.parsebytes(raw, headersonly=body is not None)
+        return mail_record(
+            msg_id=id,
+            message_id=msg['message-id'],
+            datetime=mail_datetime(msg),
+            sender=msg['from'],
+            to=msg['to'],
+            subject=msg['subject'],
+            body=mail_text(msg) if body is None else body,
+        )
+
+
+# Parsed email
+class mail_record:
+    ''' One email as handed to routing
+        + msg_id: IMAP sequence number (for STORE); uid: IMAP UID (mail_sync only)
+        + body: decoded text of the first text/plain part
+    '''
+    __slots__ = ('msg_id', 'uid', 'message_id', 'datetime', 'sender', 'to', 'subject', 'body')
+
+    def __init__(self, msg_id, message_id, datetime, sender, to, subject, body, uid=None):
+        self.msg_id = msg_id
+        self.uid = uid
+        self.message_id = message_id
+        self.datetime = datetime
+        self.sender = sender
+        self.to = to
+        self.subject = subject
+        self.body = body
+
+    def __repr__(self):
+        return 'mail_record(msg_id={!r}, uid={!r}, sender={!r}, subject={!r})'.format(
+            self.msg_id, self.uid, self.sender, self.subject
+        )
+
+def mail_text(msg):
+    'Decoded text of first text/plain part (whole payload if not multipart)'
+    for part in msg.walk():
+        if part.get_content_maintype() == 'multipart':
+            continue
+        if part.get_content_type() == 'text/plain' or not msg.is_multipart():
+            payload = part.get_payload(decode=True) or b''
+            return payload.decode(part.get_content_charset() or 'utf-8', 'replace')
+    return ''
+
+def mail_datetime(msg):
+    'Time the message was received (last hop of Received header, else Date), in US/Eastern'
+    stamp = msg['received'] or ''
+    stamp = stamp.rsplit(';', 1)[-1].strip() if ';' in stamp else msg['date']
+    try:
+        return email.utils.parsedate_to_datetime(stamp).astimezone(EASTERN)
+    except (TypeError, ValueError):
+        return None
+
+
+# Email connection manager
+class email_connections:
+    ''' Owns the app's IMAP client and SMTP server sessions
+        + imap() / smtp(): current live connection -- callers never log in themselves
+        + check(): one NOOP per connection; a dead one is replaced on the spot, so the
+          background task (APP.email_connect) pays the TLS handshake and login, not a command
+        + sendmail(): drop-in for smtplib.SMTP.sendmail, so routes are handed the manager;
+          a send that still finds the socket dead reconnects once and retries
+        + imap_lock: held by the mail loop while it uses IMAP (IDLE, fetch, store);
+          check() holds it only for the NOOP, never for a reconnect.  If the mail loop
+          holds it (IDLE), the probe is left due and the mail loop runs probe() once IDLE returns
+        + generation: bumped whenever IMAP is replaced; the mail loop then reselects the inbox
+        + Lock order: SMTP_LOCK may be held while taking reconnect_lock, never the reverse
+    '''
+    def __init__(self, e_client=None, e_server=None, factory=None):
+        self.factory = factory or email_server()
+        self.client = e_client
+        self.server = e_server
+        self.imap_lock = threading.Lock()
+        self.reconnect_lock = threading.Lock()      # one handshake at a time
+        self.generation = 0
+        self.probe_due = False                      # IMAP NOOP skipped by check() while in use
+        self.stats = {'checks':0, 'imap_reconnects':0, 'smtp_reconnects':0, 'reconnect_s':0.0}
+
+    # Live connections
+    def imap(self):
+        'IMAP client, connecting first if there is none'
+        return self.client if self.client is not None else self.reconnect('imap')
+
+    def smtp(self):
+        'SMTP server, connecting first if there is none'
+        return self.server if self.server is not None else self.reconnect('smtp')
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        'smtplib.SMTP.sendmail on the live server'
+        with SMTP_LOCK:
+            server = self.smtp()
+            try:
+                return server.sendmail(from_addr=from_addr, to_addrs=to_addrs, msg=msg)
+            except smtplib.SMTPServerDisconnected:
+                pass
+        self.reconnect('smtp', stale=server)
+        with SMTP_LOCK:
+            return self.smtp().sendmail(from_addr=from_addr, to_addrs=to_addrs, msg=msg)
+
+    # Health
+    @staticmethod
+    def alive(connection):
+        'NOOP round trip; False if the session is gone'
+        try:
+            if isinstance(connection, smtplib.SMTP):
+                return connection.noop()[0] == 250
+            return connection.noop()[0] == 'OK'
+        except Exception:
+            return False
+
+    def check(self):
+        'NOOP both connections; replace whichever is dead'
+        self.stats['checks'] += 1
+        with SMTP_LOCK:
+            server = self.server
+            smtp_alive = server is not None and self.alive(server)
+        if not smtp_alive:
+            self.reconnect('smtp', stale=server)
+        if not self.probe(blocking=False):                          # mail loop in IDLE -- it probes
+            self.probe_due = True                                   # once IDLE returns
+
+    def probe(self, blocking=True):
+        ''' NOOP IMAP under imap_lock; replace it if dead
+            + blocking=False: give up if the mail loop holds imap_lock; returns False then
+        '''
+        if not self.imap_lock.acquire(blocking=blocking):
+            return False
+        try:
+            self.probe_due = False
+            client = self.client
+            imap_alive = client is not None and self.alive(client)
+        finally:
+            self.imap_lock.release()
+        if not imap_alive:                                          # handshake outside imap_lock -- the
+            self.reconnect('imap', stale=client)                    # mail loop takes it on the event loop
+        return True
+
+    def reconnect(self, service, stale=None):
+        ''' Replace 'imap' or 'smtp' with a new session and close the old one
+            + stale: connection the caller found dead; if another thread already
+              replaced it, that replacement is returned instead of logging in again
+        '''
+        with self.reconnect_lock:
+            current = self.client if service == 'imap' else self.server
+            if current is not stale:
+                return current
+            start = time.perf_counter()
+            if service == 'imap':
+                self.client = connection = self.factory.connect_gmail()
+                self.generation += 1
+            else:
+                self.server = connection = self.factory.connect_smtp()
+            latency = time.perf_counter() - start
+            self.stats['{}_reconnects'.format(service)] += 1
+            self.stats['reconnect_s'] += latency
+
+        # Old session is closed after reconnect_lock is released: SMTP_LOCK waits for
+        # a send still using it, and is never taken while holding reconnect_lock
+        if service == 'smtp':
+            with SMTP_LOCK:
+                self.close(stale)
+        else:
+            self.close(stale)
+        print('{now} -- [EMAIL] Reconnected {service} [Latency: {latency:.3f}s]'.format(
+            now=now(), service=service.upper(), latency=latency,
+        ))
+        return connection
+
+    @staticmethod
+    def close(connection):
+        'Best-effort logout of a replaced session'
+        if connection is None:
+            return
+        try:
+            if isinstance(connection, smtplib.SMTP):
+                connection.quit()
+            else:
+                connection.logout()
+        except Exception:
+            pass
+
+    def close_all(self):
+        'Log out of both sessions'
+        self.close(self.client)
+        self.close(self.server)
+
+
+# Inbox listener
+class mail_listener:
+    ''' Decides when to look for new mail, keeping the inbox selected.
+        + 'idle' mode: blocks in IMAP IDLE and wakes only when the server
+          pushes EXISTS/RECENT (or on 'idle_timeout' to refresh IDLE)
+        + 'poll' mode: used when configured or when the server lacks IDLE;
+          sleeps 'poll_min' after mail arrives, doubling up to 'poll_max'
+          while the inbox stays quiet
+        Works with any imaplib-compatible client, including a local IMAP4 server.
+        + lock: held while in IDLE (email_connections.imap_lock)
+        + broken: set when IDLE hit a dead connection; the mail loop reconnects before reading
+        + A server that advertises IDLE but refuses it switches the listener to 'poll'
+    '''
+    def __init__(self, e_client, inbox_name='Inbox', settings=config.settings['mail'], lock=None):
+        self.e_client = e_client
+        self.settings = settings
+        self.lock = lock
+        self.broken = False
+        self.mode = 'poll'
+        if settings['listener'] == 'idle' and 'IDLE' in e_client.capabilities:
+            self.mode = 'idle'
+        self.interval = settings['poll_min']
+        e_client.select(inbox_name)                                 # select once, stay selected
+
+    def update(self, new_mail):
+        'Adapt poll interval to number of messages just read'
+        if new_mail:
+            self.interval = self.settings['poll_min']
+        else:
+            self.interval = min(self.interval * 2, self.settings['poll_max'])
+
+    async def wait(self):
+        'Wait until there may be new mail; IDLE runs in a worker thread so the event loop stays free'
+        if self.mode == 'poll':
+            await asyncio.sleep(self.interval)
+            return True
+        def idle():
+            with self.lock or contextlib.nullcontext():
+                return email_server().idle(self.e_client, self.settings['idle_timeout'], self.settings['idle_reply_timeout'])
+
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(None, idle)
+        except (imaplib.IMAP4.abort, OSError):
+            self.broken = True
+            return True     # mail loop reconnects, then reads
+        except imaplib.IMAP4.error:
+            self.mode = 'poll'                                      # IDLE refused; session still usable
+            return True
+
+
+# Incremental inbox sync
+class mail_sync:
+    ''' Returns only mail that arrived since the last processed message.
+        + 'uid' mode: keyed on UIDVALIDITY and the last processed UID, which is
+          persisted to 'mail_sync.json' so restarts resume where they left off.
+          Each poll asks only for 'UID n+1:*' -- cost grows with new mail, not inbox size.
+          With CONDSTORE the poll is 'UID FETCH n+1:* (UID MODSEQ) (CHANGEDSINCE modseq)'
+          so the server skips messages already seen at the last HIGHESTMODSEQ.
+        + 'unseen' mode: falls back to email_server.get_unread_mail() (\\Seen flag)
+        A message is committed once routed, even if its route failed, so a
+        failing command is never re-fetched in a loop.
+    '''
+    def __init__(self, e_client, inbox_name='Inbox', mode=config.settings['mail']['sync'],
+                 path=os.path.join(STATE_PATH, 'mail_sync.json')):
+        self.e_client = e_client
+        self.inbox_name = inbox_name
+        self.mode = mode
+        self.path = path
+        self.pending_modseq = None                                  # highest MODSEQ seen by last poll
+        if mode == 'uid':
+            self.condstore = 'CONDSTORE' in e_client.capabilities
+            self.state = self.load()
+            self.open_mailbox()
+
+    # Persisted state
+    def load(self):
+        'Load last processed UID for inbox'
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f).get(self.inbox_name, {})
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        'Write state atomically so a crash never leaves a torn file'
+        try:
+            with open(self.path, 'r') as f:
+                states = json.load(f)
+        except (OSError, ValueError):
+            states = {}
+        states[self.inbox_name] = self.state
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(states, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def open_mailbox(self):
+        'Select inbox and (re)seed high-water mark if UIDVALIDITY changed or no state exists'
+        self.e_client.select(self.inbox_name)
+        uidvalidity = int(self.e_client.response('UIDVALIDITY')[1][0])
+        if self.state.get('uidvalidity') != uidvalidity:
+            # Start from oldest unread message so nothing pending is lost,
+            # and nothing already read (old trades) is replayed
+            unseen = self.e_client.uid('SEARCH', None, 'UNSEEN')[1][0].split()
+            if unseen:
+                last_uid = min(int(uid) for uid in unseen) - 1
+            else:
+                last_uid = int(self.e_client.response('UIDNEXT')[1][0] or 1) - 1
+            self.state = {'uidvalidity':uidvalidity, 'last_uid':last_uid, 'modseq':None}
+            self.save()
+
+    # New mail
+    def get_new_mail(self):
+        'Return mail that arrived after the high-water mark'
+        if self.mode != 'uid':
+            return email_server().get_unread_mail(e_client=self.e_client, inbox_name=self.inbox_name, reselect=False)
+
+        last_uid = self.state['last_uid']
+        new_uids = [uid for uid in self.new_uids(last_uid) if uid > last_uid]   # 'n+1:*' always matches the newest message
+        if not new_uids:
+            return []
+
+        start_timer = dt.datetime.now()
+        result = email_server().fetch_mail(self.e_client, new_uids, uid=True)
+        result = [mail for mail in result if mail.uid > last_uid]
+        print('{now} -- [MAIL] Synced {n} message(s) after UID {uid} [Latency: {runtime}]'.format(
+            now=now(),
+            n=len(result),
+            uid=last_uid,
+            runtime=dt.datetime.now() - start_timer,
+        ))
+        return result
+
+    def new_uids(self, last_uid):
+        'UIDs at or above last_uid + 1 (one small round trip)'
+        if not self.condstore:
+            typ, data = self.e_client.uid('SEARCH', None, 'UID', '{}:*'.format(last_uid + 1))
+            return [int(uid) for uid in data[0].split()]
+
+        # CHANGEDSINCE also enables CONDSTORE for the session (RFC 7162)
+        changedsince = ''
+        if self.state.get('modseq') is not None:
+            changedsince = ' (CHANGEDSINCE {})'.format(self.state['modseq'])
+        typ, data = self.e_client.uid('FETCH', '{}:*'.format(last_uid + 1), '(UID MODSEQ)' + changedsince)
+        uids = []
+        for item in data:
+            if not item:
+                continue
+            uid = re.search(rb'UID (\d+)', item)
+            modseq = re.search(rb'MODSEQ \((\d+)\)', item)
+            if uid:
+                uids.append(int(uid.group(1)))
+            if modseq:
+                self.pending_modseq = max(self.pending_modseq or 0, int(modseq.group(1)))
+        return uids
+
+    def commit(self, mail):
+        'Advance high-water mark past routed mail and persist it'
+        if self.mode != 'uid' or not mail:
+            return
+        self.state['last_uid'] = max(self.state['last_uid'], max(m.uid for m in mail))
+        if self.pending_modseq is not None:
+            self.state['modseq'] = max(self.state['modseq'] or 0, self.pending_modseq)
+        self.save()
+
 
 # Custom application functions/processes
 class app_functions:
@@ -102,111 +871,124 @@ class app_functions:
         '!! Cant handle when holdings is empty df'
         '!! Make separate case for when there is no open positions'
         
-        # Get account information from RH
-        account_profile = r.profiles.load_account_profile()
-        portfolio = r.profiles.load_portfolio_profile()
-        holdings = rh.account.get_position.my_holdings()                        # all open positions
-
-        # Calculate portfolio aggregates
-        positions =         holdings['pos_$'].sum()
-        buying_power =      float(account_profile['buying_power'])
-        portfolio_value =   positions + buying_power                            # total portfolio $
-        daily_change =      (portfolio_value / 
-                             float(portfolio['adjusted_portfolio_equity_previous_close']) - 1
-                            ) * 100
-        cash_pct =          buying_power / portfolio_value                      # total cash %
-        pos_pct =           positions / portfolio_value                         # total positions %
-        pos_cost =          (holdings['pos_$'].sum() - holdings['r_$'].sum())   # total position cost
-        return_dollars =    holdings['r_$'].sum() 
-        return_pct =        (holdings['r_$'].sum() / pos_cost) * 100
-        aggregates = {
-            'daily_change':         daily_change.round(2),
-            'total_position_value': positions,
-            'total_buying_power':   buying_power,
-            'total_portfolio_value':portfolio_value,
-            'total_position_cost':  pos_cost,
-            'position_pct':         pos_pct*100,
-            'cash_pct':             cash_pct*100,
-            'return_$':             return_dollars,
-            'return_%':             return_pct
-        }
+        # Get account information from RH (fetched concurrently)
+        rh.SESSION.ensure()                                                     # renew token only if due
+        snapshot = rh.account.get_position.snapshot()
+        account_profile = snapshot['account_profile']
+        portfolio = snapshot['portfolio']
+        holdings = snapshot['holdings']                                         # all open positions (holdings_book)
+
+        # Calculate portfolio aggregates (one pass over the holdings columns)
+        aggregates = holdings.aggregates(
+            buying_power=float(account_profile['buying_power']),
+            previous_close=float(portfolio['adjusted_portfolio_equity_previous_close']),
+        )
         aggregates = {key:'{:,.2f}'.format(value) for key, value in aggregates.items()}
 
         # Construct email
-        path = os.path.join(TEMPLATE_PATH, 'current_holdings.html')
-        TEMPLATE = open(path,'r').read() 
         msg = MIMEText(
-            Environment().from_string(TEMPLATE).render(
-                h=holdings.round(2),
-                agg=aggregates,
+            templates().render(
+                'current_holdings.html',
+                **holdings_table(holdings, aggregates),
                 dt=dt.datetime.now().strftime('%Y-%m-%d  %H:%M:%S')[:-4],
             ), 
             'html'
         )
 
-        # Send email
+        # Send email (e_server: email_connections -- serializes sends, reconnects if dead)
+        email_bot = email_server().email_bot
         msg['Subject'] = '[Current]'
-        msg['From'] = email_server().email_bot
-        msg['To'] = email_server().email_bot
+        msg['From'] = email_bot
+        msg['To'] = email_bot
         e_server.sendmail(
-            from_addr=email_server().email_bot, 
-            to_addrs=email_server().email_bot, 
+            from_addr=email_bot, 
+            to_addrs=email_bot, 
             msg=msg.as_string()
         )
+        print('{now} -- [QUOTES] {stats}'.format(now=now(), stats=marketdata.stats()))   # shared cache hits/misses
 
 
     # Cancel all open orders
-    def cancel_orders():
-        'cancels all orders'
-        rh.orders.cancel_all_orders()
+    def cancel_orders(e_server=None):
+        ''' Cancels all orders (concurrently, see rh.orders.cancel_all_orders)
+            and texts back each order's outcome and the time-to-flat
+        '''
+        rh.SESSION.ensure()
+        result = rh.orders.cancel_all_orders()
+        if e_server is not None:
+            email_server().send_text(e_server, cancel_reply(result), subject='[Cancel]')
+        return result
 
 
     # Limit buy/sell
-    def equity_limit_order(COMMAND):
-        'Equity limit order'
-
-        # Parse order parameters from COMMAND
-        COMMAND = COMMAND.as_string().strip().split('\n')      
-        order_type = COMMAND[0].split(' ')
-        order_detail = COMMAND[1].split(' ')
-        order_params = {
-            'type':order_type[0].upper(),
-            'side':order_type[1].upper(),
-            'instrument':order_type[2].upper(),
-            'quantity':float(order_detail[0]),
-            'symbol':order_detail[1],
-        }
-
-        # Get market quote of stock
-        mkt_quote = r.stocks.get_stock_quote_by_symbol(order_params['symbol'])
-        mkt_price = float(mkt_quote['last_extended_hours_trade_price'])
-        mkt_dt = mkt_quote['updated_at']
-
-        # Adjust mkt price by MAX/MIN pct and place limit order
-        if   'MAX' in COMMAND: adj_di = 1        
-        elif 'MIN' in COMMAND: adj_di = -1
-        else:                  adj_di = 0
-        price_adjuster = order_detail[-2:]
-        adj_pct = float(price_adjuster[1]) / 100    #!!! PCT ADJUSTER (0.3 == 0.3%)
-        price_adjuster = (1 + (adj_di * adj_pct))   # adjust mkt price by limit pct
-        LIMIT_PRICE = mkt_price * price_adjuster    # calculate limit price
-
-        # What to do when MAX/MIN not provided; instead limitPrice is provided
-        # !! WIP
-        if adj_di == 0:
-            'LIMIT_PRICE = order_details[-1]'
-
-        # Send order to RH
-        rh.orders.equity.place_limit_order(
-            symbol=order_params['symbol'].lower(),
-            quantity=order_params['quantity'],
-            side=order_params['side'].lower(),
-            limitPrice=LIMIT_PRICE,
-        )
+    def equity_limit_order(ORDER, e_server=None):
+        'Equity limit order from an order_command parsed in Process_routes.py'
+        return app_functions.equity_limit_orders([ORDER], e_server)
+
+    # Batch of limit orders from one text
+    def equity_limit_orders(ORDERS, e_server=None):
+        ''' Equity limit orders, one per leg of a text (Process_commands.parse_orders)
+            + Quotes for every leg are prefetched in one bulk request
+            + Legs are submitted concurrently (config.settings['orders']['batch_workers'])
+            + Texts back one reply: each leg's limit price and order id, or why it failed
+        '''
+        start = time.perf_counter()
+
+        # Make sure the session will not expire mid-batch, then get market quotes
+        # of every MAX/MIN leg at once (shared quote cache, strict staleness budget)
+        rh.SESSION.ensure()
+        quoted = [ORDER.symbol for ORDER in ORDERS if ORDER.price_mode in commands.PRICE_MODES]
+        mkt_quotes = marketdata.stock_quotes(quoted, use='order') if quoted else {}
+
+        def place(ORDER):
+            leg = {'order':ORDER, 'limit_price':None, 'id':None, 'error':None}
+
+            # Adjust mkt price by MAX/MIN pct (0.3 == 0.3%), or use given limit price
+            if ORDER.price_mode in commands.PRICE_MODES:
+                mkt_quote = mkt_quotes.get(ORDER.symbol)
+                if mkt_quote is None:
+                    leg['error'] = 'no market quote'
+                    return leg
+                mkt_price = float(mkt_quote['last_extended_hours_trade_price'] or mkt_quote['last_trade_price'])
+                leg['limit_price'] = ORDER.limit_price(mkt_price)
+            else:
+                leg['limit_price'] = ORDER.price
+
+            # Send order to RH
+            try:
+                placed = rh.orders.equity.place_limit_order(
+                    symbol=ORDER.symbol.lower(),
+                    quantity=ORDER.quantity,
+                    side=ORDER.side.lower(),
+                    limitPrice=leg['limit_price'],
+                )
+            except Exception as error:
+                leg['error'] = repr(error)
+                return leg
+            if placed and placed.get('id'):
+                leg['id'] = placed['id']
+            else:
+                leg['error'] = (placed or {}).get('detail') or 'rejected'
+            return leg
+
+        workers = min(config.settings['orders']['batch_workers'], len(ORDERS))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            legs = list(pool.map(place, ORDERS))
+        latency = time.perf_counter() - start
+        print('{now} -- [ORDERS] {placed}/{n} placed [Latency: {latency:.3f}s]'.format(
+            now=now(), placed=sum(leg['id'] is not None for leg in legs), n=len(legs), latency=latency,
+        ))
+        if e_server is not None:
+            email_server().send_text(e_server, orders_reply(legs, latency), subject='[Orders]')
+        return legs
 
 
-    # Fetch all open orders (WIP)
-    def open_orders():
-        TRIGGER = ['ORDERS', 'OPEN ORDERS']
+    # Open orders
+    def open_orders(e_server):
+        'Texts back every open order (equity, options, crypto) from a shared, concurrent snapshot'
+        rh.SESSION.ensure()
+        snapshot = rh.orders.open_orders()
+        email_server().send_text(e_server, open_orders_reply(snapshot), subject='[Open]')
+        return snapshot
 
 # %%
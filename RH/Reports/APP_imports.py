@@ -0,0 +1,58 @@
+''' Deferred imports
+    + lazy_module: stand-in for a heavy module (pandas, numpy, jinja2, robin_stocks)
+      that is imported on first attribute access instead of at startup
+    + IMPORT_TIMES: seconds spent importing each deferred module, for startup reports
+    + preload(): import every deferred module now (config.settings['startup']['mode'] == 'eager')
+'''
+
+#%% Import packages
+import importlib
+import threading
+import time
+
+IMPORT_TIMES = {}       # module name: seconds to import
+_MODULES = []           # every lazy_module created
+_LOCK = threading.Lock()    # guards _MODULES and IMPORT_TIMES only -- never held while importing
+
+#%% Lazy module
+class lazy_module:
+    ''' Module imported on first use
+        + r = lazy_module('robin_stocks'); r.stocks.get_quotes(...) imports on that call
+        + Safe to touch from several threads at once (one import, timed once)
+        + One lock per instance: a deferred module may itself create and use
+          lazy_modules while it is being imported
+    '''
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+        with _LOCK:
+            _MODULES.append(self)
+
+    def load(self):
+        'Import (once) and return the real module'
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    with _LOCK:
+                        IMPORT_TIMES.setdefault(self._name, time.perf_counter() - start)   # first importer's time
+                    self.__dict__['_module'] = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.load(), attr, value)
+
+    def __repr__(self):
+        return '<lazy_module {!r} ({})>'.format(self._name, 'loaded' if self._module is not None else 'deferred')
+
+#%% Preload
+def preload():
+    'Import every deferred module now; returns {name: seconds}'
+    for module in list(_MODULES):
+        module.load()
+    return dict(IMPORT_TIMES)
@@ -5,7 +5,7 @@ import os
 import sys
 import logging
 
-log_folder = os.path.join(os.getcwd(),'RH','Log')
+log_folder = os.path.join(os.getcwd(),'RH','Reports','Log')
 
 class log:
 
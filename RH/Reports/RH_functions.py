@@ -11,11 +11,19 @@
 #%% Import packages      
 import os, sys
 import config as config
+from RH.Reports.APP_imports import lazy_module
+import RH.Reports.RH_marketdata as marketdata   # shared market/reference data
 
 import datetime as dt
-import pandas as pd
-import robin_stocks as r
+import pickle
+import threading
 import time
+np = lazy_module('numpy')                       # heavy imports -- deferred until first use
+pd = lazy_module('pandas')
+r = lazy_module('robin_stocks')
+rh_holdings = lazy_module('RH.Reports.RH_holdings') # columnar holdings engine (numpy)
+ratelimit = lazy_module('RH.Reports.RH_ratelimit')  # request limits/retries (requests)
+from concurrent.futures import Future, ThreadPoolExecutor
 
 #%% Now time
 def now():
@@ -23,6 +31,27 @@ def now():
     datetime = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     return datetime
 
+#%% Concurrent fetch
+def fetch_concurrently(calls, max_workers=None):
+    ''' Run independent no-argument calls in parallel threads.
+        + calls: {name: function}
+        + Returns ({name: result, or the exception it raised}, {name: seconds})
+        Wall time is roughly the slowest call instead of the sum of all calls.
+    '''
+    def timed(call):
+        start = time.perf_counter()
+        try:
+            result = call()
+        except Exception as error:
+            result = error
+        return result, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(calls)) as pool:
+        futures = {name:pool.submit(timed, call) for name, call in calls.items()}
+    results = {name:future.result()[0] for name, future in futures.items()}
+    timings = {name:future.result()[1] for name, future in futures.items()}
+    return results, timings
+
 #%% Connect to Robinhood application
 class app:
     ''' Robinhood connection-type processes
@@ -35,7 +64,174 @@ class app:
 
     # Connect to to Robinhood
     def connect_robinhood(self):
-        r.login(username=self.rh_user, password=self.rh_pw)        
+        'Session is valid after this returns: logs in, or refreshes only when needed (see session)'
+        SESSION.ensure(credentials=(self.rh_user, self.rh_pw))
+
+#%% Robinhood session
+class session:
+    ''' Robinhood OAuth session with token bookkeeping
+        + Tracks access token expiry; ensure() renews only when the token is within
+          'refresh_margin' seconds of expiry, or a request came back 401
+        + Renewal uses the refresh token (one POST) and falls back to a full
+          credential login (r.login) only if the refresh fails
+        + One lock: concurrent ensure() calls wait for the renewal already in
+          flight and reuse it -- only one login/refresh at a time
+        + stats: logins, refreshes, failures, 401s seen, coalesced waits, latencies
+        + Requests are rate limited and retried by RH_ratelimit (mounted by hook())
+    '''
+    def __init__(self, user_info=config.user_info, settings=config.settings['robinhood']):
+        self.credentials = (user_info['robinhood']['username'], user_info['robinhood']['password'])
+        self.expires_in = settings['expires_in']
+        self.refresh_margin = settings['refresh_margin']
+        self.lock = threading.Lock()
+        self.token = None               # {'token_type', 'access_token', 'refresh_token', 'device_token'}
+        self.expires_at = 0.0           # time.time() when access token expires
+        self.unauthorized = False       # set by a 401 response; next ensure() renews
+        self.generation = 0             # renewals so far; lets waiters see a renewal happened
+        self.hooked = False
+        self.stats = {
+            'logins':0, 'refreshes':0, 'refresh_failures':0, 'unauthorized':0, 'coalesced':0,
+            'login_s':0.0, 'refresh_s':0.0, 'last_refresh_s':None,
+        }
+
+    # State
+    def valid(self):
+        'Token present, not flagged by a 401, and not within refresh_margin of expiry'
+        return (self.token is not None and not self.unauthorized
+                and time.time() < self.expires_at - self.refresh_margin)
+
+    def seconds_to_refresh(self):
+        'Seconds until ensure() would renew (0 if it would now)'
+        if self.token is None or self.unauthorized:
+            return 0.0
+        return max(0.0, self.expires_at - self.refresh_margin - time.time())
+
+    def metrics(self):
+        'stats plus averages and token lifetime left'
+        stats = dict(self.stats)
+        stats['login_avg_s'] = stats['login_s'] / stats['logins'] if stats['logins'] else None
+        stats['refresh_avg_s'] = stats['refresh_s'] / stats['refreshes'] if stats['refreshes'] else None
+        stats['expires_in_s'] = max(0.0, self.expires_at - time.time()) if self.token else None
+        stats['throttled'] = ratelimit.LIMITER.stats()['throttled'] if self.hooked else 0
+        return stats
+
+    # Renewal
+    def ensure(self, credentials=None):
+        ''' Make sure the session is usable; renew if needed (thread-safe)
+            + Cheap when the token is valid: no lock, no request
+        '''
+        if self.valid():
+            return
+        generation = self.generation
+        with self.lock:
+            if self.generation != generation and self.valid():     # renewed while we waited
+                self.stats['coalesced'] += 1
+                return
+            if self.valid():
+                return
+            if credentials is not None:
+                self.credentials = credentials
+            self.hook()
+            if not (self.token is not None and self.token.get('refresh_token') and self.refresh()):
+                self.login()
+            self.unauthorized = False
+            self.generation += 1
+
+    def login(self):
+        'Full credential login (caller holds lock)'
+        start = time.perf_counter()
+        data = r.login(username=self.credentials[0], password=self.credentials[1], expiresIn=self.expires_in)
+        latency = time.perf_counter() - start
+        self.stats['logins'] += 1
+        self.stats['login_s'] += latency
+        self.token = {
+            'token_type':data.get('token_type', 'Bearer'),
+            'access_token':data.get('access_token'),
+            'refresh_token':data.get('refresh_token'),
+            'device_token':self.device_token(),
+        }
+        if 'using authentication' in (data.get('detail') or ''):       # restored from pickle -- age unknown
+            self.expires_at = time.time()                               # refresh on next ensure()
+        else:
+            self.expires_at = time.time() + float(data.get('expires_in') or self.expires_in)
+        print('{now} -- [RH SESSION] Logged in [Latency: {latency:.3f}s] [Logins: {n}]'.format(
+            now=now(), latency=latency, n=self.stats['logins'],
+        ))
+
+    def refresh(self):
+        'Refresh-token grant; True on success (caller holds lock)'
+        start = time.perf_counter()
+        payload = {
+            'client_id':ROBINHOOD_CLIENT_ID,
+            'grant_type':'refresh_token',
+            'refresh_token':self.token['refresh_token'],
+            'scope':'internal',
+            'expires_in':self.expires_in,
+        }
+        if self.token.get('device_token'):
+            payload['device_token'] = self.token['device_token']
+        data = r.helper.request_post(r.urls.login_url(), payload)
+        latency = time.perf_counter() - start
+        if not data or 'access_token' not in data:
+            self.stats['refresh_failures'] += 1
+            print('{now} -- [RH SESSION] Refresh failed, logging in [Latency: {latency:.3f}s]'.format(
+                now=now(), latency=latency,
+            ))
+            return False
+        self.token.update({
+            'token_type':data.get('token_type', self.token['token_type']),
+            'access_token':data['access_token'],
+            'refresh_token':data.get('refresh_token', self.token['refresh_token']),
+        })
+        self.expires_at = time.time() + float(data.get('expires_in') or self.expires_in)
+        r.helper.update_session('Authorization', '{} {}'.format(self.token['token_type'], self.token['access_token']))
+        r.helper.set_login_state(True)
+        self.store()
+        self.stats['refreshes'] += 1
+        self.stats['refresh_s'] += latency
+        self.stats['last_refresh_s'] = latency
+        print('{now} -- [RH SESSION] Refreshed token [Latency: {latency:.3f}s] [Expires in: {left:.0f}s]'.format(
+            now=now(), latency=latency, left=self.expires_at - time.time(),
+        ))
+        return True
+
+    # robin_stocks token file (~/.tokens/robinhood.pickle) -- kept in sync so restarts reuse the token
+    def device_token(self):
+        'Device token robin_stocks logged in with (needed for refresh grant)'
+        try:
+            with open(TOKEN_PATH, 'rb') as f:
+                return pickle.load(f).get('device_token')
+        except Exception:
+            return None
+
+    def store(self):
+        'Write refreshed tokens where r.login() looks for them'
+        try:
+            with open(TOKEN_PATH, 'wb') as f:
+                pickle.dump(self.token, f)
+        except OSError:
+            pass
+
+    # 401 watch, request limits
+    def hook(self):
+        ''' Watch every robin_stocks response for 401 (robin_stocks swallows HTTP errors)
+            and send every request through the shared rate limiter
+        '''
+        if not self.hooked:
+            ratelimit.install(r.helper.SESSION)
+            r.helper.SESSION.hooks['response'].append(self.observe)
+            self.hooked = True
+
+    def observe(self, response, *args, **kwargs):
+        'requests response hook: flag the session on 401 so the next ensure() renews'
+        if response.status_code == 401 and 'oauth2/token' not in response.url:
+            self.unauthorized = True
+            self.stats['unauthorized'] += 1
+        return response
+
+ROBINHOOD_CLIENT_ID = 'c82SH0WZOsabOXGP2sxqcj34FxkvfnWRZBKlBjFS'    # robin_stocks' OAuth client id
+TOKEN_PATH = os.path.join(os.path.expanduser('~'), '.tokens', 'robinhood.pickle')
+SESSION = session()     # shared by every Robinhood call in the app
 
 #%% Account information
 class account:
@@ -45,7 +241,7 @@ class account:
     # Open positions
     class get_position:
         ''' Return df of open positions in individual or aggregate asset classes.
-            + my_holdings() --- aggregate
+            + my_holdings() --- aggregate (holdings_book)
         '''
         def buying_power():
             'not in use -- delete'
@@ -54,13 +250,34 @@ class account:
             return buying_power
 
         def equity():
+            ''' Open stock positions, priced from the shared stock quote cache
+                + Symbols come from instruments() -- no network calls when warm
+                + All quotes in one request, or none within the 'report' staleness
+                  budget (marketdata.stock_quotes)
+                + percent_change is against average buy price, as in r.account.build_holdings()
+            '''
             # Fetch positions from RH
-            positions = r.account.build_holdings()     
+            positions = [p for p in r.account.get_open_stock_positions() or [] if p]
+            stocks = marketdata.instruments().stocks([p['instrument'] for p in positions])
+            symbols = [stocks[p['instrument']]['symbol'] for p in positions]
+            quotes = marketdata.stock_quotes(symbols, use='report')
 
             # Open stock positions
-            result = [positions[p] for p in positions]
-            result = pd.DataFrame(result)
-            result.insert(0,'symbol',positions.keys())
+            rows = []
+            for position, symbol in zip(positions, symbols):
+                quote = quotes[symbol]
+                price = float(quote['last_extended_hours_trade_price'] or quote['last_trade_price'])
+                cost = float(position['average_buy_price'])
+                quantity = float(position['quantity'])
+                rows.append({
+                    'symbol':symbol,
+                    'price':price,
+                    'quantity':quantity,
+                    'average_buy_price':cost,
+                    'equity':price * quantity,
+                    'percent_change':(price - cost) * 100 / cost if cost else 0.0,
+                })
+            result = pd.DataFrame(rows, columns=['symbol', 'price', 'quantity', 'average_buy_price', 'equity', 'percent_change'])
             result = result.sort_values(by='symbol').reset_index(drop=True)
             return result
 
@@ -73,9 +290,9 @@ class account:
             result = result.set_index('chain_symbol').reset_index()   # workaround for moving chain_symbol to first column
             result = result.sort_values(by='chain_symbol').reset_index(drop=True)
 
-            # Mkt quote of position        
-            mkt_quote = r.options.get_option_market_data_by_id(id=result.option_id[0])        # get mkt data for specific option
-            mkt_quote = pd.DataFrame([mkt_quote])            
+            # Mkt quote of each position -- batched, aligned row-for-row with result
+            mkt_quote = marketdata.option_quotes(result.option_id)
+            mkt_quote = pd.DataFrame.from_dict(mkt_quote, orient='index').reindex(result.option_id).reset_index(drop=True)
             return result, mkt_quote
 
         def crypto():
@@ -88,116 +305,130 @@ class account:
             result.insert(0,'symbol', symbols)
             result = result.sort_values(by='symbol').reset_index(drop=True)
         
-            # Mkt quote of position
-            mkt_quote = [r.crypto.get_crypto_quote(symbol=s) for s in result.symbol]
-            mkt_quote = pd.DataFrame(mkt_quote)
+            # Mkt quote of position -- fetched concurrently, shared for a few seconds
+            mkt_quote = marketdata.crypto_quotes(result.symbol)
+            mkt_quote = pd.DataFrame([mkt_quote[s] for s in result.symbol])
 
             return result, mkt_quote
 
-        def my_holdings():
-            'Return df of open positions, all asset class'        
-            portfolio_value = float(r.account.build_user_profile()['equity'])
+        def my_holdings(fetched=None):
+            ''' Return holdings_book of open positions, all asset class
+                + fetched: results of fetch_concurrently() for 'user_profile', 'equity',
+                  'options' and 'crypto'; fetched in parallel here when not given
+                + A failed asset class is left out; the others are still returned
+                + Each column is converted to float once; pos_% is set in one pass
+                  over the combined book (.frame() for a DataFrame)
+            '''
+            if fetched is None:
+                fetched, timings = fetch_concurrently({
+                    'user_profile':r.account.build_user_profile,
+                    'equity':account.get_position.equity,
+                    'options':account.get_position.options,
+                    'crypto':account.get_position.crypto,
+                })
+
+            def leg(name):
+                'Fetched result of leg; re-raise its error so the asset class is skipped'
+                if isinstance(fetched[name], Exception):
+                    raise fetched[name]
+                return fetched[name]
+
+            portfolio_value = float(leg('user_profile')['equity'])
 
             def equity():
-                equities = account.get_position.equity()            # custom function
-                cost = equities.average_buy_price.astype(float)
-                price = equities.price.astype(float)
-                quantity = equities.quantity.astype(float)
-                result = {
-                    'symbol':equities.symbol,
+                equities = leg('equity')                            # custom function
+                cost = rh_holdings.floats(equities.average_buy_price)
+                price = rh_holdings.floats(equities.price)
+                return rh_holdings.holdings_book.build(equities.symbol, 'equity', {
                     'price':price,
-                    'quantity':quantity,
-                    'pct_change':equities.percent_change.astype(float),
-                    'inst':'equity',
+                    'quantity':rh_holdings.floats(equities.quantity),
+                    'pct_change':rh_holdings.floats(equities.percent_change),
                     'cost':cost,
-                    'pos_$':equities.equity.astype(float),
-                    'pos_%':(equities.equity.astype(float) / portfolio_value)*100,
+                    'pos_$':rh_holdings.floats(equities.equity),
                     'r_$':price - cost,
                     'r_%':(price / cost - 1) * 100,
-                }
-                result = pd.DataFrame(result).sort_values(by='symbol')
-                return result
-            
-            def options():
-                options, mkt_quote = account.get_position.options()
-                price = mkt_quote.adjusted_mark_price.astype(float)     # price per shae
-                cost = options.average_price.astype(float) / 100        # cost per share
-                quantity = options.quantity.astype(float)
-
-                # Get options detail
-                option_id = options.option_id
-                option_side = options.type
-                option_type, option_strike = [], []
-                
-                # Get option inst
-                for x in option_id:
-                    detail = r.options.get_option_instrument_data_by_id(x)
-                    option_type.append(detail['type'])
-                    option_strike.append(float(detail['strike_price']))
-                option_detail = {
-                    'option_strike':option_strike,
-                    'option_side': option_side,
-                    'option_type': option_type,
-                }
-                inst = []
-                for x, strike in enumerate(option_detail['option_strike']):
-                    inst.append(
-                        '{strike} {side}{type}'.format(
-                            strike=int(strike),
-                            side=option_detail['option_side'][x][0],
-                            type=option_detail['option_type'][x][0].upper(),
-                        )
-                    )
+                })
 
-                # Results
-                result = {
-                    'symbol':options.chain_symbol,
-                    'inst':inst,                   # call / put options
+            def options():
+                options, mkt_quote = leg('options')
+                price = rh_holdings.floats(mkt_quote.adjusted_mark_price)       # price per share
+                cost = rh_holdings.floats(options.average_price) / 100          # cost per share
+                quantity = rh_holdings.floats(options.quantity)
+
+                # Get option inst, e.g. '150 LC' (bulk, cached across restarts)
+                details = marketdata.instruments().options(options.option_id)
+                details = [details[x] for x in options.option_id]
+                strike = rh_holdings.floats([d['strike_price'] for d in details]).astype(int).astype(str)
+                side = np.asarray(options.type, dtype='U1')                                 # first letter
+                kind = np.char.upper(np.asarray([d['type'] for d in details], dtype='U1'))  # first letter
+                inst = np.char.add(np.char.add(strike, ' '), np.char.add(side, kind))
+
+                return rh_holdings.holdings_book.build(options.chain_symbol, inst, {
                     'price':price,
-                    'pct_change':(price / mkt_quote.previous_close_price.astype(float) - 1) * 100,
                     'quantity':quantity,
+                    'pct_change':(price / rh_holdings.floats(mkt_quote.previous_close_price) - 1) * 100,
+                    'cost':cost,
                     'pos_$':price * 100 * quantity,
-                    'pos_%':((price * 100 * quantity) / portfolio_value) * 100,
-                    'r_$':(price - cost)*100 * quantity,
+                    'r_$':(price - cost) * 100 * quantity,
                     'r_%':(price / cost - 1) * 100,
-                    'cost': cost,
-                }
-                result = pd.DataFrame(result)
-                return result
+                }, sort=False)                                      # already sorted by chain_symbol
 
             def crypto():
-                crypto, mkt_quote = account.get_position.crypto()
-                price = mkt_quote.mark_price.astype(float)
-                prior_price = mkt_quote.open_price.values.astype(float)
-                cost = [float(cost_bases[0]['direct_cost_basis']) for cost_bases in crypto.cost_bases]
-                quantity = crypto.quantity.astype(float)
-                result = {
-                    'symbol':crypto.symbol,
+                crypto, mkt_quote = leg('crypto')
+                price = rh_holdings.floats(mkt_quote.mark_price)
+                quantity = rh_holdings.floats(crypto.quantity)
+                cost = np.fromiter((cost_bases[0]['direct_cost_basis'] for cost_bases in crypto.cost_bases), float, len(crypto))
+                value = price * quantity                            # adjust crypto price by fractional shares
+                return rh_holdings.holdings_book.build(crypto.symbol, 'crypto', {
                     'price':price,
-                    'pct_change':(price / prior_price - 1) * 100,
                     'quantity':quantity,
-                    'pos_$':price * quantity,
-                    'pos_%':((price* quantity) / portfolio_value) * 100,
-                    'r_$':(price * quantity) - cost,                        # adjust crypto price by fractional shares
-                    'r_%':((price * quantity) / cost - 1) * 100,            # adjust crypto price by fractional shares
-                    'cost': cost,
-                    'inst':'crypto',                  
-                }
-                result = pd.DataFrame(result).sort_values(by='symbol')
-                result = result.dropna(subset=['r_%'])          
-                return result
-
-            # Combine tables of equity, options, and crypto
+                    'pct_change':(price / rh_holdings.floats(mkt_quote.open_price) - 1) * 100,
+                    'cost':cost,
+                    'pos_$':value,
+                    'r_$':value - cost,
+                    'r_%':(value / cost - 1) * 100,
+                }, dropna='r_%')
+
+            # Combine equity, options, and crypto (a failed class is named, not hidden)
             result = []
-            try:    result.append(equity())
-            except: pass
-            try:    result.append(options())
-            except: pass
-            try:    result.append(crypto())
-            except: pass  
-            result = pd.concat(result).reset_index(drop=True)
-            return result    
-#account.get_position.my_holdings().round(2)
+            for name, build in [('equity', equity), ('options', options), ('crypto', crypto)]:
+                try:
+                    result.append(build())
+                except Exception as error:
+                    print('{now} -- [HOLDINGS] {name} left out: {error!r}'.format(now=now(), name=name, error=error))
+            return rh_holdings.holdings_book.concat(result).weigh(portfolio_value)
+
+        def snapshot():
+            ''' Concurrent holdings snapshot for reports
+                + Fetches user, account and portfolio profiles plus equity, options and
+                  crypto positions in parallel, then builds my_holdings() from them
+                + Returns dict: holdings, account_profile, portfolio, timings (seconds per leg)
+            '''
+            start = time.perf_counter()
+            fetched, timings = fetch_concurrently({
+                'user_profile':r.account.build_user_profile,
+                'account_profile':r.profiles.load_account_profile,
+                'portfolio':r.profiles.load_portfolio_profile,
+                'equity':account.get_position.equity,
+                'options':account.get_position.options,
+                'crypto':account.get_position.crypto,
+            })
+            for name in ['account_profile', 'portfolio']:           # report cannot be built without these
+                if isinstance(fetched[name], Exception):
+                    raise fetched[name]
+            holdings = account.get_position.my_holdings(fetched=fetched)
+            timings['total'] = time.perf_counter() - start
+            print('{now} -- [SNAPSHOT] {legs}'.format(
+                now=now(),
+                legs=', '.join('{} {:.3f}s'.format(name, sec) for name, sec in timings.items()),
+            ))
+            return {
+                'holdings':holdings,
+                'account_profile':fetched['account_profile'],
+                'portfolio':fetched['portfolio'],
+                'timings':timings,
+            }
+#account.get_position.my_holdings().frame().round(2)
 #account.get_position.buying_power()
 
 
@@ -240,29 +471,33 @@ class orders:
 
         # Place limit order
         def place_limit_order(symbol, quantity, limitPrice, side, **kwargs):
-
+            'Returns Robinhood order dict (has "id" when accepted, "detail" when rejected)'
+            order = None
             if side.lower() == 'buy':
-                r.orders.order_buy_limit(
+                order = r.orders.order_buy_limit(
                     symbol=symbol,
                     quantity=quantity,
                     limitPrice=limitPrice,
                     timeInForce=kwargs.get('timeInForce','gtc'),
                 )
             if side.lower() == 'sell':
-                r.orders.order_sell_limit(
+                order = r.orders.order_sell_limit(
                     symbol=symbol,
                     quantity=quantity,
                     limitPrice=limitPrice,
                     timeInForce=kwargs.get('timeInForce','gtc'),
                 )
+            ORDER_BOOK.invalidate()                         # open orders changed
+            return order
         
         # Open equity orders
         def open_orders():
             'Returns raw return of all outstanding stock order'
             open_orders = r.orders.get_all_open_stock_orders()    
             open_orders = pd.DataFrame(open_orders)
+            instruments = marketdata.instruments().stocks(open_orders.instrument)    # bulk, cached
             symbols = [
-                r.stocks.get_instrument_by_url(order)['symbol'] for order in open_orders.instrument
+                instruments[order]['symbol'] for order in open_orders.instrument
             ]
             open_orders.insert(0,'symbol',symbols)
             return open_orders
@@ -359,10 +594,12 @@ class orders:
             '''
 
         # Open options orders
-        # !! WIP
         def open_orders():
-            open_orders = r.options.get_open_option_positions()
-            
+            'Returns raw return of all outstanding option orders'
+            open_orders = r.orders.get_all_open_option_orders()
+            open_orders = pd.DataFrame(open_orders)
+            return open_orders
+
         # Cancel all options orders
         def cancel_all_orders():
             'check if this should be threaded'
@@ -428,13 +665,210 @@ class orders:
             r.orders.cancel_all_crypto_orders()            
             print('{} -- All stock orders canceled'.format(now()))
 
+    # Open orders -- all asset classes
+    def open_orders(max_age=None):
+        ''' Snapshot of every open order: equity, options and crypto
+            + Shared for max_age seconds (config.settings['orders']['open_orders_ttl']);
+              callers arriving while it is being fetched wait for that fetch
+            + Cancels and new orders invalidate it, including a fetch already in flight
+            + Returns dict (see order_book_snapshot): orders, list_errors, timings, latency
+        '''
+        if max_age is None:
+            max_age = config.settings['orders']['open_orders_ttl']
+        return ORDER_BOOK.get(max_age)
+
     # Cancel all orders
-    def cancel_all_orders():
-        'Clear out order book'
-        orders.equity.cancel_all_orders()
-        orders.options.cancel_all_orders()
-        orders.crypto.cancel_all_orders()
-        
+    def cancel_all_orders(max_workers=None):
+        ''' Clear out order book as fast as possible (time-to-flat)
+            + Open equity, options and crypto orders are listed concurrently
+            + Every cancel is posted at once on a bounded pool
+              (config.settings['orders']['cancel_workers'])
+            + Returns dict:
+                - outcomes: one order_row per order, plus ok and error
+                - canceled, failed: counts
+                - list_errors: {asset: error} for asset classes that could not be listed
+                - timings: seconds to list each asset class
+                - time_to_flat: seconds from start until the last cancel answered
+        '''
+        start = time.perf_counter()
+        listed, timings = fetch_concurrently({
+            asset:getattr(r.orders, function) for asset, function in OPEN_ORDERS.items()
+        })
+
+        # One job per open order that can still be canceled
+        jobs, list_errors = [], {}
+        for asset, result in listed.items():
+            if isinstance(result, Exception):
+                list_errors[asset] = repr(result)
+                continue
+            for order in result or []:
+                cancel_url = order.get('cancel') or order.get('cancel_url')
+                if cancel_url:
+                    jobs.append((asset, order, cancel_url))
+
+        def cancel(job):
+            asset, order, cancel_url = job
+            try:
+                response = r.helper.request_post(cancel_url, jsonify_data=False)
+            except Exception as error:                      # one failed cancel must not hide the others
+                return dict(order_row(asset, order), ok=False, error=repr(error))
+            ok = response is not None and response.status_code < 300
+            return dict(
+                order_row(asset, order),
+                ok=ok,
+                error=None if ok else ('no response' if response is None else 'HTTP {}'.format(response.status_code)),
+            )
+
+        outcomes = []
+        workers = max_workers or config.settings['orders']['cancel_workers']
+        if jobs:
+            with ThreadPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+                outcomes.extend(pool.map(cancel, jobs))
+        time_to_flat = time.perf_counter() - start
+        ORDER_BOOK.invalidate()
+        name_orders(outcomes)                               # after the book is flat
+
+        result = {
+            'outcomes':outcomes,
+            'canceled':sum(o['ok'] for o in outcomes),
+            'failed':sum(not o['ok'] for o in outcomes),
+            'list_errors':list_errors,
+            'timings':timings,
+            'time_to_flat':time_to_flat,
+        }
+        print('{now} -- [CANCEL] {canceled} canceled, {failed} failed [Time to flat: {flat:.3f}s]'.format(
+            now=now(), canceled=result['canceled'], failed=result['failed'], flat=time_to_flat,
+        ))
+        return result
+
+#%% Order book
+# Open-order listing per asset class (robin_stocks.orders functions)
+OPEN_ORDERS = {
+    'equity':'get_all_open_stock_orders',
+    'options':'get_all_open_option_orders',
+    'crypto':'get_all_open_crypto_orders',
+}
+
+def order_row(asset, order):
+    'Common fields of a raw equity/option/crypto order'
+    return {
+        'asset':asset,
+        'id':order.get('id'),
+        'symbol':order.get('chain_symbol') or order.get('symbol'),    # options carry chain_symbol
+        'side':order.get('side') or order.get('direction') or '',      # options: debit | credit
+        'quantity':order.get('quantity') or '',
+        'price':order.get('price') or '',
+        'type':order.get('type') or '',
+        'state':order.get('state') or '',
+        'instrument':order.get('instrument'),                           # equity: instrument url
+        'pair':order.get('currency_pair_id'),                           # crypto: currency pair id
+    }
+
+def name_orders(rows):
+    ''' Fill in missing symbols from caches, in bulk
+        + equity: instrument url -> symbol (instrument_store; no request when warm)
+        + crypto: currency pair id -> 'BTC-USD' (crypto_pairs; loaded once)
+    '''
+    urls = [row['instrument'] for row in rows if not row['symbol'] and row['instrument']]
+    pairs = [row['pair'] for row in rows if not row['symbol'] and row['pair']]
+    try:
+        instruments = marketdata.instruments().stocks(urls) if urls else {}
+        crypto = marketdata.crypto_pairs(pairs) if pairs else {}
+    except Exception:
+        return rows                                         # symbols are cosmetic -- keep ids
+    for row in rows:
+        if not row['symbol']:
+            if row['instrument'] in instruments:
+                row['symbol'] = instruments[row['instrument']]['symbol']
+            elif row['pair'] in crypto:
+                row['symbol'] = crypto[row['pair']]
+    return rows
+
+def order_book_snapshot():
+    ''' Every open order, listed concurrently across asset classes
+        + Symbols come from caches, so latency is about one listing round trip
+          whatever the number of open orders
+        + Returns dict: orders (order_row each), list_errors, timings, latency
+    '''
+    start = time.perf_counter()
+    listed, timings = fetch_concurrently({
+        asset:getattr(r.orders, function) for asset, function in OPEN_ORDERS.items()
+    })
+    rows, list_errors = [], {}
+    for asset, result in listed.items():
+        if isinstance(result, Exception):
+            list_errors[asset] = repr(result)
+            continue
+        rows.extend(order_row(asset, order) for order in result or [])
+    name_orders(rows)
+    return {
+        'orders':rows,
+        'list_errors':list_errors,
+        'timings':timings,
+        'latency':time.perf_counter() - start,
+    }
+
+class order_book:
+    ''' Open-order snapshot shared for a few seconds
+        + get(max_age): cached snapshot if fresh, else one fetch -- callers arriving
+          meanwhile wait for it instead of listing again
+        + invalidate(): after a cancel or new order; bumps the generation, so the
+          cached snapshot is dropped and a fetch already in flight (started before
+          the change) is handed to its own callers but never cached or shared
+        + stats: hits / misses / coalesced / discarded (in-flight fetches outdated)
+    '''
+    def __init__(self, fetch=order_book_snapshot):
+        self.fetch = fetch
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.cached = None              # (snapshot, fetched_at, generation)
+        self.pending = None             # (Future, generation) of fetch in flight
+        self.stats = {'hits':0, 'misses':0, 'coalesced':0, 'discarded':0}
+
+    def get(self, max_age):
+        'Snapshot no older than max_age seconds (fetched now if there is none)'
+        started = time.monotonic()
+        with self.lock:
+            generation = self.generation
+            if self.cached is not None and self.cached[2] == generation and started - self.cached[1] <= max_age:
+                self.stats['hits'] += 1
+                return self.cached[0]
+            if self.pending is not None and self.pending[1] == generation:
+                self.stats['coalesced'] += 1
+                waiting = self.pending[0]
+            else:
+                self.stats['misses'] += 1
+                waiting, mine = None, Future()
+                self.pending = (mine, generation)
+        if waiting is not None:
+            return waiting.result()
+
+        try:
+            snapshot = self.fetch()
+        except Exception as error:
+            with self.lock:
+                if self.pending is not None and self.pending[0] is mine:
+                    self.pending = None
+            mine.set_exception(error)
+            raise
+        with self.lock:
+            if self.pending is not None and self.pending[0] is mine:
+                self.pending = None
+            if generation == self.generation:
+                self.cached = (snapshot, started, generation)   # age counts from request start
+            else:
+                self.stats['discarded'] += 1
+        mine.set_result(snapshot)
+        return snapshot
+
+    def invalidate(self):
+        'Open orders changed: drop cached snapshot and outdate any fetch in flight'
+        with self.lock:
+            self.generation += 1
+            self.cached = None
+
+ORDER_BOOK = order_book()
+
 #orders.stock.cancel_all_orders()
 #orders.crypto.place_order(symbol='BTC', by='amount', by_value=0.1, side='buy')
 #orders.crypto.cancel_all_orders()
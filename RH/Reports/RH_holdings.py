@@ -0,0 +1,112 @@
+''' Columnar holdings engine
+    + holdings_book: one NumPy float matrix (positions x FIELDS) plus a
+      symbol/instrument index, instead of one DataFrame per asset class
+    + Asset classes are converted to floats once, combined with one concatenate,
+      and weighted/aggregated in single vectorized passes
+    + frame() gives the familiar DataFrame for interactive use
+'''
+
+#%% Import packages
+import numpy as np
+
+FIELDS = ('price', 'quantity', 'pct_change', 'cost', 'pos_$', 'pos_%', 'r_$', 'r_%')        # float columns
+COLUMNS = ['symbol', 'price', 'quantity', 'pct_change', 'inst', 'cost', 'pos_$', 'pos_%', 'r_$', 'r_%']  # report order
+FIELD = {name:i for i, name in enumerate(FIELDS)}
+
+#%% Helpers
+def floats(values):
+    'Float array from a column of numbers or numeric strings (None -> nan)'
+    return np.asarray(values, dtype=object).astype(float)
+
+#%% Holdings book
+class holdings_book:
+    ''' Open positions of all asset classes
+        + symbol, inst: object arrays (n,)
+        + values: float64 array (n, len(FIELDS)); column(name) is a view
+    '''
+    __slots__ = ('symbol', 'inst', 'values')
+    columns = COLUMNS
+
+    def __init__(self, symbol, inst, values):
+        self.symbol = symbol
+        self.inst = inst
+        self.values = values
+
+    def __len__(self):
+        return len(self.symbol)
+
+    def column(self, name):
+        'Float column by name (view, not a copy)'
+        return self.values[:, FIELD[name]]
+
+    # Build
+    @classmethod
+    def build(cls, symbol, inst, fields, sort=True, dropna=None):
+        ''' One asset class from already-float columns
+            + fields: {name: array} for every FIELDS entry except 'pos_%' (see weigh())
+            + inst: str for the whole class, or one per position
+            + sort: order by symbol; dropna: field whose nan rows are dropped
+        '''
+        symbol = np.asarray(symbol, dtype=object)
+        n = len(symbol)
+        values = np.full((n, len(FIELDS)), np.nan)
+        for name, column in fields.items():
+            values[:, FIELD[name]] = column
+        inst = np.full(n, inst, dtype=object) if isinstance(inst, str) else np.asarray(inst, dtype=object)
+        keep = np.arange(n)
+        if dropna is not None:
+            keep = keep[~np.isnan(values[:, FIELD[dropna]])]
+        if sort:
+            keep = keep[np.argsort(symbol[keep], kind='stable')]
+        return cls(symbol[keep], inst[keep], values[keep])
+
+    @classmethod
+    def concat(cls, books):
+        'Combine asset classes in one copy'
+        if not books:
+            return cls(np.empty(0, dtype=object), np.empty(0, dtype=object), np.empty((0, len(FIELDS))))
+        return cls(
+            np.concatenate([b.symbol for b in books]),
+            np.concatenate([b.inst for b in books]),
+            np.concatenate([b.values for b in books]),
+        )
+
+    # Vectorized passes
+    def weigh(self, portfolio_value):
+        'Set pos_% (position value as % of portfolio_value) for every position at once'
+        self.values[:, FIELD['pos_%']] = self.values[:, FIELD['pos_$']] / portfolio_value * 100
+        return self
+
+    def aggregates(self, buying_power, previous_close):
+        ''' Report aggregates from one column-sum pass (floats, unformatted)
+            + previous_close: portfolio equity at previous close
+        '''
+        positions, return_dollars = np.nansum(self.values[:, [FIELD['pos_$'], FIELD['r_$']]], axis=0)
+        portfolio_value = positions + buying_power                  # total portfolio $
+        pos_cost = positions - return_dollars                       # total position cost
+        return {
+            'daily_change':         (portfolio_value / previous_close - 1) * 100,
+            'total_position_value': positions,
+            'total_buying_power':   buying_power,
+            'total_portfolio_value':portfolio_value,
+            'total_position_cost':  pos_cost,
+            'position_pct':         positions / portfolio_value * 100,
+            'cash_pct':             buying_power / portfolio_value * 100,
+            'return_$':             return_dollars,
+            'return_%':             return_dollars / pos_cost * 100,
+        }
+
+    # Output
+    def rows(self, decimals=2):
+        'One tuple of strings per position, in COLUMNS order (inst sits after the first 3 FIELDS)'
+        values = self.values.round(decimals).tolist()
+        return [
+            (symbol, *map(str, v[:3]), inst, *map(str, v[3:]))
+            for symbol, inst, v in zip(self.symbol, self.inst, values)
+        ]
+
+    def frame(self):
+        'DataFrame in COLUMNS order (interactive use)'
+        import pandas as pd
+        columns = {'symbol':self.symbol, 'inst':self.inst}
+        return pd.DataFrame({name:columns[name] if name in columns else self.column(name) for name in COLUMNS})
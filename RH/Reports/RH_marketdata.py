@@ -0,0 +1,296 @@
+''' Market data and reference data shared across commands
+    + Built on top of "robin_stocks" package
+    + instrument_store: option/stock instrument metadata, resolved in bulk,
+      cached in memory (LRU) and persisted to SQLite across restarts
+    + option_quotes: market data for many option contracts in one request per chunk
+    + quote_cache: short-lived quotes shared across commands, with request
+      coalescing (crypto_quotes, stock_quotes -- limit order pricing and the
+      holdings report share one stock quote cache)
+    + stats(): hit/miss/coalesced counters of the caches
+    + crypto_pairs: crypto currency pair id -> symbol, loaded once
+'''
+
+#%% Import packages
+import os, sys
+import config as config
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from RH.Reports.APP_imports import lazy_module
+r = lazy_module('robin_stocks')                 # deferred until first request
+
+STORE_PATH = os.path.join(os.getcwd(),'RH','Reports','Log','instruments.sqlite')  # instrument metadata file
+
+#%% Instrument metadata
+class instrument_store:
+    ''' Instrument metadata (option type/strike/expiry, stock symbol, ...)
+        never changes for a given id, so it is fetched once and kept.
+        + Lookups check memory (LRU), then SQLite, then Robinhood
+        + Robinhood lookups are bulk: one '?ids=' request per 'chunk' ids
+        + Warm lookups make no network calls
+    '''
+    def __init__(self, path=STORE_PATH, capacity=config.settings['marketdata']['instrument_lru'], chunk=50):
+        self.urls = {
+            'option':r.urls.option_instruments(),  # https://api.robinhood.com/options/instruments/
+            'stock':r.urls.instruments(),          # https://api.robinhood.com/instruments/
+        }
+        self.capacity = capacity
+        self.chunk = chunk
+        self.memory = OrderedDict()                 # (kind, id): data
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS instruments '
+            '(kind TEXT, id TEXT, data TEXT, PRIMARY KEY (kind, id))'
+        )
+        self.db.commit()
+        self.stats = {'memory':0, 'disk':0, 'network':0, 'requests':0}
+
+    # Public lookups
+    def options(self, ids):
+        'Return {option_id: option instrument dict}'
+        return self.get('option', ids)
+
+    def stocks(self, urls):
+        'Return {instrument_url: stock instrument dict} (symbol, name, ...)'
+        ids = {url:url.rstrip('/').rsplit('/', 1)[-1] for url in urls}
+        found = self.get('stock', ids.values())
+        return {url:found[id] for url, id in ids.items() if id in found}
+
+    # Tiered lookup
+    def get(self, kind, ids):
+        'Resolve ids of given kind through memory, SQLite, then one bulk request per chunk'
+        ids = list(dict.fromkeys(ids))              # unique, keep order
+        result, missing = {}, []
+        with self.lock:
+            for id in ids:
+                data = self.memory.get((kind, id))
+                if data is None:
+                    missing.append(id)
+                    continue
+                self.memory.move_to_end((kind, id))
+                result[id] = data
+            self.stats['memory'] += len(result)
+
+            if missing:
+                for id, data in self.read(kind, missing).items():
+                    result[id] = data
+                    self.remember(kind, id, data)
+                    self.stats['disk'] += 1
+                missing = [id for id in missing if id not in result]
+
+        if missing:
+            fetched = self.fetch(kind, missing)
+            with self.lock:
+                self.write(kind, fetched)
+                for id, data in fetched.items():
+                    result[id] = data
+                    self.remember(kind, id, data)
+                self.stats['network'] += len(fetched)
+        return result
+
+    def remember(self, kind, id, data):
+        'Insert into LRU, evicting least recently used'
+        self.memory[(kind, id)] = data
+        self.memory.move_to_end((kind, id))
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def read(self, kind, ids):
+        'Rows from SQLite for ids'
+        rows = []
+        for i in range(0, len(ids), 500):           # stay under SQLite variable limit
+            part = ids[i:i + 500]
+            rows += self.db.execute(
+                'SELECT id, data FROM instruments WHERE kind=? AND id IN ({})'.format(','.join('?' * len(part))),
+                [kind] + part,
+            ).fetchall()
+        return {id:json.loads(data) for id, data in rows}
+
+    def write(self, kind, fetched):
+        'Persist fetched instruments'
+        self.db.executemany(
+            'INSERT OR REPLACE INTO instruments (kind, id, data) VALUES (?, ?, ?)',
+            [(kind, id, json.dumps(data)) for id, data in fetched.items()],
+        )
+        self.db.commit()
+
+    def fetch(self, kind, ids):
+        'Bulk request to Robinhood; falls back to one request per id if bulk fails'
+        result = {}
+        for i in range(0, len(ids), self.chunk):
+            part = ids[i:i + self.chunk]
+            self.stats['requests'] += 1
+            data = r.helper.request_get(self.urls[kind], 'pagination', {'ids':','.join(part)})
+            for item in data or []:
+                if item:
+                    result[item['id']] = item
+        for id in ids:
+            if id not in result:
+                self.stats['requests'] += 1
+                if kind == 'option':
+                    item = r.options.get_option_instrument_data_by_id(id)
+                else:
+                    item = r.stocks.get_instrument_by_url(self.urls['stock'] + id + '/')
+                if item:
+                    result[id] = item
+        return result
+
+    def close(self):
+        self.db.close()
+
+
+_INSTRUMENTS = None
+_INSTRUMENTS_LOCK = threading.Lock()
+
+def instruments():
+    'Shared instrument_store, opened on first use'
+    global _INSTRUMENTS
+    with _INSTRUMENTS_LOCK:
+        if _INSTRUMENTS is None:
+            _INSTRUMENTS = instrument_store()
+        return _INSTRUMENTS
+
+
+#%% Option market data
+def option_quotes(option_ids, chunk=40):
+    ''' Market data (mark, greeks, previous close, ...) for many option contracts.
+        + Instrument URLs come from instruments() -- no network calls when warm
+        + One '/marketdata/options/?instruments=' request per 'chunk' contracts,
+          instead of two requests per contract with get_option_market_data_by_id()
+        + Returns {option_id: market data dict}; contracts without data are left out
+    '''
+    option_ids = list(dict.fromkeys(option_ids))
+    details = instruments().options(option_ids)
+    by_url = {details[id]['url']:id for id in option_ids if id in details}
+    urls = list(by_url)
+    result = {}
+    for i in range(0, len(urls), chunk):
+        data = r.helper.request_get(
+            r.urls.marketdata_options(), 'results', {'instruments':','.join(urls[i:i + chunk])}
+        )
+        for quote in data or []:
+            if quote and quote.get('instrument') in by_url:
+                result[by_url[quote['instrument']]] = quote
+    return result
+
+
+#%% Quote cache
+class quote_cache:
+    ''' Short-lived quotes shared across commands
+        + get_many(keys, max_age): quotes fetched within 'max_age' seconds are
+          served from memory -- each caller sets its own staleness budget
+        + Stale or missing keys are fetched with one bulk call (fetch_many) or
+          concurrently one per key (fetch)
+        + Requests are coalesced: a key already being fetched by another caller
+          is awaited instead of requested again
+        + stats: hits / misses / coalesced
+    '''
+    def __init__(self, fetch=None, fetch_many=None, max_workers=8):
+        self.fetch = fetch                          # key -> quote (one request per key)
+        self.fetch_many = fetch_many                # [keys] -> {key: quote} (one request)
+        self.entries = {}                           # key: (quote, fetched_at)
+        self.pending = {}                           # key: Future of in-flight request
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='quote')
+        self.stats = {'hits':0, 'misses':0, 'coalesced':0}
+
+    def get_many(self, keys, max_age):
+        'Return {key: quote}; keys the backend has no quote for are left out'
+        keys = list(dict.fromkeys(keys))
+        started = time.monotonic()
+        result, waiting, missing = {}, {}, []
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is not None and started - entry[1] <= max_age:
+                    result[key] = entry[0]
+                    self.stats['hits'] += 1
+                elif key in self.pending:
+                    waiting[key] = self.pending[key]
+                    self.stats['coalesced'] += 1
+                else:
+                    self.pending[key] = Future()
+                    missing.append(key)
+                    self.stats['misses'] += 1
+
+        if missing:
+            try:
+                quotes = self.request(missing)
+            except Exception as error:
+                with self.lock:
+                    for key in missing:
+                        self.pending.pop(key).set_exception(error)
+                raise
+            with self.lock:
+                for key in missing:
+                    quote = quotes.get(key)
+                    if quote is not None:
+                        self.entries[key] = (quote, started)    # age counts from request start
+                    self.pending.pop(key).set_result(quote)
+            result.update({key:quote for key, quote in quotes.items() if quote is not None})
+
+        for key, future in waiting.items():
+            quote = future.result()
+            if quote is not None:
+                result[key] = quote
+        return result
+
+    def get(self, key, max_age):
+        'Single quote; KeyError if the backend has none'
+        return self.get_many([key], max_age)[key]
+
+    def request(self, keys):
+        'Fetch keys from backend'
+        if self.fetch_many is not None:
+            return self.fetch_many(keys)
+        return dict(zip(keys, self.pool.map(self.fetch, keys)))
+
+
+CRYPTO_QUOTES = quote_cache(fetch=lambda symbol: r.crypto.get_crypto_quote(symbol=symbol))
+
+def crypto_quotes(symbols, max_age=config.settings['marketdata']['crypto_quote_ttl']):
+    'Return {symbol: crypto quote}, shared across commands for max_age seconds'
+    return CRYPTO_QUOTES.get_many(symbols, max_age)
+
+
+STOCK_QUOTES = quote_cache(
+    fetch_many=lambda symbols: {q['symbol']:q for q in r.stocks.get_quotes(symbols) or [] if q}
+)
+
+def stock_quotes(symbols, use='report'):
+    ''' Return {SYMBOL: stock quote} for symbols (upper-cased)
+        + use: staleness budget from config.settings['marketdata']['stock_quote_max_age'],
+          e.g. 'order' (strict, for limit pricing) or 'report' (looser)
+        + All misses go out in one get_quotes() request
+    '''
+    max_age = config.settings['marketdata']['stock_quote_max_age'][use]
+    return STOCK_QUOTES.get_many([s.upper() for s in symbols], max_age)
+
+
+def stats():
+    'Cache counters of the shared market data services'
+    result = {'stock_quotes':dict(STOCK_QUOTES.stats), 'crypto_quotes':dict(CRYPTO_QUOTES.stats)}
+    if _INSTRUMENTS is not None:
+        result['instruments'] = dict(_INSTRUMENTS.stats)
+    return result
+
+
+#%% Crypto currency pairs
+_CRYPTO_PAIRS = {}
+_CRYPTO_PAIRS_LOCK = threading.Lock()
+
+def crypto_pairs(ids=()):
+    ''' Return {currency_pair_id: symbol, e.g. 'BTC-USD'}
+        + Loaded in one request on first use and kept; reloaded only if an id is unknown
+    '''
+    with _CRYPTO_PAIRS_LOCK:
+        if not _CRYPTO_PAIRS or any(id not in _CRYPTO_PAIRS for id in ids):
+            pairs = r.crypto.get_crypto_currency_pairs() or []
+            _CRYPTO_PAIRS.update({pair['id']:pair['symbol'] for pair in pairs if pair})
+        return dict(_CRYPTO_PAIRS)
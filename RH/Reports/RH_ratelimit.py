@@ -0,0 +1,194 @@
+''' Robinhood rate limiting
+    + Every robin_stocks call goes through one requests session (r.helper.SESSION);
+      limiter_adapter is mounted on it, so all of RH_functions/RH_marketdata is
+      covered without touching call sites
+    + token_bucket per endpoint family (auth, orders, quotes, instruments, account, other)
+    + Concurrency cap: at most settings['ratelimit']['max_in_flight'] requests on the wire,
+      each bounded by settings['ratelimit']['timeout'] unless the caller set one
+    + 429/5xx: jittered exponential backoff (Retry-After honoured); a 429 also halves
+      that family's rate, which climbs back toward the configured rate on success
+    + stats(): requests, throttled (429s), server errors, retries and wait time per family
+'''
+
+#%% Import packages
+import config as config
+import datetime as dt
+import random
+import re
+import threading
+import time
+import requests
+
+#%% Now time
+def now():
+    'Return now time, cleanly formatted'
+    datetime = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return datetime
+
+#%% Endpoint families
+FAMILIES = (                                                    # first match wins; else 'other'
+    ('auth',        re.compile(r'/oauth2/')),
+    ('orders',      re.compile(r'/orders/')),
+    ('quotes',      re.compile(r'/(marketdata|quotes)/')),
+    ('instruments', re.compile(r'/(instruments|currency_pairs)/')),
+    ('account',     re.compile(r'/(accounts|portfolios|positions|holdings|user)/')),
+)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+IDEMPOTENT = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+def family(url):
+    'Endpoint family of a Robinhood URL'
+    for name, pattern in FAMILIES:
+        if pattern.search(url):
+            return name
+    return 'other'
+
+def retryable(request, status):
+    ''' Safe to send again?
+        + 429: always -- the request was turned away before it was processed
+        + 5xx: idempotent methods and cancel posts only; a new order that got a
+          5xx may still have been placed, so it is never resent
+    '''
+    if status == 429:
+        return True
+    return request.method in IDEMPOTENT or request.url.rstrip('/').endswith('/cancel')
+
+#%% Token bucket
+class token_bucket:
+    ''' rate tokens/second, holding up to burst
+        + take() reserves a token and sleeps until it is due (callers queue in order)
+        + slow_down()/speed_up(): halve the rate on a 429, recover additively
+    '''
+    def __init__(self, rate, burst, min_rate):
+        self.ceiling = self.rate = float(rate)
+        self.burst = float(burst)
+        self.min_rate = float(min_rate)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        'Add tokens earned since last stamp (caller holds lock)'
+        clock = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (clock - self.stamp) * self.rate)
+        self.stamp = clock
+
+    def take(self):
+        'Reserve one token; returns seconds waited'
+        with self.lock:
+            self.refill()
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def slow_down(self):
+        'Throttled: halve rate (not below min_rate) and spend any saved-up burst'
+        with self.lock:
+            self.refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+        return self.rate
+
+    def speed_up(self):
+        'Success: win back 5% of the configured rate'
+        if self.rate < self.ceiling:
+            with self.lock:
+                self.refill()
+                self.rate = min(self.ceiling, self.rate + self.ceiling * 0.05)
+
+#%% Rate limiter
+class rate_limiter:
+    ''' Shared limits for every Robinhood request
+        + send(adapter_send, request, **kwargs): bucket, then concurrency slot, then
+          the request; retried with backoff while retryable (see retryable())
+    '''
+    def __init__(self, settings=config.settings['ratelimit']):
+        self.settings = settings
+        self.buckets = {
+            name:token_bucket(limit['rate'], limit['burst'], settings['min_rate'])
+            for name, limit in settings['families'].items()
+        }
+        self.slots = threading.BoundedSemaphore(settings['max_in_flight'])
+        self.lock = threading.Lock()
+        self.counts = {name:{'requests':0, 'throttled':0, 'server_errors':0, 'retries':0, 'waited_s':0.0}
+                       for name in self.buckets}
+
+    def count(self, name, key, value=1):
+        'Add to a family counter'
+        with self.lock:
+            self.counts[name][key] += value
+
+    def backoff(self, attempt, response):
+        'Full-jitter exponential delay; at least Retry-After when the server sends one'
+        delay = random.uniform(0, min(self.settings['backoff_max'], self.settings['backoff_base'] * 2 ** attempt))
+        try:
+            delay = max(delay, float(response.headers.get('Retry-After', 0)))
+        except ValueError:
+            pass                                                # HTTP-date form -- use jittered delay
+        return min(delay, self.settings['backoff_max'])
+
+    def send(self, adapter_send, request, **kwargs):
+        'Send request within limits; returns final response (retries exhausted or not retryable)'
+        name = family(request.url)
+        bucket = self.buckets[name]
+        attempt = 0
+        while True:
+            self.count(name, 'waited_s', bucket.take())
+            with self.slots:
+                response = adapter_send(request, **kwargs)
+            self.count(name, 'requests')
+            status = response.status_code
+            if status not in RETRY_STATUS:
+                bucket.speed_up()
+                return response
+
+            if status == 429:
+                self.count(name, 'throttled')
+                rate = bucket.slow_down()
+            else:
+                self.count(name, 'server_errors')
+                rate = bucket.rate
+            if attempt >= self.settings['retries'] or not retryable(request, status):
+                return response                                 # robin_stocks handles it as before
+            delay = self.backoff(attempt, response)
+            print('{now} -- [RATELIMIT] {status} {name} {method}, retry {n} in {delay:.2f}s (rate {rate:.1f}/s)'.format(
+                now=now(), status=status, name=name, method=request.method, n=attempt + 1, delay=delay, rate=rate,
+            ))
+            response.close()
+            time.sleep(delay)
+            self.count(name, 'retries')
+            attempt += 1
+
+    def stats(self):
+        'Per-family counters plus current rates'
+        with self.lock:
+            stats = {name:dict(counts) for name, counts in self.counts.items()}
+        for name, bucket in self.buckets.items():
+            stats[name]['rate'] = bucket.rate
+        stats['throttled'] = sum(stats[name]['throttled'] for name in self.buckets)
+        return stats
+
+#%% Transport adapter
+class limiter_adapter(requests.adapters.HTTPAdapter):
+    'HTTPAdapter whose send() goes through a rate_limiter'
+    def __init__(self, limiter, **kwargs):
+        self.limiter = limiter
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        'robin_stocks sends GETs/DELETEs without a timeout; a hung read must not hold a slot forever'
+        kwargs['timeout'] = kwargs.get('timeout') or self.limiter.settings['timeout']
+        return self.limiter.send(super().send, request, **kwargs)
+
+LIMITER = rate_limiter()     # shared by every Robinhood request in the app
+
+def install(session, limiter=LIMITER):
+    'Mount limiter on a requests session for https (idempotent); returns limiter'
+    adapter = session.get_adapter('https://')
+    if isinstance(adapter, limiter_adapter):
+        return adapter.limiter
+    pool = max(10, limiter.settings['max_in_flight'])          # 10 -- requests default pool size
+    session.mount('https://', limiter_adapter(limiter, pool_connections=pool, pool_maxsize=pool))
+    return limiter
@@ -0,0 +1,545 @@
+''' Benchmarks
+    + Compare optimized paths with the code they replaced, against fake backends
+      (no Robinhood or mail account needed)
+    + Run all:      python -m RH.benchmarks
+    + Run some:     python -m RH.benchmarks crypto_quotes
+'''
+#%% Import packages
+import sys
+import time
+import copy
+import email
+import tracemalloc
+import contextlib
+import robin_stocks as r
+import config as config
+import RH.Reports.RH_marketdata as marketdata
+import RH.Process_commands as commands
+import RH.Reports.APP_functions as app
+import RH.Reports.RH_functions as rh
+import RH.Reports.RH_holdings as holdings
+
+#%% Helpers
+def best_of(function, repeat=5):
+    'Best wall time (seconds) of repeated calls'
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+@contextlib.contextmanager
+def patched(obj, name, value):
+    'Temporarily replace obj.name'
+    original = getattr(obj, name)
+    setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        setattr(obj, name, original)
+
+def fake_latency(seconds, response):
+    'Fake backend call: sleep like a network round trip, then answer'
+    def call(*args, **kwargs):
+        time.sleep(seconds)
+        return response(*args, **kwargs)
+    return call
+
+def peak_memory(function):
+    'Peak bytes allocated while running function'
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def report(name, rows, columns):
+    'Print benchmark table'
+    print('\n== {}'.format(name))
+    print(' | '.join('{:>14}'.format(c) for c in columns))
+    for row in rows:
+        row = ['{:.4f}'.format(x) if isinstance(x, float) else x for x in row]
+        print(' | '.join('{:>14}'.format(x) for x in row))
+
+
+#%% Crypto quotes
+def crypto_quotes(sizes=(1, 5, 20), latency=0.02):
+    ''' Per-symbol loop (old account.get_position.crypto) vs concurrent fetch,
+        cold and warm (within crypto_quote_ttl)
+    '''
+    quote = fake_latency(latency, lambda symbol, info=None: {'symbol':symbol, 'mark_price':'1.0', 'open_price':'1.0'})
+    rows = []
+    with patched(r.crypto, 'get_crypto_quote', quote):
+        for n in sizes:
+            symbols = ['C{}'.format(i) for i in range(n)]
+            loop = best_of(lambda: [r.crypto.get_crypto_quote(symbol=s) for s in symbols], repeat=3)
+            cache = marketdata.quote_cache(fetch=lambda symbol: r.crypto.get_crypto_quote(symbol=symbol))
+            cold = best_of(lambda: cache.get_many(symbols, max_age=-1), repeat=3)
+            warm = best_of(lambda: cache.get_many(symbols, max_age=60), repeat=3)
+            rows.append([n, loop, cold, warm])
+    report('crypto quotes ({}s fake latency)'.format(latency), rows, ['symbols', 'loop s', 'concurrent s', 'cached s'])
+
+
+#%% Command matcher
+def command_matcher(custom=(0, 10, 100, 1000), repeat=2000):
+    ''' Per-message cost of the old per-route substring scans vs the compiled
+        token trie, as custom commands are added to config.commands
+    '''
+    text = 'LIMIT BUY E\n10 AAPL MAX 0.3\n'
+    rows = []
+    for n in custom:
+        table = copy.deepcopy(config.commands)
+        table.update({'custom_{}'.format(i):['CUSTOM COMMAND {}'.format(i)] for i in range(n)})
+        groups = [v for v in table.values() if not isinstance(v, dict)] + list(table['instruments'].values())
+        matcher = commands.command_matcher(table)
+
+        def scan():
+            return [any(trigger in text for trigger in triggers) for triggers in groups]
+
+        old = best_of(lambda: [scan() for _ in range(repeat)]) / repeat
+        new = best_of(lambda: [matcher.match(text) for _ in range(repeat)]) / repeat
+        rows.append([n, old * 1e6, new * 1e6])
+    report('command matching (per message)', rows, ['custom cmds', 'substring us', 'trie us'])
+
+
+#%% Mail parsing
+def mail_parse(backlog=(10, 100, 1000)):
+    ''' Draining a backlog: old parse (decode, message_from_string, pandas date,
+        re-parse body in routes) vs single BytesParser pass into mail_record
+    '''
+    import pandas as pd
+    raw = (
+        b'Received: by 2002:a05:6000:1:b0:1 with SMTP id x;\r\n'
+        b'        Mon, 18 Oct 2026 10:00:00 -0700 (PDT)\r\n'
+        b'From: 5555555555@vzwpix.com\r\nTo: bot@gmail.com\r\nSubject: \r\n'
+        b'Message-ID: <1@vzwpix.com>\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n'
+        b'LIMIT BUY E\r\n10 AAPL MAX 0.3\r\n'
+    )
+
+    def old(n):
+        for _ in range(n):
+            msg = email.message_from_string(raw.decode('utf-8'))
+            pd.to_datetime(msg['received'].split('\r\n')[-1].strip()).astimezone(tz='US/Eastern')
+            email.message_from_string(msg.get_payload()).as_string().upper()
+
+    def new(n):
+        for _ in range(n):
+            app.email_server().parse_mail(b'1', raw).body.upper()
+
+    rows = []
+    for n in backlog:
+        rows.append([
+            n,
+            best_of(lambda: old(n), repeat=3) / n * 1e6,
+            best_of(lambda: new(n), repeat=3) / n * 1e6,
+            peak_memory(lambda: old(n)) / 1024,
+            peak_memory(lambda: new(n)) / 1024,
+        ])
+    report('mail parsing (per message)', rows, ['messages', 'old us', 'new us', 'old peak KiB', 'new peak KiB'])
+
+
+#%% Report templates
+def templates(rows=(10, 100), repeat=20):
+    ''' current_holdings.html render: old path (read file, new Environment,
+        compile from string) vs template_registry (compiled once, mtime-checked)
+    '''
+    import os
+    from jinja2 import Environment
+    path = os.path.join(app.TEMPLATE_PATH, 'current_holdings.html')
+    registry = app.template_registry()
+    result = []
+    for n in rows:
+        table = app.holdings_table(synthetic_holdings(n), synthetic_aggregates())
+
+        def cold():
+            with open(path, 'r') as f:
+                return Environment().from_string(f.read()).render(dt='', **table)
+
+        def warm():
+            return registry.render('current_holdings.html', dt='', **table)
+
+        result.append([n, best_of(cold, repeat) * 1e3, best_of(warm, repeat) * 1e3])
+    report('report template render', result, ['positions', 'cold ms', 'warm ms'])
+
+# Holdings table body as rendered before row materialization: one DataFrame lookup per cell
+PER_CELL_TEMPLATE = '''
+{% for position in range(h.shape[0])%}<tr>{% for column in h.columns %}<td>{{ h[column][position] }}</td>{% endfor %}</tr>{% endfor %}
+'''
+ROW_TEMPLATE = '''
+{% for row in rows %}<tr>{% for cell in row %}<td>{{ cell }}</td>{% endfor %}</tr>{% endfor %}
+'''
+
+def holdings_render(rows=(10, 100, 1000, 5000)):
+    ''' Holdings table body: per-cell DataFrame indexing inside the template vs
+        rows materialized once by holdings_table() and looped as plain tuples
+    '''
+    from jinja2 import Environment
+    per_cell = Environment().from_string(PER_CELL_TEMPLATE)
+    row_wise = Environment().from_string(ROW_TEMPLATE)
+    agg = synthetic_aggregates()
+    result = []
+    for n in rows:
+        book = synthetic_holdings(n)
+        h = book.frame().round(2)
+        old = lambda: per_cell.render(h=h)
+        new = lambda: row_wise.render(rows=app.holdings_table(book, agg)['rows'])
+        result.append([
+            n,
+            best_of(old, repeat=3) * 1e3,
+            best_of(new, repeat=3) * 1e3,
+            peak_memory(old) / 1024,
+            peak_memory(new) / 1024,
+        ])
+    report('holdings table render', result, ['positions', 'per-cell ms', 'rows ms', 'per-cell peak KiB', 'rows peak KiB'])
+
+def synthetic_aggregates():
+    'Aggregates dict shaped like app_functions.current_holdings() builds it'
+    return {key:'0.00' for key in [
+        'daily_change', 'total_position_value', 'total_buying_power', 'total_portfolio_value',
+        'total_position_cost', 'position_pct', 'cash_pct', 'return_$', 'return_%',
+    ]}
+
+def synthetic_holdings(n, seed=0):
+    'holdings_book shaped like account.get_position.my_holdings()'
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    price = rng.uniform(1, 500, n)
+    cost = price * rng.uniform(0.5, 1.5, n)
+    quantity = rng.integers(1, 100, n).astype(float)
+    return holdings.holdings_book.build(['S{}'.format(i) for i in range(n)], 'equity', {
+        'price':price,
+        'quantity':quantity,
+        'pct_change':rng.normal(0, 2, n),
+        'cost':cost,
+        'pos_$':price * quantity,
+        'r_$':price - cost,
+        'r_%':(price / cost - 1) * 100,
+    }, sort=False).weigh((price * quantity).sum())
+
+
+#%% Holdings engine
+def holdings_engine(positions=(10, 100, 1000, 5000)):
+    ''' my_holdings() + report aggregates from fetched positions: old per-asset
+        DataFrames (repeated astype, Python loops, pd.concat, repeated sums) vs
+        holdings_book (float once, one concatenate, one aggregate pass).
+        Positions are split 60/20/20 across equity/options/crypto.
+    '''
+    account_profile = {'buying_power':'1000.00'}
+    portfolio = {'adjusted_portfolio_equity_previous_close':'100000.00'}
+    result = []
+    for n in positions:
+        fetched, details = synthetic_fetched(n)
+        store = type('store', (), {'options':lambda self, ids: details})()
+
+        def old():
+            h = legacy_holdings(fetched, details)
+            return h, legacy_aggregates(h, account_profile, portfolio)
+
+        def new():
+            h = rh.account.get_position.my_holdings(fetched=fetched)
+            return h, h.aggregates(
+                buying_power=float(account_profile['buying_power']),
+                previous_close=float(portfolio['adjusted_portfolio_equity_previous_close']),
+            )
+
+        with patched(marketdata, 'instruments', lambda: store):
+            (h_old, a_old), (h_new, a_new) = old(), new()
+            assert (h_old.round(6).astype(str).values == h_new.frame().round(6).astype(str).values).all()
+            assert all(abs(a_old[k] - a_new[k]) <= 1e-9 * max(1, abs(a_old[k])) for k in a_old)
+            result.append([
+                n,
+                best_of(old, repeat=3) * 1e3,
+                best_of(new, repeat=3) * 1e3,
+                peak_memory(old) / 1024,
+                peak_memory(new) / 1024,
+            ])
+    report('holdings engine (build + aggregates)', result, ['positions', 'old ms', 'new ms', 'old peak KiB', 'new peak KiB'])
+
+def synthetic_fetched(n, seed=0):
+    ''' fetch_concurrently() results as my_holdings() receives them (numbers as
+        strings, like Robinhood), plus {option_id: option instrument}
+    '''
+    import numpy as np
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    n_options, n_crypto = n // 5, n // 5
+    n_equity = n - n_options - n_crypto
+    text = lambda values: ['{:.4f}'.format(x) for x in values]
+
+    price = rng.uniform(1, 500, n_equity)
+    quantity = rng.integers(1, 100, n_equity)
+    equity = pd.DataFrame({
+        'symbol':['S{:05d}'.format(i) for i in range(n_equity)],
+        'price':text(price),
+        'quantity':text(quantity),
+        'average_buy_price':text(price * rng.uniform(0.5, 1.5, n_equity)),
+        'equity':text(price * quantity),
+        'percent_change':text(rng.normal(0, 2, n_equity)),
+    })
+
+    ids = ['option-{}'.format(i) for i in range(n_options)]
+    options = pd.DataFrame({
+        'chain_symbol':['O{:05d}'.format(i) for i in range(n_options)],
+        'option_id':ids,
+        'type':rng.choice(['long', 'short'], n_options),
+        'average_price':text(rng.uniform(10, 900, n_options)),
+        'quantity':text(rng.integers(1, 10, n_options)),
+    })
+    option_quotes = pd.DataFrame({
+        'adjusted_mark_price':text(rng.uniform(0.1, 9, n_options)),
+        'previous_close_price':text(rng.uniform(0.1, 9, n_options)),
+    })
+    details = {x:{'type':kind, 'strike_price':'{:.4f}'.format(strike)} for x, kind, strike in zip(
+        ids, rng.choice(['call', 'put'], n_options), rng.integers(5, 500, n_options))}
+
+    crypto = pd.DataFrame({
+        'symbol':['C{:05d}'.format(i) for i in range(n_crypto)],
+        'quantity':text(rng.uniform(0.01, 5, n_crypto)),
+        'cost_bases':[[{'direct_cost_basis':'{:.4f}'.format(c)}] for c in rng.uniform(10, 5000, n_crypto)],
+    })
+    crypto_quotes = pd.DataFrame({
+        'mark_price':text(rng.uniform(1, 3000, n_crypto)),
+        'open_price':text(rng.uniform(1, 3000, n_crypto)),
+    })
+    fetched = {
+        'user_profile':{'equity':'100000.00'},
+        'equity':equity,
+        'options':(options, option_quotes),
+        'crypto':(crypto, crypto_quotes),
+    }
+    return fetched, details
+
+def legacy_holdings(fetched, details):
+    'my_holdings() before holdings_book: one DataFrame per asset class, then pd.concat'
+    import pandas as pd
+    portfolio_value = float(fetched['user_profile']['equity'])
+
+    equities = fetched['equity']
+    cost = equities.average_buy_price.astype(float)
+    price = equities.price.astype(float)
+    equity = pd.DataFrame({
+        'symbol':equities.symbol,
+        'price':price,
+        'quantity':equities.quantity.astype(float),
+        'pct_change':equities.percent_change.astype(float),
+        'inst':'equity',
+        'cost':cost,
+        'pos_$':equities.equity.astype(float),
+        'pos_%':(equities.equity.astype(float) / portfolio_value)*100,
+        'r_$':price - cost,
+        'r_%':(price / cost - 1) * 100,
+    }).sort_values(by='symbol')
+
+    options, mkt_quote = fetched['options']
+    price = mkt_quote.adjusted_mark_price.astype(float)
+    cost = options.average_price.astype(float) / 100
+    quantity = options.quantity.astype(float)
+    option_type, option_strike = [], []
+    for x in options.option_id:
+        option_type.append(details[x]['type'])
+        option_strike.append(float(details[x]['strike_price']))
+    inst = []
+    for x, strike in enumerate(option_strike):
+        inst.append('{} {}{}'.format(int(strike), options.type[x][0], option_type[x][0].upper()))
+    option = pd.DataFrame({
+        'symbol':options.chain_symbol,
+        'inst':inst,
+        'price':price,
+        'pct_change':(price / mkt_quote.previous_close_price.astype(float) - 1) * 100,
+        'quantity':quantity,
+        'pos_$':price * 100 * quantity,
+        'pos_%':((price * 100 * quantity) / portfolio_value) * 100,
+        'r_$':(price - cost)*100 * quantity,
+        'r_%':(price / cost - 1) * 100,
+        'cost':cost,
+    })
+
+    crypto, mkt_quote = fetched['crypto']
+    price = mkt_quote.mark_price.astype(float)
+    cost = [float(cost_bases[0]['direct_cost_basis']) for cost_bases in crypto.cost_bases]
+    quantity = crypto.quantity.astype(float)
+    coin = pd.DataFrame({
+        'symbol':crypto.symbol,
+        'price':price,
+        'pct_change':(price / mkt_quote.open_price.values.astype(float) - 1) * 100,
+        'quantity':quantity,
+        'pos_$':price * quantity,
+        'pos_%':((price* quantity) / portfolio_value) * 100,
+        'r_$':(price * quantity) - cost,
+        'r_%':((price * quantity) / cost - 1) * 100,
+        'cost':cost,
+        'inst':'crypto',
+    }).sort_values(by='symbol').dropna(subset=['r_%'])
+    return pd.concat([equity, option, coin]).reset_index(drop=True)
+
+def legacy_aggregates(holdings, account_profile, portfolio):
+    'current_holdings() aggregates before holdings_book.aggregates()'
+    positions = holdings['pos_$'].sum()
+    buying_power = float(account_profile['buying_power'])
+    portfolio_value = positions + buying_power
+    pos_cost = (holdings['pos_$'].sum() - holdings['r_$'].sum())
+    return {
+        'daily_change':(portfolio_value / float(portfolio['adjusted_portfolio_equity_previous_close']) - 1) * 100,
+        'total_position_value':positions,
+        'total_buying_power':buying_power,
+        'total_portfolio_value':portfolio_value,
+        'total_position_cost':pos_cost,
+        'position_pct':positions / portfolio_value * 100,
+        'cash_pct':buying_power / portfolio_value * 100,
+        'return_$':holdings['r_$'].sum(),
+        'return_%':(holdings['r_$'].sum() / pos_cost) * 100,
+    }
+
+
+#%% Cancel all
+def cancel_all(per_class=(1, 5, 20), latency=0.02):
+    ''' CANCEL ALL time-to-flat: old sequential equity -> options -> crypto
+        (list, then cancel one by one) vs concurrent listing and pooled cancels
+    '''
+    import types
+    def book(n, asset):
+        key = 'cancel' if asset == 'equity' else 'cancel_url'
+        return [{'id':'{}-{}'.format(asset, i), key:'https://x/{}/{}/cancel/'.format(asset, i),
+                 'symbol':'S{}'.format(i), 'side':'buy', 'quantity':'1'} for i in range(n)]
+    post = fake_latency(latency, lambda url, payload=None, **kwargs: types.SimpleNamespace(status_code=200))
+    rows = []
+    for n in per_class:
+        listing = {asset:fake_latency(latency, lambda asset=asset: book(n, asset)) for asset in rh.OPEN_ORDERS}
+
+        def old():
+            for asset in rh.OPEN_ORDERS:
+                for order in listing[asset]():
+                    post(order.get('cancel') or order.get('cancel_url'))
+
+        with contextlib.ExitStack() as stack:
+            for asset, function in rh.OPEN_ORDERS.items():
+                stack.enter_context(patched(r.orders, function, listing[asset]))
+            stack.enter_context(patched(r.helper, 'request_post', post))
+            stack.enter_context(contextlib.redirect_stdout(None))
+            new = best_of(rh.orders.cancel_all_orders, repeat=3)
+        rows.append([n * 3, best_of(old, repeat=3), new])
+    report('cancel all -- time to flat ({}s fake latency)'.format(latency), rows, ['open orders', 'sequential s', 'concurrent s'])
+
+
+#%% Open orders
+def open_orders(counts=(1, 10, 100), latency=0.02):
+    ''' OPEN ORDERS latency vs number of open stock orders: asset classes listed
+        one after another with one instrument lookup per order, vs the concurrent
+        snapshot with bulk, cached symbol resolution
+    '''
+    def stock_orders(n):
+        return [{'id':'s{}'.format(i), 'instrument':'https://x/instruments/i{}/'.format(i),
+                 'side':'buy', 'quantity':'1', 'price':'1', 'type':'limit'} for i in range(n)]
+    lookup = fake_latency(latency, lambda url: {'symbol':url})
+    store = type('store', (), {'stocks':lambda self, urls: {url:{'symbol':url} for url in urls}})()
+    rows = []
+    for n in counts:
+        listing = {
+            'get_all_open_stock_orders':fake_latency(latency, lambda n=n: stock_orders(n)),
+            'get_all_open_option_orders':fake_latency(latency, lambda: []),
+            'get_all_open_crypto_orders':fake_latency(latency, lambda: []),
+        }
+
+        def old():
+            books = [listing[function]() for function in rh.OPEN_ORDERS.values()]
+            return [lookup(order['instrument'])['symbol'] for order in books[0]]
+
+        with contextlib.ExitStack() as stack:
+            for function, fake in listing.items():
+                stack.enter_context(patched(r.orders, function, fake))
+            stack.enter_context(patched(marketdata, 'instruments', lambda: store))
+            new = best_of(lambda: rh.orders.open_orders(max_age=-1), repeat=3)
+            cached = best_of(lambda: rh.orders.open_orders(), repeat=3)
+        rows.append([n, best_of(old, repeat=3), new, cached])
+    report('open orders ({}s fake latency)'.format(latency), rows, ['open orders', 'sequential s', 'snapshot s', 'cached s'])
+
+
+#%% Batch orders
+def batch_orders(legs=(1, 5, 20), latency=0.02):
+    ''' Multi-order text: old one text per order (quote, then place, one after
+        another) vs one batch (bulk quote, then legs placed concurrently)
+    '''
+    quote = {'last_extended_hours_trade_price':None, 'last_trade_price':'10'}
+    quotes = fake_latency(latency, lambda symbols, use=None: {symbol:quote for symbol in symbols})
+    place = fake_latency(latency, lambda **kwargs: {'id':kwargs['symbol']})
+    rows = []
+    for n in legs:
+        text = 'LIMIT BUY E\n' + '\n'.join('1 S{} MAX 0.3'.format(i) for i in range(n))
+        ORDERS = commands.parse_orders(text)
+
+        def old():
+            for ORDER in ORDERS:
+                mkt_quote = quotes([ORDER.symbol])[ORDER.symbol]
+                place(symbol=ORDER.symbol, quantity=ORDER.quantity, side=ORDER.side,
+                      limitPrice=ORDER.limit_price(float(mkt_quote['last_trade_price'])))
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(patched(marketdata, 'stock_quotes', quotes))
+            stack.enter_context(patched(rh.orders.equity, 'place_limit_order', place))
+            stack.enter_context(patched(rh.SESSION, 'ensure', lambda *args, **kwargs: None))
+            stack.enter_context(contextlib.redirect_stdout(None))
+            new = best_of(lambda: app.app_functions.equity_limit_orders(ORDERS), repeat=3)
+        rows.append([n, best_of(old, repeat=3), new])
+    report('batch orders ({}s fake latency)'.format(latency), rows, ['legs', 'sequential s', 'batch s'])
+
+
+#%% Rate limiter
+def ratelimit(requests=(50, 200), threads=16, latency=0.01, server_rate=100.0):
+    ''' Fan-out of quote requests against a fake server that answers 429 above
+        server_rate/second: old unthrottled requests (429s reach robin_stocks and
+        come back empty) vs RH_ratelimit (bucket below server_rate, retries)
+    '''
+    import types
+    from concurrent.futures import ThreadPoolExecutor
+    import RH.Reports.RH_ratelimit as ratelimit
+
+    def fake_server():
+        bucket = ratelimit.token_bucket(server_rate, 10, server_rate)
+        def send(request, **kwargs):
+            with bucket.lock:
+                bucket.refill()
+                allowed = bucket.tokens >= 1
+                bucket.tokens -= allowed
+            time.sleep(latency)
+            return types.SimpleNamespace(status_code=200 if allowed else 429, headers={}, close=lambda: None)
+        return send
+
+    request = types.SimpleNamespace(method='GET', url='https://api.robinhood.com/marketdata/quotes/')
+    settings = dict(config.settings['ratelimit'], families={'quotes':{'rate':server_rate * 0.8, 'burst':10}})
+    rows = []
+    for n in requests:
+        def run(send):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                codes = list(pool.map(lambda i: send(request).status_code, range(n)))
+            return time.perf_counter() - start, codes.count(429)
+
+        old_s, old_failed = run(fake_server())
+        limiter = ratelimit.rate_limiter(settings)
+        server = fake_server()
+        with contextlib.redirect_stdout(None):
+            new_s, new_failed = run(lambda request: limiter.send(server, request))
+        rows.append([n, old_s, old_failed, new_s, new_failed, limiter.stats()['throttled']])
+    report('rate limiter ({}/s fake server limit, {} threads)'.format(server_rate, threads), rows,
+           ['requests', 'unlimited s', 'failed', 'limited s', 'failed', '429s seen'])
+
+
+#%% Run
+BENCHMARKS = {
+    'crypto_quotes':crypto_quotes,
+    'command_matcher':command_matcher,
+    'mail_parse':mail_parse,
+    'templates':templates,
+    'holdings_render':holdings_render,
+    'holdings_engine':holdings_engine,
+    'cancel_all':cancel_all,
+    'open_orders':open_orders,
+    'batch_orders':batch_orders,
+    'ratelimit':ratelimit,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -78,3 +78,83 @@ commands = {
         ]
     },
 }
+
+#%% Application settings
+''' Tune how the application listens for and processes commands.
+    Defaults are safe for a Gmail inbox; change only if needed.
+'''
+settings = {
+    # Inbox listener
+    'mail':{
+        'listener':'idle',          # 'idle' | 'poll' -- 'idle' falls back to 'poll' if server lacks IDLE
+        'idle_timeout':60 * 9,      # seconds -- re-issue IDLE before server drops idle connection
+        'idle_reply_timeout':30,    # seconds -- no reply in IDLE (or to DONE) this long means a dead connection
+        'poll_min':0.1,             # seconds -- poll interval right after mail arrives
+        'poll_max':5.0,             # seconds -- poll interval ceiling while inbox is quiet
+        'sync':'uid',               # 'uid' -- only fetch UIDs above last processed UID (saved to disk)
+                                    # 'unseen' -- search for messages without the \Seen flag
+        'fetch':'text',             # 'text' -- read BODYSTRUCTURE, download only the first text part
+                                    # 'full' -- download whole message (MMS images and all)
+        'text_max_bytes':4096,      # bytes -- cap on text part download in 'text' mode
+        'check_interval':60,        # seconds -- NOOP IMAP/SMTP this often; dead sessions are replaced in the background
+    },
+
+    # Command dispatcher -- runs commands off the event loop
+    'dispatch':{
+        'max_workers':4,            # commands allowed to run at the same time (unprioritized dispatcher)
+        'classes':{                 # priority scheduler -- highest priority first, each with reserved workers
+            'cancel':{'max_workers':2},
+            'order':{'max_workers':2},
+            'report':{'max_workers':1},
+        },
+    },
+
+    # Market/reference data caches
+    'marketdata':{
+        'instrument_lru':10000,     # instruments kept in memory (all are kept on disk)
+        'crypto_quote_ttl':5.0,     # seconds -- back-to-back reports reuse crypto quotes this fresh
+        'stock_quote_max_age':{     # seconds -- oldest cached stock quote each use accepts
+            'order':1.0,            # limit order pricing
+            'report':15.0,          # reports
+        },
+    },
+
+    # Order handling
+    'orders':{
+        'cancel_workers':8,         # cancels posted at the same time by CANCEL ALL (ratelimit max_in_flight caps requests on the wire)
+        'open_orders_ttl':2.0,      # seconds -- OPEN ORDERS snapshot shared this long (cancels/new orders reset it)
+        'batch_max_legs':20,        # orders allowed in one text (one header line, then one line per order)
+        'batch_workers':5,          # orders of one text submitted at the same time
+    },
+
+    # Robinhood session
+    'robinhood':{
+        'expires_in':86400,         # seconds -- access token lifetime requested at login/refresh
+        'refresh_margin':900,       # seconds -- refresh this long before the token expires
+        'check_interval':60,        # seconds -- longest APP.rh_login sleeps between expiry checks
+    },
+
+    # Robinhood request limits (RH_ratelimit.py) -- every robin_stocks request
+    'ratelimit':{
+        'max_in_flight':8,          # requests on the wire at the same time, all threads
+        'timeout':16,               # seconds -- connect/read timeout for requests sent without one
+        'families':{                # token bucket per endpoint family -- rate: requests/second, burst: saved-up requests
+            'auth':{'rate':1, 'burst':2},
+            'orders':{'rate':5, 'burst':10},
+            'quotes':{'rate':10, 'burst':20},
+            'instruments':{'rate':10, 'burst':20},
+            'account':{'rate':5, 'burst':10},
+            'other':{'rate':5, 'burst':10},
+        },
+        'min_rate':0.5,             # requests/second -- floor when 429s keep halving a family's rate
+        'retries':4,                # resends after 429/5xx (5xx only for reads and cancels, never new orders)
+        'backoff_base':0.5,         # seconds -- first retry waits up to this, doubling each time (jittered)
+        'backoff_max':8.0,          # seconds -- longest single wait, Retry-After included
+    },
+
+    # Application start
+    'startup':{
+        'mode':'fast',              # 'fast'  -- defer pandas/numpy/jinja2 until a route needs them, log in concurrently
+                                    # 'eager' -- import everything up front, log in one service at a time
+    },
+}
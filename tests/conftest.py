@@ -0,0 +1,9 @@
+''' Test setup
+    + Puts the repository root on sys.path so tests import config and RH.* as APP.py does
+    + Run:      python -m pytest -q
+'''
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
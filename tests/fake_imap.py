@@ -0,0 +1,194 @@
+''' Local IMAP stand-in for listener tests
+    + Plain TCP on 127.0.0.1; any imaplib.IMAP4 client can log in
+    + Speaks just enough IMAP for mail_listener and mail_sync: CAPABILITY, LOGIN,
+      SELECT, NOOP, IDLE, LOGOUT, UID SEARCH (UNSEEN | UID n:*) and
+      UID FETCH (UID MODSEQ) [(CHANGEDSINCE m)] | (UID BODY.PEEK[])
+    + idle='accept' answers IDLE with a continuation, idle='reject' with a tagged NO
+    + done='ignore' never answers DONE, as a half-open connection would not
+    + push(): add a message and announce it ('* n EXISTS') to every client in IDLE
+    + drop(): close every client socket, as a server or network failure would
+'''
+
+#%% Import packages
+import imaplib
+import socket
+import socketserver
+import threading
+
+#%% UID sets
+def uid_set(text, highest):
+    "UIDs matched by an IMAP set such as '1:3,7' or '5:*' ('*' is the highest UID)"
+    def bound(value):
+        return highest if value == '*' else int(value)
+    ranges = []
+    for part in text.split(','):
+        lo, hi = (part.split(':') + [part])[:2]
+        lo, hi = bound(lo), bound(hi)
+        ranges.append((min(lo, hi), max(lo, hi)))
+    return lambda uid: any(lo <= uid <= hi for lo, hi in ranges)
+
+#%% Connection handler
+class handler(socketserver.StreamRequestHandler):
+    def write(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        fake = self.server.fake
+        with fake.lock:
+            fake.sockets.append(self.request)
+        self.write('* OK fake IMAP ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            with fake.lock:
+                fake.commands.append(line.decode().strip())
+            tag, command = (line.decode().split() + [''])[:2]
+            command = command.upper()
+            if command == 'CAPABILITY':
+                self.write('* CAPABILITY {}'.format(' '.join(fake.capabilities)))
+                self.write('{} OK done'.format(tag))
+            elif command == 'LOGIN':
+                self.write('{} OK [CAPABILITY {}] logged in'.format(tag, ' '.join(fake.capabilities)))
+            elif command == 'SELECT':
+                self.write('* {} EXISTS'.format(fake.messages))
+                self.write('* OK [UIDVALIDITY {}] ok'.format(fake.uidvalidity))
+                self.write('* OK [UIDNEXT {}] ok'.format(fake.uidnext))
+                self.write('{} OK [READ-WRITE] selected'.format(tag))
+            elif command == 'NOOP':
+                self.write('{} OK done'.format(tag))
+            elif command == 'LOGOUT':
+                self.write('* BYE')
+                self.write('{} OK done'.format(tag))
+                return
+            elif command == 'IDLE':
+                if fake.idle != 'accept':
+                    self.write('{} NO IDLE not allowed'.format(tag))
+                    continue
+                with fake.lock:
+                    fake.idlers.append(self)
+                self.write('+ idling')
+                done = self.rfile.readline()                        # DONE, or b'' if dropped
+                with fake.lock:
+                    fake.idlers.remove(self)
+                if not done:
+                    return
+                if fake.done == 'ignore':
+                    continue
+                self.write('{} OK IDLE terminated'.format(tag))
+            elif command == 'UID':
+                self.uid(tag, line.decode().split()[2:])
+            else:
+                self.write('{} BAD unknown command'.format(tag))
+
+    def uid(self, tag, args):
+        'UID SEARCH / UID FETCH over the mailbox'
+        fake = self.server.fake
+        with fake.lock:
+            mailbox = list(enumerate(fake.mailbox, 1))
+        highest = mailbox[-1][1]['uid'] if mailbox else 0
+        command = args[0].upper()
+        if command == 'SEARCH':
+            if args[1].upper() == 'UNSEEN':
+                found = [m['uid'] for n, m in mailbox if not m['seen']]
+            else:                                                   # UID n:*
+                match = uid_set(args[2], highest)
+                found = [m['uid'] for n, m in mailbox if match(m['uid'])]
+            self.write('* SEARCH {}'.format(' '.join(str(uid) for uid in found)).rstrip())
+        elif command == 'FETCH':
+            match = uid_set(args[1], highest)
+            items = ' '.join(args[2:]).upper()
+            changedsince = int(args[-1].rstrip(')')) if 'CHANGEDSINCE' in items else 0
+            for n, m in mailbox:
+                if not match(m['uid']) or m['modseq'] <= changedsince:
+                    continue
+                if 'BODY.PEEK[]' in items:
+                    self.wfile.write('* {} FETCH (UID {} BODY[] {{{}}}\r\n'.format(n, m['uid'], len(m['raw'])).encode())
+                    self.wfile.write(m['raw'] + b')\r\n')
+                else:
+                    self.write('* {} FETCH (UID {} MODSEQ ({}))'.format(n, m['uid'], m['modseq']))
+        else:
+            self.write('{} BAD unknown UID command'.format(tag))
+            return
+        self.write('{} OK done'.format(tag))
+
+class server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+#%% Fake IMAP server
+class fake_imap:
+    ''' One mailbox behind a local IMAP server
+        + capabilities: advertised in CAPABILITY and LOGIN responses
+        + idle: 'accept' | 'reject'
+        + done: 'reply' | 'ignore'
+        + mailbox: one dict per message -- uid, raw, seen, modseq
+    '''
+    def __init__(self, capabilities=('IMAP4rev1', 'IDLE'), idle='accept', done='reply'):
+        self.capabilities = capabilities
+        self.idle = idle
+        self.done = done
+        self.mailbox = []
+        self.uidvalidity = 1
+        self.uidnext = 1
+        self.modseq = 1
+        self.commands = []              # every command line received
+        self.lock = threading.Lock()
+        self.idlers = []                # handlers currently in IDLE
+        self.sockets = []               # every client socket accepted
+        self.server = server(('127.0.0.1', 0), handler)
+        self.server.fake = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def client(self):
+        'Logged-in imaplib client'
+        e_client = imaplib.IMAP4('127.0.0.1', self.port)
+        e_client.login('user', 'password')
+        return e_client
+
+    @property
+    def messages(self):
+        return len(self.mailbox)
+
+    def push(self, raw=b'From: a@b\r\n\r\nX\r\n', seen=False):
+        'New message arrives: store it, tell clients in IDLE; returns its UID'
+        with self.lock:
+            self.modseq += 1
+            self.mailbox.append({'uid':self.uidnext, 'raw':raw, 'seen':seen, 'modseq':self.modseq})
+            self.uidnext += 1
+            for idler in self.idlers:
+                idler.write('* {} EXISTS'.format(self.messages))
+            return self.uidnext - 1
+
+    def renumber(self):
+        'Mailbox rebuilt by the server: new UIDVALIDITY, UIDs restart at 1'
+        with self.lock:
+            self.uidvalidity += 1
+            for uid, message in enumerate(self.mailbox, 1):
+                message['uid'] = uid
+            self.uidnext = len(self.mailbox) + 1
+
+    def drop(self):
+        'Close every client connection'
+        with self.lock:
+            for sock in self.sockets:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def idling(self):
+        'Number of clients in IDLE'
+        with self.lock:
+            return len(self.idlers)
+
+    def close(self):
+        self.drop()
+        self.server.shutdown()
+        self.server.server_close()
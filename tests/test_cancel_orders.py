@@ -0,0 +1,125 @@
+''' rh.orders.cancel_all_orders (RH_functions.py) with a stubbed robin_stocks
+    -- every open order canceled once, concurrently; failures reported per order
+'''
+import threading
+import time
+import types
+
+import robin_stocks
+
+import RH.Reports.RH_functions as rh
+import RH.Reports.RH_marketdata as marketdata
+
+API = 'https://api.robinhood.com'
+
+def equity(id, symbol):
+    return {'id':id, 'side':'buy', 'quantity':'1', 'price':'10', 'type':'limit', 'state':'confirmed',
+            'instrument':'{}/instruments/{}/'.format(API, symbol), 'cancel':'{}/orders/{}/cancel/'.format(API, id)}
+
+def option(id):
+    return {'id':id, 'chain_symbol':'SPY', 'direction':'debit', 'quantity':'1', 'price':'2',
+            'cancel_url':'{}/options/orders/{}/cancel/'.format(API, id)}
+
+def crypto(id):
+    return {'id':id, 'side':'sell', 'quantity':'0.1', 'currency_pair_id':'pair-btc',
+            'cancel_url':'https://nummus.robinhood.com/orders/{}/cancel/'.format(id)}
+
+class broker:
+    ''' robin_stocks stand-in: open orders per asset class, and the cancel POST
+        + status: {cancel url: HTTP status | None (no response) | Exception}
+    '''
+    def __init__(self, monkeypatch, equity=(), options=(), crypto=(), status=None, delay=0.02):
+        self.status = status or {}
+        self.delay = delay
+        self.posts = []
+        self.active = 0
+        self.overlap = 0
+        self.lock = threading.Lock()
+        for function, orders in [('get_all_open_stock_orders', equity),
+                                 ('get_all_open_option_orders', options),
+                                 ('get_all_open_crypto_orders', crypto)]:
+            if isinstance(orders, Exception):
+                monkeypatch.setattr(robin_stocks.orders, function, self.failing(orders))
+            else:
+                monkeypatch.setattr(robin_stocks.orders, function, lambda orders=orders: list(orders))
+        monkeypatch.setattr(robin_stocks.helper, 'request_post', self.request_post)
+        monkeypatch.setattr(marketdata, 'instruments', lambda: types.SimpleNamespace(
+            stocks=lambda urls: {url:{'symbol':url.rstrip('/').rsplit('/', 1)[-1]} for url in urls}
+        ))
+        monkeypatch.setattr(marketdata, 'crypto_pairs', lambda ids=(): {'pair-btc':'BTC-USD'})
+
+    @staticmethod
+    def failing(error):
+        def listing():
+            raise error
+        return listing
+
+    def request_post(self, url, payload=None, jsonify_data=True):
+        with self.lock:
+            self.posts.append(url)
+            self.active += 1
+            self.overlap = max(self.overlap, self.active)
+        try:
+            time.sleep(self.delay)
+            status = self.status.get(url, 200)
+            if isinstance(status, Exception):
+                raise status
+            return None if status is None else types.SimpleNamespace(status_code=status)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+def cancel_urls(*orders):
+    return sorted(order.get('cancel') or order.get('cancel_url') for order in orders)
+
+
+def test_every_open_order_canceled_once(monkeypatch, capsys):
+    orders = {
+        'equity':[equity('e1', 'AAPL'), equity('e2', 'MSFT'), equity('e3', 'TSLA')],
+        'options':[option('o1'), option('o2')],
+        'crypto':[crypto('c1')],
+    }
+    backend = broker(monkeypatch, **orders)
+    result = rh.orders.cancel_all_orders(max_workers=8)
+    assert sorted(backend.posts) == cancel_urls(*sum(orders.values(), []))
+    assert backend.overlap > 1                                      # posted concurrently
+    assert (result['canceled'], result['failed'], result['list_errors']) == (6, 0, {})
+
+    outcomes = {o['id']:o for o in result['outcomes']}
+    assert set(outcomes) == {'e1', 'e2', 'e3', 'o1', 'o2', 'c1'}
+    assert [outcomes[id]['symbol'] for id in ['e1', 'o1', 'c1']] == ['AAPL', 'SPY', 'BTC-USD']
+    assert {outcomes[id]['asset'] for id in ['e1', 'e2', 'e3']} == {'equity'}
+    assert all(o['ok'] and o['error'] is None for o in outcomes.values())
+
+def test_failed_cancels_do_not_hide_the_others(monkeypatch, capsys):
+    orders = [equity('e{}'.format(i), 'S{}'.format(i)) for i in range(6)]
+    backend = broker(monkeypatch, equity=orders, status={
+        orders[1]['cancel']:400,
+        orders[3]['cancel']:None,
+        orders[4]['cancel']:ConnectionError('reset'),
+    })
+    result = rh.orders.cancel_all_orders(max_workers=4)
+    assert sorted(backend.posts) == cancel_urls(*orders)
+    assert (result['canceled'], result['failed']) == (3, 3)
+    errors = {o['id']:o['error'] for o in result['outcomes']}
+    assert errors == {'e0':None, 'e1':'HTTP 400', 'e2':None, 'e3':'no response', 'e4':"ConnectionError('reset')", 'e5':None}
+
+def test_unlisted_asset_class_reported(monkeypatch, capsys):
+    backend = broker(monkeypatch, equity=[equity('e1', 'AAPL')], options=RuntimeError('listing failed'))
+    result = rh.orders.cancel_all_orders()
+    assert backend.posts == [equity('e1', 'AAPL')['cancel']]
+    assert result['canceled'] == 1
+    assert result['list_errors'] == {'options':"RuntimeError('listing failed')"}
+
+def test_orders_without_cancel_url_skipped(monkeypatch, capsys):
+    filled = dict(equity('e2', 'MSFT'), cancel=None)                # already filled -- nothing to cancel
+    backend = broker(monkeypatch, equity=[equity('e1', 'AAPL'), filled])
+    result = rh.orders.cancel_all_orders()
+    assert backend.posts == [equity('e1', 'AAPL')['cancel']]
+    assert [o['id'] for o in result['outcomes']] == ['e1']
+
+def test_nothing_open(monkeypatch, capsys):
+    backend = broker(monkeypatch)
+    result = rh.orders.cancel_all_orders()
+    assert backend.posts == [] and result['outcomes'] == []
+    assert 'time_to_flat' in result
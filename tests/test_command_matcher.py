@@ -0,0 +1,56 @@
+''' command_matcher (Process_commands.py) -- whole-word trigger matching
+'''
+import pytest
+
+import RH.Process_commands as commands
+
+TABLE = {
+    'current_holdings':['CURRENT', 'CURRENT HOLDINGS'],
+    'cancel_orders':['CANCEL ALL'],
+    'open_orders':['O', 'OPEN ORDERS'],
+    'instruments':{
+        'equities':['E', 'STOCK'],
+        'options':['O', 'OPTIONS'],
+        'crypto':['C', 'CRYPTO'],
+    },
+}
+
+@pytest.fixture(scope='module')
+def matcher():
+    return commands.command_matcher(TABLE)
+
+
+def test_multi_word_trigger(matcher):
+    assert matcher.match('cancel all') == {'cancel_orders'}
+
+def test_trigger_inside_longer_word_does_not_match(matcher):
+    assert matcher.match('CANCELLATION ALL') == set()
+    assert matcher.match('CANCEL ALLOCATION') == set()
+
+def test_multi_word_trigger_needs_words_in_order(matcher):
+    assert matcher.match('ALL CANCEL') == set()
+    assert matcher.match('CANCEL NOW ALL') == set()
+
+def test_single_letters_match_only_as_words(matcher):
+    assert matcher.match('CRYPTO') == {'instruments.crypto'}     # not 'C' or 'O'
+    assert matcher.match('OPEN') == set()                         # 'O' is not a prefix match
+    assert matcher.match('LIMIT BUY O') == {'open_orders', 'instruments.options'}
+
+def test_nested_groups_are_dotted(matcher):
+    assert matcher.match('10 AAPL STOCK') == {'instruments.equities'}
+
+def test_all_routes_in_one_pass(matcher):
+    assert matcher.match('CURRENT HOLDINGS\nOPEN ORDERS E') == {
+        'current_holdings', 'open_orders', 'instruments.equities',
+    }
+
+def test_punctuation_and_case(matcher):
+    assert matcher.match('current, holdings!') == {'current_holdings'}
+    assert matcher.match('Cancel-All') == {'cancel_orders'}
+
+def test_empty_text(matcher):
+    assert matcher.match('') == set()
+
+def test_default_table_compiles():
+    assert 'cancel_orders' in commands.MATCHER.match('CANCEL ALL')
+    assert commands.MATCHER.match('CANCELLATION') == set()
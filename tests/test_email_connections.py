@@ -0,0 +1,184 @@
+''' email_connections (APP_functions.py) -- generation counter, reconnect(),
+    probe after IDLE, serialized sendmail() and lock order
+'''
+import contextlib
+import smtplib
+import threading
+import time
+
+import pytest
+
+import RH.Reports.APP_functions as app
+
+
+class imap:
+    'imaplib stand-in: NOOP answers OK until killed'
+    def __init__(self, n):
+        self.n = n
+        self.dead = False
+        self.logged_out = False
+
+    def noop(self):
+        if self.dead:
+            raise OSError('connection reset')
+        return 'OK', [b'done']
+
+    def logout(self):
+        self.logged_out = True
+
+class smtp(smtplib.SMTP):
+    ''' smtplib.SMTP stand-in (never connects)
+        + block: Event the next sendmail() waits on
+        + fail: sendmail() raises SMTPServerDisconnected
+    '''
+    def __init__(self, n):
+        super().__init__()
+        self.n = n
+        self.dead = False
+        self.fail = False
+        self.block = None
+        self.sent = []
+        self.active = 0
+        self.overlap = 0
+        self.quitted = False
+
+    def noop(self):
+        return (421, b'gone') if self.dead else (250, b'ok')
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        self.active += 1
+        self.overlap = max(self.overlap, self.active)
+        try:
+            if self.block is not None:
+                self.block.wait(5)
+            time.sleep(0.005)
+            if self.fail:
+                raise smtplib.SMTPServerDisconnected('gone')
+            self.sent.append(msg)
+            return {}
+        finally:
+            self.active -= 1
+
+    def quit(self):
+        self.quitted = True
+
+class factory:
+    'email_server stand-in counting logins'
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.imaps = []
+        self.smtps = []
+
+    def connect_gmail(self):
+        time.sleep(self.delay)
+        self.imaps.append(imap(len(self.imaps)))
+        return self.imaps[-1]
+
+    def connect_smtp(self):
+        time.sleep(self.delay)
+        self.smtps.append(smtp(len(self.smtps)))
+        return self.smtps[-1]
+
+def connections(delay=0.0):
+    logins = factory(delay)
+    return app.email_connections(logins.connect_gmail(), logins.connect_smtp(), factory=logins), logins
+
+def threads(*targets):
+    'Run targets in threads and join them; True if all finished'
+    started = [threading.Thread(target=target, daemon=True) for target in targets]
+    for thread in started:
+        thread.start()
+    for thread in started:
+        thread.join(5)
+    return not any(thread.is_alive() for thread in started)
+
+
+#%% Generation, reconnect()
+def test_generation_counts_imap_replacements_only(capsys):
+    manager, logins = connections()
+    assert manager.generation == 0
+    manager.reconnect('smtp', stale=manager.server)
+    assert manager.generation == 0
+    old = manager.client
+    assert manager.reconnect('imap', stale=old) is manager.imap()
+    assert manager.generation == 1
+    assert old.logged_out                                           # stale session closed
+
+def test_reconnect_of_replaced_session_reuses_replacement(capsys):
+    manager, logins = connections()
+    old = manager.client
+    new = manager.reconnect('imap', stale=old)
+    assert manager.reconnect('imap', stale=old) is new              # someone else already replaced it
+    assert len(logins.imaps) == 2 and manager.generation == 1
+
+def test_concurrent_reconnects_share_one_login(capsys):
+    manager, logins = connections(delay=0.1)
+    old = manager.client
+    results = []
+    assert threads(*[lambda: results.append(manager.reconnect('imap', stale=old))] * 6)
+    assert len(logins.imaps) == 2                                   # initial + one replacement
+    assert len({id(result) for result in results}) == 1
+    assert manager.generation == 1
+
+
+#%% check() / probe()
+def test_check_replaces_dead_connections(capsys):
+    manager, logins = connections()
+    manager.server.dead = True
+    manager.client.dead = True
+    manager.check()
+    assert (len(logins.smtps), len(logins.imaps)) == (2, 2)
+    assert manager.generation == 1 and not manager.probe_due
+
+def test_busy_imap_probed_after_idle(capsys):
+    manager, logins = connections()
+    manager.client.dead = True
+    with manager.imap_lock:                                         # mail loop in IDLE
+        manager.check()
+        assert manager.probe_due and manager.generation == 0
+    manager.probe()                                                 # mail loop, after IDLE returns
+    assert not manager.probe_due
+    assert manager.generation == 1
+
+def test_check_never_waits_for_imap_lock(capsys):
+    manager, logins = connections()
+    with manager.imap_lock:
+        assert threads(manager.check)
+
+
+#%% sendmail()
+def test_sends_are_serialized(capsys):
+    manager, logins = connections()
+    assert threads(*[lambda i=i: manager.sendmail('bot', 'me', 'm{}'.format(i)) for i in range(8)])
+    assert sorted(manager.server.sent) == sorted('m{}'.format(i) for i in range(8))
+    assert manager.server.overlap == 1
+
+def test_disconnected_send_reconnects_and_retries_once(capsys):
+    manager, logins = connections()
+    old = manager.server
+    old.fail = True
+    manager.sendmail('bot', 'me', 'hello')
+    assert manager.server is not old and manager.server.sent == ['hello']
+    assert old.quitted and len(logins.smtps) == 2
+
+@pytest.mark.parametrize('caller_holds_smtp_lock', [False, True])
+def test_reconnect_during_send_does_not_deadlock(capsys, caller_holds_smtp_lock):
+    ''' A send holds SMTP_LOCK and then finds the server gone while another thread
+        replaces that server: both finish, with one new login.  Callers may hold
+        SMTP_LOCK around sendmail() (lock order: SMTP_LOCK, then reconnect_lock)
+    '''
+    manager, logins = connections()
+    old = manager.server
+    old.fail = True
+    old.block = threading.Event()
+    def send():
+        with app.SMTP_LOCK if caller_holds_smtp_lock else contextlib.nullcontext():
+            manager.sendmail('bot', 'me', 'hello')
+    def replace():
+        while not old.active:                                       # send is in progress, holding SMTP_LOCK
+            time.sleep(0.001)
+        threading.Timer(0.05, old.block.set).start()
+        manager.reconnect('smtp', stale=old)
+    assert threads(send, replace)
+    assert len(logins.smtps) == 2
+    assert manager.server.sent == ['hello']
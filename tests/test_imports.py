@@ -0,0 +1,65 @@
+''' lazy_module (APP_imports.py) -- deferred, thread-safe, re-entrant imports
+'''
+import builtins
+import sys
+import threading
+
+import pytest
+
+import RH.Reports.APP_imports as imports
+
+
+@pytest.fixture
+def modules(tmp_path, monkeypatch):
+    'Directory on sys.path for throwaway modules; they are unloaded afterwards'
+    monkeypatch.syspath_prepend(str(tmp_path))
+    names = []
+    def write(name, source):
+        (tmp_path / (name + '.py')).write_text(source)
+        names.append(name)
+    yield write
+    for name in names:
+        sys.modules.pop(name, None)
+        imports.IMPORT_TIMES.pop(name, None)
+
+def load_in_thread(module):
+    'load() in a thread; None if it did not finish (deadlock)'
+    result = []
+    thread = threading.Thread(target=lambda: result.append(module.load()), daemon=True)
+    thread.start()
+    thread.join(5)
+    return result[0] if result else None
+
+
+def test_import_deferred_until_first_use(modules):
+    modules('lazy_plain', 'VALUE = 42\n')
+    module = imports.lazy_module('lazy_plain')
+    assert 'lazy_plain' not in sys.modules
+    assert 'deferred' in repr(module)
+    assert module.VALUE == 42
+    assert 'lazy_plain' in imports.IMPORT_TIMES and 'loaded' in repr(module)
+
+def test_deferred_module_using_lazy_modules_does_not_deadlock(modules):
+    modules('lazy_inner', 'VALUE = 7\n')
+    modules('lazy_outer', (
+        'from RH.Reports.APP_imports import lazy_module\n'
+        'inner = lazy_module("lazy_inner")\n'
+        'VALUE = inner.VALUE + 1\n'                                 # used at import time
+    ))
+    outer = load_in_thread(imports.lazy_module('lazy_outer'))
+    assert outer is not None and outer.VALUE == 8
+
+def test_concurrent_first_use_imports_once(modules):
+    modules('lazy_counted', 'import builtins\nbuiltins.lazy_counted_imports = getattr(builtins, "lazy_counted_imports", 0) + 1\n')
+    module = imports.lazy_module('lazy_counted')
+    start = threading.Barrier(8)
+    def touch():
+        start.wait()
+        module.load()
+    threads = [threading.Thread(target=touch) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert builtins.lazy_counted_imports == 1
+    del builtins.lazy_counted_imports
@@ -0,0 +1,123 @@
+''' command_journal (Process_journal.py) -- at-most-once execution by Message-ID
+'''
+import asyncio
+import threading
+
+import pytest
+
+import RH.Process_dispatch as dispatch
+import RH.Process_journal as journaling
+import RH.Process_routes as routes
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'journal.sqlite')
+
+@pytest.fixture
+def journal(path):
+    journal = journaling.command_journal(path)
+    yield journal
+    journal.close()
+
+
+def test_claim_once(journal):
+    assert journal.claim('<m1@x>', 'STOCK ORDER') is True
+    assert journal.claim('<m1@x>', 'STOCK ORDER') is False
+    assert journal.status('<m1@x>', 'STOCK ORDER') == 'started'
+
+def test_routes_of_one_message_are_separate(journal):
+    assert journal.claim('<m1@x>', 'STOCK ORDER') is True
+    assert journal.claim('<m1@x>', 'CANCEL') is True
+
+def test_finished_command_is_not_claimed_again(journal):
+    journal.claim('<m1@x>', 'CANCEL')
+    journal.finish('<m1@x>', 'CANCEL')
+    assert journal.status('<m1@x>', 'CANCEL') == 'done'
+    assert journal.claim('<m1@x>', 'CANCEL') is False
+
+def test_repeat_refused_after_reopen(path):
+    journal = journaling.command_journal(path)
+    assert journal.claim('<m1@x>', 'STOCK ORDER') is True           # crash before finish()
+    journal.claim('<m2@x>', 'CANCEL')
+    journal.finish('<m2@x>', 'CANCEL', error=RuntimeError('boom'))
+    journal.close()
+
+    reopened = journaling.command_journal(path)
+    try:
+        assert reopened.claim('<m1@x>', 'STOCK ORDER') is False
+        assert reopened.claim('<m2@x>', 'CANCEL') is False
+        assert reopened.status('<m1@x>', 'STOCK ORDER') == 'started'
+        assert reopened.status('<m2@x>', 'CANCEL') == 'failed'
+        assert reopened.claim('<m3@x>', 'STOCK ORDER') is True
+    finally:
+        reopened.close()
+
+def test_concurrent_claims_one_winner(journal):
+    results = []
+    def claim():
+        results.append(journal.claim('<m1@x>', 'STOCK ORDER'))
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [False] * 7 + [True]
+
+def test_tracked_records_outcome(journal):
+    journal.claim('<ok@x>', 'R')
+    assert journal.tracked('<ok@x>', 'R', lambda x: x * 2)(21) == 42
+    assert journal.status('<ok@x>', 'R') == 'done'
+
+    def fail():
+        raise ValueError('bad')
+    journal.claim('<bad@x>', 'R')
+    with pytest.raises(ValueError):
+        journal.tracked('<bad@x>', 'R', fail)()
+    assert journal.status('<bad@x>', 'R') == 'failed'
+
+
+#%% journal_key
+class mail:
+    def __init__(self, message_id, sender='a@b', datetime='t', body='CANCEL ALL'):
+        self.message_id = message_id
+        self.sender = sender
+        self.datetime = datetime
+        self.body = body
+
+def test_key_is_message_id():
+    assert journaling.journal_key(mail(' <m1@x> ')) == '<m1@x>'
+
+def test_key_without_message_id_is_stable_hash():
+    assert journaling.journal_key(mail(None)) == journaling.journal_key(mail(None))
+    assert journaling.journal_key(mail(None)).startswith('sha1:')
+    assert journaling.journal_key(mail(None)) != journaling.journal_key(mail(None, body='CURRENT'))
+
+
+#%% RUN_ROUTE with a dispatcher -- claim runs on the pool, not the event loop
+def test_route_claims_on_pool_thread(journal, capsys):
+    claims = []
+    claim = journal.claim
+    def recording_claim(message_id, route):
+        claims.append(threading.current_thread())
+        return claim(message_id, route)
+    journal.claim = recording_claim
+    ran = []
+
+    async def main():
+        scheduler = dispatch.scheduler({'report':{'max_workers':2}})
+        try:
+            tasks = [
+                routes.RUN_ROUTE('R', ran.append, 'x', dispatcher=scheduler, journal=journal, message_id='<m1@x>')
+                for _ in range(2)                                   # same text read twice
+            ]
+            assert claims == []                                     # nothing written on the loop thread
+            await asyncio.gather(*tasks)
+        finally:
+            scheduler.shutdown(wait=False)
+    asyncio.run(main())
+
+    assert ran == ['x']
+    assert len(claims) == 2 and threading.main_thread() not in claims
+    assert journal.status('<m1@x>', 'R') == 'done'
+    assert 'Skipped -- already executed for <m1@x> (' in capsys.readouterr().out
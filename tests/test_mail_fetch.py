@@ -0,0 +1,116 @@
+''' Size-bounded text fetch (APP_functions.py) -- imap_parse, text_part, decode_part, fetch_text
+'''
+import base64
+
+import RH.Reports.APP_functions as app
+
+PLAIN = b'("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 12 1 NIL NIL NIL)'
+MMS = (                                                             # image, then text/plain + html alternative
+    b'(("IMAGE" "JPEG" ("NAME" "pic.jpg") NIL NIL "BASE64" 250000 NIL NIL NIL)'
+    b'(("TEXT" "PLAIN" ("CHARSET" "iso-8859-1") NIL NIL "BASE64" 40 1 NIL NIL NIL)'
+    b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "QUOTED-PRINTABLE" 90 2 NIL NIL NIL) "ALTERNATIVE")'
+    b' "MIXED" ("BOUNDARY" "b1") NIL NIL)'
+)
+
+def structure(text):
+    'Parsed BODYSTRUCTURE, as fetch_text() sees it'
+    [(id, items)] = app.imap_parse([b'1 (BODYSTRUCTURE ' + text + b')'])
+    return items[b'BODYSTRUCTURE']
+
+
+#%% imap_parse
+def test_imap_parse_literals_and_nil():
+    data = [
+        (b'1 (UID 11 BODY[HEADER] {9}', b'Subject: '),
+        b' FLAGS (\\Seen) X-NOTE NIL)',
+        (b'2 (UID 12 BODY[HEADER] {4}', b'a\r\n'),
+        b')',
+    ]
+    result = app.imap_parse(data)
+    assert [id for id, items in result] == [b'1', b'2']
+    first = result[0][1]
+    assert first[b'UID'] == b'11'
+    assert first[b'BODY[HEADER]'] == b'Subject: '                   # literal spliced in, not tokenized
+    assert first[b'FLAGS'] == [b'\\Seen']
+    assert first[b'X-NOTE'] is None
+
+def test_imap_parse_quoted_strings():
+    [(id, items)] = app.imap_parse([b'3 (ENVELOPE ("a \\"quoted\\" b" NIL))'])
+    assert items[b'ENVELOPE'] == [b'a "quoted" b', None]
+
+
+#%% text_part
+def test_single_part_is_section_1():
+    assert app.text_part(structure(PLAIN)) == ('1', b'7BIT', 'utf-8')
+
+def test_nested_mms_text_part():
+    assert app.text_part(structure(MMS)) == ('2.1', b'BASE64', 'iso-8859-1')
+
+def test_no_text_plain_part():
+    only_image = b'(("IMAGE" "JPEG" NIL NIL NIL "BASE64" 9 NIL NIL NIL) "MIXED")'
+    assert app.text_part(structure(only_image)) is None
+
+def test_html_only_is_not_text_plain():
+    html = b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "7BIT" 12 1 NIL NIL NIL)'
+    assert app.text_part(structure(html)) is None
+
+def test_missing_charset_defaults_to_utf8():
+    plain = b'("TEXT" "PLAIN" NIL NIL NIL NIL 12 1 NIL NIL NIL)'
+    assert app.text_part(structure(plain)) == ('1', b'7BIT', 'utf-8')
+
+
+#%% decode_part
+def test_base64_truncated_at_byte_cap():
+    encoded = base64.encodebytes('LIMIT BUY E\n10 AAPL MAX 0.3\n'.encode() * 20)   # 76-column lines
+    for cap in [10, 33, 77, 78, 101]:                              # cut mid-quantum and mid-CRLF
+        text = app.decode_part(encoded[:cap], b'BASE64', 'utf-8')
+        assert ('LIMIT BUY E\n10 AAPL MAX 0.3\n' * 20).startswith(text)
+        whole_quanta = len(encoded[:cap].replace(b'\n', b'')) // 4
+        assert len(text) == whole_quanta * 3                        # only the partial quantum is dropped
+
+def test_base64_whole_part():
+    encoded = base64.b64encode('CANCEL ALL ✔'.encode())
+    assert app.decode_part(encoded, b'BASE64', 'utf-8') == 'CANCEL ALL ✔'
+
+def test_quoted_printable_and_charset():
+    assert app.decode_part(b'caf=E9 =\r\nok', b'QUOTED-PRINTABLE', 'iso-8859-1') == 'café ok'
+
+def test_unknown_charset_falls_back_to_utf8():
+    assert app.decode_part('é'.encode(), b'7BIT', 'x-unknown') == 'é'
+
+
+#%% fetch_text
+class fetch_client:
+    ''' imaplib stand-in for fetch_text(): answers the BODYSTRUCTURE/header FETCH,
+        then the partial text FETCH, recording the commands sent
+    '''
+    def __init__(self, body):
+        self.body = body
+        self.commands = []
+
+    def fetch(self, ids, items):
+        self.commands.append(('FETCH', ids, items))
+        return 'OK', [
+            b'5 (FLAGS (\\Seen))',                                  # unsolicited update -- skipped
+            (b'6 (UID 21 BODYSTRUCTURE ' + MMS + b' BODY[HEADER] {20}', b'Subject: order\r\n\r\n'),
+            b')',
+        ]
+
+    def uid(self, command, ids, items):
+        self.commands.append((command, ids, items))
+        cap = int(items.split('.')[-1].rstrip('>)'))
+        return 'OK', [
+            b'5 (FLAGS (\\Seen))',
+            (b'6 (UID 21 BODY[2.1]<0> {%d}' % len(self.body[:cap]), self.body[:cap]),
+            b')',
+        ]
+
+def test_fetch_text_downloads_only_capped_text_part():
+    body = base64.encodebytes(('LIMIT BUY E\n10 AAPL MAX 0.3\n' * 50).encode('latin-1'))
+    client = fetch_client(body)
+    [mail] = app.email_server().fetch_text(client, [b'6'], max_bytes=64)
+    assert client.commands[0] == ('FETCH', '6', '(UID BODYSTRUCTURE BODY.PEEK[HEADER])')
+    assert client.commands[1] == ('FETCH', '21', '(UID BODY.PEEK[2.1]<0.64>)')
+    assert (mail.uid, mail.subject) == (21, 'order')
+    assert mail.body.startswith('LIMIT BUY E\n10 AAPL MAX 0.3\n')
+    assert len(mail.body) <= 64 * 3 // 4
@@ -0,0 +1,177 @@
+''' mail_listener / email_server.idle against the local IMAP stand-in (fake_imap.py)
+'''
+import asyncio
+import threading
+import time
+
+import pytest
+
+import RH.Reports.APP_functions as app
+from fake_imap import fake_imap
+
+SETTINGS = {'listener':'idle', 'idle_timeout':5.0, 'idle_reply_timeout':5.0, 'poll_min':0.1, 'poll_max':0.4}
+
+@pytest.fixture
+def imap():
+    fake = fake_imap()
+    yield fake
+    fake.close()
+
+def when_idling(fake, action):
+    'Run action in a thread once a client is in IDLE'
+    def run():
+        deadline = time.monotonic() + 5
+        while not fake.idling() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        action()
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+def timed_wait(listener):
+    'Run listener.wait() on an event loop; returns (result, seconds)'
+    start = time.monotonic()
+    result = asyncio.run(listener.wait())
+    return result, time.monotonic() - start
+
+
+#%% IDLE accepted
+def test_idle_mode_when_server_supports_it(imap):
+    listener = app.mail_listener(imap.client(), settings=SETTINGS)
+    assert listener.mode == 'idle'
+
+def test_push_wakes_listener(imap):
+    listener = app.mail_listener(imap.client(), settings=SETTINGS)
+    when_idling(imap, imap.push)
+    new_mail, seconds = timed_wait(listener)
+    assert new_mail is True
+    assert seconds < SETTINGS['idle_timeout'] / 2                   # woken by push, not timeout
+    assert not listener.broken
+    assert imap.idling() == 0                                       # left IDLE (DONE sent)
+
+def test_listener_holds_lock_only_while_idle(imap):
+    lock = threading.Lock()
+    listener = app.mail_listener(imap.client(), settings=SETTINGS, lock=lock)
+    seen = []
+    when_idling(imap, lambda: (seen.append(lock.locked()), imap.push()))
+    timed_wait(listener)
+    assert seen == [True]
+    assert not lock.locked()
+
+def test_idle_connection_still_usable_after_push(imap):
+    e_client = imap.client()
+    listener = app.mail_listener(e_client, settings=SETTINGS)
+    when_idling(imap, imap.push)
+    timed_wait(listener)
+    assert e_client.noop()[0] == 'OK'
+
+
+#%% Timeout, poll fallback
+def test_idle_timeout_returns_without_mail(imap):
+    settings = dict(SETTINGS, idle_timeout=0.3)
+    listener = app.mail_listener(imap.client(), settings=settings)
+    new_mail, seconds = timed_wait(listener)
+    assert new_mail is False
+    assert 0.25 <= seconds < 2
+    assert listener.mode == 'idle' and not listener.broken
+
+def test_poll_mode_without_idle_capability():
+    fake = fake_imap(capabilities=('IMAP4rev1',))
+    try:
+        listener = app.mail_listener(fake.client(), settings=SETTINGS)
+        assert listener.mode == 'poll'
+        new_mail, seconds = timed_wait(listener)
+        assert new_mail is True
+        assert seconds < 1
+        assert fake.idling() == 0
+    finally:
+        fake.close()
+
+def test_poll_interval_adapts():
+    fake = fake_imap(capabilities=('IMAP4rev1',))
+    try:
+        listener = app.mail_listener(fake.client(), settings=SETTINGS)
+        intervals = []
+        for new_mail in [0, 0, 0, 0, 1]:
+            listener.update(new_mail=new_mail)
+            intervals.append(listener.interval)
+        assert intervals == [0.2, 0.4, 0.4, 0.4, 0.1]             # doubles up to poll_max, resets on mail
+    finally:
+        fake.close()
+
+def test_poll_mode_when_configured(imap):
+    listener = app.mail_listener(imap.client(), settings=dict(SETTINGS, listener='poll'))
+    assert listener.mode == 'poll'
+
+
+#%% IDLE rejected
+def test_rejected_idle_falls_back_to_poll():
+    fake = fake_imap(idle='reject')
+    try:
+        e_client = fake.client()
+        listener = app.mail_listener(e_client, settings=SETTINGS)
+        assert listener.mode == 'idle'                              # advertised, so tried first
+        new_mail, seconds = timed_wait(listener)
+        assert new_mail is True                                     # mail loop reads once now
+        assert listener.mode == 'poll'
+        assert not listener.broken                                  # no reconnect needed
+        assert e_client.noop()[0] == 'OK'
+    finally:
+        fake.close()
+
+def test_idle_rejected_raises():
+    fake = fake_imap(idle='reject')
+    try:
+        e_client = fake.client()
+        e_client.select('Inbox')
+        with pytest.raises(e_client.error, match='IDLE rejected'):
+            app.email_server().idle(e_client, timeout=1)
+    finally:
+        fake.close()
+
+
+#%% Connection drop
+def test_connection_drop_sets_broken(imap):
+    listener = app.mail_listener(imap.client(), settings=SETTINGS)
+    when_idling(imap, imap.drop)
+    new_mail, seconds = timed_wait(listener)
+    assert new_mail is True                                         # mail loop wakes to reconnect
+    assert listener.broken
+    assert seconds < SETTINGS['idle_timeout'] / 2                   # noticed at once, not at timeout
+
+def test_connection_drop_raises_abort(imap):
+    e_client = imap.client()
+    e_client.select('Inbox')
+    when_idling(imap, imap.drop)
+    with pytest.raises(e_client.abort):
+        app.email_server().idle(e_client, timeout=5)
+
+
+#%% Half-open connection -- server stops answering
+def test_unanswered_done_sets_broken():
+    fake = fake_imap(done='ignore')
+    try:
+        listener = app.mail_listener(fake.client(), settings=dict(SETTINGS, idle_timeout=0.2, idle_reply_timeout=0.3))
+        new_mail, seconds = timed_wait(listener)
+        assert new_mail is True                                     # mail loop wakes to reconnect
+        assert listener.broken
+        assert seconds < 2                                          # reply timeout, not TCP's
+    finally:
+        fake.close()
+
+def test_unanswered_done_raises_abort():
+    fake = fake_imap(done='ignore')
+    try:
+        e_client = fake.client()
+        e_client.select('Inbox')
+        with pytest.raises(e_client.abort, match='no reply'):
+            app.email_server().idle(e_client, timeout=0.1, reply_timeout=0.2)
+    finally:
+        fake.close()
+
+def test_socket_timeout_restored_after_idle(imap):
+    e_client = imap.client()
+    e_client.select('Inbox')
+    assert e_client.sock.gettimeout() is None
+    app.email_server().idle(e_client, timeout=0.1, reply_timeout=0.5)
+    assert e_client.sock.gettimeout() is None
@@ -0,0 +1,80 @@
+''' Single-parse mail pipeline (APP_functions.py) -- parse_mail, mail_text, mail_datetime
+'''
+import base64
+import datetime as dt
+
+import RH.Reports.APP_functions as app
+
+HEADERS = (
+    b'Received: by 2002:a05:1234 with SMTP id x;\r\n'
+    b'        Mon, 18 Oct 2026 10:00:05 -0400\r\n'
+    b'From: 5551234567@carrier.example\r\n'
+    b'To: bot@example.com\r\n'
+    b'Subject: \r\n'
+    b'Message-ID: <abc@carrier.example>\r\n'
+    b'Date: Mon, 18 Oct 2026 09:59:00 -0400\r\n'
+)
+
+def parse(raw):
+    return app.email_server().parse_mail(b'7', raw)
+
+
+def test_plain_message():
+    mail = parse(HEADERS + b'Content-Type: text/plain\r\n\r\nCURRENT HOLDINGS\r\n')
+    assert mail.msg_id == b'7'
+    assert mail.message_id == '<abc@carrier.example>'
+    assert mail.sender == '5551234567@carrier.example'
+    assert mail.body.strip() == 'CURRENT HOLDINGS'
+
+def test_received_time_from_last_hop():
+    'Same instant, whatever zone it is shown in (US/Eastern, or local time without tzdata)'
+    mail = parse(HEADERS + b'Content-Type: text/plain\r\n\r\nX\r\n')
+    assert mail.datetime == dt.datetime(2026, 10, 18, 10, 0, 5, tzinfo=dt.timezone(dt.timedelta(hours=-4)))
+
+def test_date_header_when_no_received():
+    raw = HEADERS.replace(b'Received: by 2002:a05:1234 with SMTP id x;\r\n        Mon, 18 Oct 2026 10:00:05 -0400\r\n', b'')
+    mail = parse(raw + b'Content-Type: text/plain\r\n\r\nX\r\n')
+    assert mail.datetime == dt.datetime(2026, 10, 18, 9, 59, tzinfo=dt.timezone(dt.timedelta(hours=-4)))
+
+def test_bad_date_is_none():
+    raw = b'From: a@b\r\nDate: not a date\r\n\r\nX\r\n'
+    assert parse(raw).datetime is None
+
+def test_mms_first_text_plain_part():
+    raw = HEADERS + (
+        b'MIME-Version: 1.0\r\n'
+        b'Content-Type: multipart/mixed; boundary="outer"\r\n\r\n'
+        b'--outer\r\n'
+        b'Content-Type: multipart/related; boundary="inner"\r\n\r\n'
+        b'--inner\r\n'
+        b'Content-Type: image/jpeg\r\nContent-Transfer-Encoding: base64\r\n\r\n'
+        + base64.b64encode(b'\xff\xd8' * 100) + b'\r\n'
+        b'--inner\r\n'
+        b'Content-Type: text/plain; charset="utf-8"\r\nContent-Transfer-Encoding: base64\r\n\r\n'
+        + base64.b64encode('CANCEL ALL ✔'.encode()) + b'\r\n'
+        b'--inner--\r\n'
+        b'--outer\r\n'
+        b'Content-Type: text/html\r\n\r\n<p>ignored</p>\r\n'
+        b'--outer--\r\n'
+    )
+    assert parse(raw).body == 'CANCEL ALL ✔'
+
+def test_multipart_without_text_plain():
+    raw = HEADERS + (
+        b'Content-Type: multipart/mixed; boundary="b"\r\n\r\n'
+        b'--b\r\nContent-Type: image/png\r\n\r\nPNG\r\n--b--\r\n'
+    )
+    assert parse(raw).body == ''
+
+def test_quoted_printable_latin1():
+    raw = HEADERS + (
+        b'Content-Type: text/plain; charset="iso-8859-1"\r\n'
+        b'Content-Transfer-Encoding: quoted-printable\r\n\r\n'
+        b'caf=E9\r\n'
+    )
+    assert parse(raw).body.strip() == 'café'
+
+def test_headers_only_with_separate_body():
+    mail = app.email_server().parse_mail(b'7', HEADERS + b'\r\n', body='OPEN ORDERS')
+    assert mail.body == 'OPEN ORDERS'
+    assert mail.subject == ''
@@ -0,0 +1,113 @@
+''' mail_sync (APP_functions.py) against the local IMAP stand-in (fake_imap.py)
+    -- UID high-water mark, UIDVALIDITY reseed, CONDSTORE CHANGEDSINCE
+'''
+import json
+
+import pytest
+
+import config as config
+import RH.Reports.APP_functions as app
+from fake_imap import fake_imap
+
+
+@pytest.fixture
+def imap():
+    fake = fake_imap()
+    yield fake
+    fake.close()
+
+@pytest.fixture(autouse=True)
+def full_fetch(monkeypatch):
+    monkeypatch.setitem(config.settings['mail'], 'fetch', 'full')
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'mail_sync.json')
+
+def text(body):
+    return 'From: a@b\r\nMessage-ID: <{}@x>\r\n\r\n{}\r\n'.format(body.replace(' ', '.'), body).encode()
+
+def bodies(mail):
+    return [m.body.strip() for m in mail]
+
+
+#%% High-water mark
+def test_only_new_mail_is_returned(imap, path):
+    imap.push(text('OLD'), seen=True)
+    sync = app.mail_sync(imap.client(), path=path)
+    assert sync.get_new_mail() == []                                # already read before first start
+
+    imap.push(text('CURRENT'))
+    imap.push(text('CANCEL'))
+    mail = sync.get_new_mail()
+    assert bodies(mail) == ['CURRENT', 'CANCEL']
+    sync.commit(mail)
+    assert sync.get_new_mail() == []
+
+def test_high_water_mark_survives_restart(imap, path):
+    sync = app.mail_sync(imap.client(), path=path)
+    imap.push(text('CURRENT'))
+    sync.commit(sync.get_new_mail())
+    with open(path) as f:
+        assert json.load(f)['Inbox'] == {'uidvalidity':1, 'last_uid':1, 'modseq':None}
+
+    imap.push(text('CANCEL'))                                      # arrives while the app is down
+    restarted = app.mail_sync(imap.client(), path=path)
+    assert bodies(restarted.get_new_mail()) == ['CANCEL']
+
+def test_uncommitted_mail_is_read_again_after_restart(imap, path):
+    sync = app.mail_sync(imap.client(), path=path)
+    imap.push(text('CURRENT'))
+    assert bodies(sync.get_new_mail()) == ['CURRENT']               # crash before commit()
+    assert bodies(app.mail_sync(imap.client(), path=path).get_new_mail()) == ['CURRENT']
+
+
+#%% UIDVALIDITY
+def test_first_start_resumes_from_oldest_unread(imap, path):
+    imap.push(text('OLD'), seen=True)
+    imap.push(text('PENDING'))
+    imap.push(text('READ LATER'), seen=True)
+    sync = app.mail_sync(imap.client(), path=path)
+    assert sync.state['last_uid'] == 1
+    assert bodies(sync.get_new_mail()) == ['PENDING', 'READ LATER']
+
+def test_uidvalidity_change_reseeds(imap, path):
+    for body in ['A', 'B', 'C']:
+        imap.push(text(body), seen=True)
+    sync = app.mail_sync(imap.client(), path=path)
+    assert sync.state == {'uidvalidity':1, 'last_uid':3, 'modseq':None}
+
+    imap.mailbox.pop(0)                                             # mailbox rebuilt: UIDs restart at 1
+    imap.renumber()
+    imap.push(text('NEW'))                                          # UID 3 -- not above the stale mark
+    reseeded = app.mail_sync(imap.client(), path=path)
+    assert reseeded.state == {'uidvalidity':2, 'last_uid':2, 'modseq':None}
+    assert bodies(reseeded.get_new_mail()) == ['NEW']
+
+
+#%% CONDSTORE
+def test_condstore_polls_changedsince_last_modseq(imap, path):
+    imap.capabilities = ('IMAP4rev1', 'IDLE', 'CONDSTORE')
+    sync = app.mail_sync(imap.client(), path=path)
+    assert sync.condstore
+
+    imap.push(text('CURRENT'))
+    mail = sync.get_new_mail()
+    first_poll = [c for c in imap.commands if 'MODSEQ' in c][-1]
+    assert 'CHANGEDSINCE' not in first_poll                         # nothing known yet
+    sync.commit(mail)
+    assert sync.state['modseq'] == imap.mailbox[-1]['modseq']
+
+    imap.push(text('CANCEL'))
+    assert bodies(sync.get_new_mail()) == ['CANCEL']
+    last_poll = [c for c in imap.commands if 'MODSEQ' in c][-1]
+    assert last_poll.endswith('(CHANGEDSINCE {})'.format(sync.state['modseq']))
+
+def test_condstore_modseq_persisted(imap, path):
+    imap.capabilities = ('IMAP4rev1', 'CONDSTORE')
+    sync = app.mail_sync(imap.client(), path=path)
+    imap.push(text('CURRENT'))
+    sync.commit(sync.get_new_mail())
+    restarted = app.mail_sync(imap.client(), path=path)
+    assert restarted.state['modseq'] == imap.mailbox[-1]['modseq']
+    assert restarted.get_new_mail() == []
@@ -0,0 +1,104 @@
+''' order_book (RH_functions.py) -- shared open-order snapshot with invalidation
+'''
+import threading
+
+import RH.Reports.RH_functions as rh
+
+
+class listing:
+    'order_book_snapshot stand-in: counts fetches; gate (Event) holds a fetch in flight'
+    def __init__(self, gate=None):
+        self.calls = 0
+        self.gate = gate
+        self.started = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        n = self.calls
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        return {'orders':['snapshot {}'.format(n)]}
+
+
+def test_shared_within_max_age():
+    fetch = listing()
+    book = rh.order_book(fetch)
+    assert book.get(60) is book.get(60)
+    assert fetch.calls == 1
+    assert book.stats['hits'] == 1
+
+def test_refetched_when_stale():
+    fetch = listing()
+    book = rh.order_book(fetch)
+    book.get(60)
+    book.get(-1)
+    assert fetch.calls == 2
+
+def test_invalidate_drops_cached_snapshot():
+    fetch = listing()
+    book = rh.order_book(fetch)
+    book.get(60)
+    book.invalidate()
+    assert book.get(60) == {'orders':['snapshot 2']}
+
+def test_concurrent_callers_share_one_fetch():
+    gate = threading.Event()
+    fetch = listing(gate)
+    book = rh.order_book(fetch)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(book.get(60))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    fetch.started.wait(5)
+    gate.set()
+    for thread in threads:
+        thread.join()
+    assert fetch.calls == 1
+    assert all(result is results[0] for result in results)
+
+def test_fetch_in_flight_during_invalidate_is_not_cached():
+    gate = threading.Event()
+    fetch = listing(gate)
+    book = rh.order_book(fetch)
+    before = []
+    thread = threading.Thread(target=lambda: before.append(book.get(60)))
+    thread.start()
+    fetch.started.wait(5)                                           # listing started ...
+    book.invalidate()                                               # ... then an order was canceled
+    gate.set()
+    thread.join()
+    assert before == [{'orders':['snapshot 1']}]                    # its own caller still gets it
+    assert book.stats['discarded'] == 1
+    assert book.get(60) == {'orders':['snapshot 2']}                # never served after the cancel
+
+def test_caller_after_invalidate_does_not_join_old_fetch():
+    gate = threading.Event()
+    fetch = listing(gate)
+    book = rh.order_book(fetch)
+    first = threading.Thread(target=lambda: book.get(60))
+    first.start()
+    fetch.started.wait(5)
+    book.invalidate()
+    after = []
+    second = threading.Thread(target=lambda: after.append(book.get(60)))
+    second.start()
+    gate.set()
+    first.join()
+    second.join()
+    assert after == [{'orders':['snapshot 2']}]
+    assert fetch.calls == 2
+
+def test_failed_fetch_not_cached():
+    calls = []
+    def fetch():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError('down')
+        return {'orders':[]}
+    book = rh.order_book(fetch)
+    try:
+        book.get(60)
+    except ConnectionError:
+        pass
+    assert book.get(60) == {'orders':[]}
@@ -0,0 +1,135 @@
+''' Order text grammar (Process_commands.py) -- parse_order / order_command
+'''
+import pytest
+
+import RH.Process_commands as commands
+
+
+#%% Well-formed orders
+def test_max_leg():
+    order = commands.parse_order('LIMIT BUY E\n10 AAPL MAX 0.3')
+    assert (order.type, order.side, order.instrument) == ('LIMIT', 'BUY', 'equities')
+    assert (order.quantity, order.symbol, order.price_mode, order.price) == (10.0, 'AAPL', 'MAX', 0.3)
+    assert order.limit_price(100.0) == pytest.approx(100.3)
+
+def test_min_leg():
+    order = commands.parse_order('limit sell stock\n2.5 msft min 1')
+    assert (order.side, order.instrument, order.symbol) == ('SELL', 'equities', 'MSFT')
+    assert (order.quantity, order.price_mode, order.price) == (2.5, 'MIN', 1.0)
+    assert order.limit_price(200.0) == pytest.approx(198.0)
+
+def test_absolute_limit_price():
+    order = commands.parse_order('LIMIT BUY E\n10 AAPL 187.50')
+    assert (order.price_mode, order.price) == ('LIMIT', 187.5)
+    assert order.limit_price(999.0) == 187.5                        # market price ignored
+
+def test_instrument_aliases():
+    assert commands.parse_order('LIMIT BUY O\n1 SPY 2.5').instrument == 'options'
+    assert commands.parse_order('LIMIT BUY CRYPTO\n1 BTC MAX 1').instrument == 'crypto'
+
+def test_blank_lines_ignored():
+    order = commands.parse_order('\nLIMIT BUY E\n\n10 AAPL MAX 0.3\n')
+    assert order.symbol == 'AAPL'
+
+def test_order_command_has_no_dict():
+    order = commands.parse_order('LIMIT BUY E\n10 AAPL MAX 0.3')
+    with pytest.raises(AttributeError):
+        order.note = 'x'                                            # __slots__
+
+
+#%% Malformed orders -- error text is sent back to the user
+@pytest.mark.parametrize('text, message', [
+    ('LIMIT BUY E', 'Order needs 2 lines'),
+    ('LIMIT BUY\n10 AAPL MAX 0.3', 'Line 1 must be [Type] [Side] [Instrument]'),
+    ('MARKET BUY E\n10 AAPL MAX 0.3', 'Order type must be one of LIMIT, got "MARKET"'),
+    ('LIMIT HOLD E\n10 AAPL MAX 0.3', 'Side must be BUY or SELL, got "HOLD"'),
+    ('LIMIT BUY X\n10 AAPL MAX 0.3', 'Unknown instrument "X"'),
+    ('LIMIT BUY E\n10 AAPL MAX', 'MAX needs a pct, e.g. "10 AAPL MAX 0.3"'),
+    ('LIMIT BUY E\n10 AAPL MAX X', 'Pct must be a number, got "X"'),
+    ('LIMIT BUY E\n-1 AAPL MAX 0.3', 'Quantity must be above 0, got "-1"'),
+    ('LIMIT BUY E\nTEN AAPL MAX 0.3', 'Quantity must be a number, got "TEN"'),
+    ('LIMIT BUY E\n10 AAPL', 'Line 2 must be [Quantity] [Symbol] MAX|MIN [Pct]'),
+    ('LIMIT BUY E\n10 AAPL 0', 'Limit price must be above 0'),
+    ('LIMIT BUY E\nNAN AAPL MAX 0.3', 'Quantity must be a number, got "NAN"'),
+    ('LIMIT BUY E\n10 AAPL MAX INF', 'Pct must be a number, got "INF"'),
+    ('LIMIT BUY E\n10 AAPL MAX INFINITY', 'Pct must be a number, got "INFINITY"'),
+    ('LIMIT BUY E\n10 AAPL NAN', 'Limit price must be a number, got "NAN"'),
+    ('LIMIT BUY E\n10 AAPL 1E999', 'Limit price must be a number, got "1E999"'),
+    ('LIMIT SELL E\n10 AAPL MIN 150', 'MIN pct must be below 100, got "150"'),
+    ('LIMIT SELL E\n10 AAPL MIN 100', 'MIN pct must be below 100, got "100"'),
+])
+def test_malformed_leg(text, message):
+    with pytest.raises(commands.command_error) as error:
+        commands.parse_order(text)
+    assert message in str(error.value)
+
+def test_min_pct_keeps_limit_positive():
+    order = commands.parse_orders('LIMIT SELL E\n10 AAPL MAX 150\n10 AAPL MIN 99.9')[1]
+    assert order.limit_price(100.0) == pytest.approx(0.1)
+
+def test_later_leg_nan_names_its_line():
+    with pytest.raises(commands.command_error) as error:
+        commands.parse_orders('LIMIT BUY E\n10 AAPL MAX 0.3\nNAN MSFT 410')
+    assert str(error.value) == 'Quantity must be a number, got "NAN" (line 3)'
+
+def test_command_error_is_value_error():
+    with pytest.raises(ValueError):
+        commands.parse_order('LIMIT BUY E\n10 AAPL MAX X')
+
+
+#%% Multi-order texts
+def test_several_legs_share_header():
+    orders = commands.parse_orders('LIMIT SELL E\n10 AAPL MAX 0.3\n5 MSFT 410.5\n1 BRK.B MIN 1')
+    assert [(o.symbol, o.side, o.instrument) for o in orders] == [
+        ('AAPL', 'SELL', 'equities'), ('MSFT', 'SELL', 'equities'), ('BRK.B', 'SELL', 'equities'),
+    ]
+    assert [o.price_mode for o in orders] == ['MAX', 'LIMIT', 'MIN']
+
+@pytest.mark.parametrize('footer', [
+    '1 of 2',
+    '555 123 4567',
+    '(555) 123-4567',
+    '555-123-4567',
+    'Sent from my phone',
+    '--',
+    '2 PM TOMORROW PLEASE',
+])
+def test_footer_ends_order(footer):
+    orders = commands.parse_orders('LIMIT BUY E\n10 AAPL MAX 0.3\n5 MSFT 410.5\n{}\n3 TSLA 200'.format(footer))
+    assert [o.symbol for o in orders] == ['AAPL', 'MSFT']
+
+def test_malformed_later_leg_names_its_line():
+    with pytest.raises(commands.command_error, match=r'\(line 3\)'):
+        commands.parse_orders('LIMIT BUY E\n10 AAPL MAX 0.3\n5 MSFT MAX X')
+    with pytest.raises(commands.command_error, match='Line 3 must be'):
+        commands.parse_orders('LIMIT BUY E\n10 AAPL MAX 0.3\n5 MSFT')
+
+def test_leg_count_capped(monkeypatch):
+    monkeypatch.setitem(commands.config.settings['orders'], 'batch_max_legs', 2)
+    with pytest.raises(commands.command_error, match='At most 2 orders per text, got 3'):
+        commands.parse_orders('LIMIT BUY E\n1 A 1\n1 B 1\n1 C 1')
+
+@pytest.mark.parametrize('line, leg', [
+    ('10 AAPL', True),
+    ('10 AAPL 187.5', True),
+    ('10 AAPL MAX 0.3', True),
+    ('10 AAPL MIN', True),                                          # leg with a mistake -- reported, not skipped
+    ('10 AAPL 18X', False),
+    ('1 OF 2', False),
+    ('10 20 30', False),
+    ('TEN AAPL MAX 0.3', False),
+    ('10 AAPL MAX 0.3 NOW', False),
+    ('10', False),
+])
+def test_looks_like_leg(line, leg):
+    assert commands.looks_like_leg(line.split()) is leg
+
+@pytest.mark.parametrize('leg, message', [
+    ('5 MSFT MAX X', 'Pct must be a number, got "X" (line 3)'),
+    ('5 MSFT 0', 'Limit price must be above 0, got "0" (line 3)'),
+    ('-5 MSFT 410', 'Quantity must be above 0, got "-5" (line 3)'),
+])
+def test_number_errors_name_later_line(leg, message):
+    with pytest.raises(commands.command_error) as error:
+        commands.parse_orders('LIMIT BUY E\n10 AAPL MAX 0.3\n' + leg)
+    assert str(error.value) == message
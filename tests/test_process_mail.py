@@ -0,0 +1,85 @@
+''' APP.process_mail against the local IMAP stand-in (fake_imap.py)
+    -- a failing route neither kills the mail loop nor loses mail
+'''
+import asyncio
+import functools
+import imaplib
+
+import pytest
+
+import APP
+import config as config
+import RH.Process_routes as routes
+import RH.Reports.APP_functions as app
+from fake_imap import fake_imap
+
+
+@pytest.fixture
+def imap(monkeypatch, tmp_path):
+    monkeypatch.setitem(config.settings['mail'], 'listener', 'poll')
+    monkeypatch.setitem(config.settings['mail'], 'poll_min', 0.01)
+    monkeypatch.setitem(config.settings['mail'], 'poll_max', 0.02)
+    monkeypatch.setitem(config.settings['mail'], 'fetch', 'full')
+    monkeypatch.setattr(app, 'mail_sync', functools.partial(app.mail_sync, path=str(tmp_path / 'mail_sync.json')))
+    fake = fake_imap()
+    yield fake
+    fake.close()
+
+class factory:
+    'email_server stand-in: every IMAP login goes to the fake server'
+    def __init__(self, fake):
+        self.fake = fake
+
+    def connect_gmail(self):
+        return self.fake.client()
+
+def text(body):
+    return 'From: a@b\r\n\r\n{}\r\n'.format(body).encode()
+
+def run_until(connections, routed, n, later=None):
+    'Run process_mail until n batches were routed; later() is called 0.2s in'
+    async def main():
+        task = asyncio.ensure_future(APP.process_mail(connections))
+        for step in range(500):
+            if len(routed) >= n or task.done():
+                break
+            if step == 20 and later is not None:
+                later()
+            await asyncio.sleep(0.01)
+        assert not task.done()                                      # the loop never died on its own
+        task.cancel()
+    asyncio.run(main())
+
+
+def test_connection_error_in_route_reconnects_and_rereads(imap, monkeypatch):
+    routed, calls = [], []
+    def route(unread_email, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise imaplib.IMAP4.abort('socket error: EOF')         # e.g. STORE on a dropped connection
+        if unread_email:
+            routed.append([m.body.strip() for m in unread_email])
+    monkeypatch.setattr(routes, 'PROCESS_UNREAD_MSG', route)
+
+    connections = app.email_connections(imap.client(), factory=factory(imap))
+    imap.push(text('CURRENT'))
+    run_until(connections, routed, 1)
+    assert connections.generation == 1
+    assert routed[0] == ['CURRENT']                                 # batch not committed -- read again
+
+def test_route_failure_is_logged_and_loop_goes_on(imap, monkeypatch, caplog):
+    routed = []
+    def route(unread_email, **kwargs):
+        bodies = [m.body.strip() for m in unread_email]
+        if bodies == ['BAD']:
+            raise ValueError('route bug')
+        if bodies:                                                  # empty polls route nothing
+            routed.append(bodies)
+    monkeypatch.setattr(routes, 'PROCESS_UNREAD_MSG', route)
+
+    connections = app.email_connections(imap.client(), factory=factory(imap))
+    imap.push(text('BAD'))
+    run_until(connections, routed, 1, later=lambda: imap.push(text('CURRENT')))
+    assert routed == [['CURRENT']]                                  # BAD committed, not retried
+    assert connections.generation == 0
+    assert 'routing new mail failed' in caplog.text
@@ -0,0 +1,134 @@
+''' quote_cache (RH_marketdata.py) -- staleness budgets, request coalescing,
+    and the holdings report priced from the shared stock quote cache
+'''
+import threading
+import time
+
+import pytest
+import robin_stocks
+
+import RH.Reports.RH_functions as rh
+import RH.Reports.RH_marketdata as marketdata
+
+
+class backend:
+    ''' get_quotes() stand-in: records every request; blocks until 'release'
+        is set when 'gate' is given
+    '''
+    def __init__(self, gate=False):
+        self.requests = []
+        self.release = threading.Event()
+        if not gate:
+            self.release.set()
+
+    def __call__(self, symbols):
+        self.requests.append(list(symbols))
+        self.release.wait(5)
+        return {symbol:{'symbol':symbol, 'n':len(self.requests)} for symbol in symbols}
+
+def in_threads(*calls):
+    'Start calls in threads; returns (threads, results by index)'
+    results = {}
+    threads = [threading.Thread(target=lambda i=i, call=call: results.__setitem__(i, call())) for i, call in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+#%% Staleness budget
+def test_fresh_quote_served_from_memory():
+    fetch = backend()
+    cache = marketdata.quote_cache(fetch_many=fetch)
+    cache.get_many(['AAPL'], max_age=60)
+    assert cache.get('AAPL', max_age=60)['n'] == 1
+    assert fetch.requests == [['AAPL']]
+    assert cache.stats == {'hits':1, 'misses':1, 'coalesced':0}
+
+def test_each_caller_sets_its_own_budget():
+    fetch = backend()
+    cache = marketdata.quote_cache(fetch_many=fetch)
+    cache.get_many(['AAPL'], max_age=60)
+    time.sleep(0.02)
+    assert cache.get('AAPL', max_age=60)['n'] == 1                  # report budget: still fresh
+    assert cache.get('AAPL', max_age=0.01)['n'] == 2                # order budget: refetched
+
+def test_misses_go_out_in_one_request():
+    fetch = backend()
+    cache = marketdata.quote_cache(fetch_many=fetch)
+    cache.get_many(['AAPL'], max_age=60)
+    assert set(cache.get_many(['AAPL', 'MSFT', 'TSLA', 'MSFT'], max_age=60)) == {'AAPL', 'MSFT', 'TSLA'}
+    assert fetch.requests == [['AAPL'], ['MSFT', 'TSLA']]
+
+
+#%% Coalescing
+def test_concurrent_misses_coalesce_into_one_request():
+    fetch = backend(gate=True)
+    cache = marketdata.quote_cache(fetch_many=fetch)
+    first, results = in_threads(lambda: cache.get('AAPL', max_age=60))
+    while not fetch.requests:
+        time.sleep(0.001)
+    others, more = in_threads(*[lambda: cache.get('AAPL', max_age=60)] * 4)
+    while cache.stats['coalesced'] < 4:
+        time.sleep(0.001)
+    fetch.release.set()
+    for thread in first + others:
+        thread.join(5)
+    assert fetch.requests == [['AAPL']]
+    assert [quote['n'] for quote in list(results.values()) + list(more.values())] == [1] * 5
+    assert cache.stats == {'hits':0, 'misses':1, 'coalesced':4}
+
+def test_failed_request_reaches_waiters_and_is_not_cached():
+    calls = []
+    release = threading.Event()
+    def fetch(symbols):
+        calls.append(symbols)
+        release.wait(5)
+        if len(calls) == 1:
+            raise ConnectionError('down')
+        return {symbol:{'symbol':symbol} for symbol in symbols}
+    cache = marketdata.quote_cache(fetch_many=fetch)
+    errors = []
+    def get():
+        try:
+            cache.get('AAPL', max_age=60)
+        except ConnectionError as error:
+            errors.append(error)
+    threads, _ = in_threads(get)
+    while not calls:
+        time.sleep(0.001)
+    waiter, _ = in_threads(get)
+    while not cache.stats['coalesced']:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads + waiter:
+        thread.join(5)
+    assert len(errors) == 2
+    assert cache.get('AAPL', max_age=60) == {'symbol':'AAPL'}       # next call asks again
+
+
+#%% Holdings report
+class stocks:
+    'instrument_store stand-in'
+    def stocks(self, urls):
+        return {url:{'symbol':url.rstrip('/').rsplit('/', 1)[-1]} for url in urls}
+
+def test_holdings_priced_from_shared_quote_cache(monkeypatch):
+    fetch = backend()
+    monkeypatch.setattr(marketdata, 'STOCK_QUOTES', marketdata.quote_cache(fetch_many=lambda symbols: {
+        symbol:{'last_extended_hours_trade_price':None, 'last_trade_price':'110'} for symbol in fetch(symbols)
+    }))
+    monkeypatch.setattr(marketdata, 'instruments', stocks)
+    monkeypatch.setattr(robin_stocks.account, 'get_open_stock_positions', lambda: [
+        {'instrument':'https://api.robinhood.com/instruments/MSFT/', 'quantity':'2.0', 'average_buy_price':'100.0'},
+        {'instrument':'https://api.robinhood.com/instruments/AAPL/', 'quantity':'1.0', 'average_buy_price':'0.0'},
+    ])
+
+    equities = rh.account.get_position.equity()
+    assert list(equities.symbol) == ['AAPL', 'MSFT']
+    assert list(equities.equity) == [110.0, 220.0]
+    assert list(equities.percent_change) == [0.0, pytest.approx(10.0)]   # against average buy price
+    assert fetch.requests == [['MSFT', 'AAPL']]                          # one bulk request
+
+    marketdata.stock_quotes(['msft'], use='order')                 # order pricing reuses the report's quotes
+    assert fetch.requests == [['MSFT', 'AAPL']]
+    assert marketdata.stats()['stock_quotes'] == {'hits':1, 'misses':2, 'coalesced':0}
@@ -0,0 +1,135 @@
+''' Robinhood rate limiter (RH_ratelimit.py) -- retry policy, families, buckets, timeouts
+'''
+import types
+
+import pytest
+import requests
+
+import config as config
+import RH.Reports.RH_ratelimit as ratelimit
+
+API = 'https://api.robinhood.com'
+
+def request(method, path):
+    return types.SimpleNamespace(method=method, url=API + path)
+
+def response(status, headers=None):
+    return types.SimpleNamespace(status_code=status, headers=headers or {}, close=lambda: None)
+
+
+#%% retryable
+@pytest.mark.parametrize('status', [500, 502, 503, 504])
+def test_new_order_5xx_not_resent(status):
+    assert not ratelimit.retryable(request('POST', '/orders/'), status)
+    assert not ratelimit.retryable(request('POST', '/options/orders/'), status)
+
+@pytest.mark.parametrize('status', [500, 502, 503, 504])
+def test_cancel_5xx_resent(status):
+    assert ratelimit.retryable(request('POST', '/orders/abc-123/cancel/'), status)
+    assert ratelimit.retryable(request('POST', '/options/orders/abc-123/cancel'), status)
+
+def test_read_5xx_resent():
+    assert ratelimit.retryable(request('GET', '/marketdata/quotes/'), 503)
+    assert ratelimit.retryable(request('DELETE', '/watchlists/x/'), 503)
+
+def test_429_always_resent():
+    assert ratelimit.retryable(request('POST', '/orders/'), 429)
+
+
+#%% family
+@pytest.mark.parametrize('path, name', [
+    ('/oauth2/token/', 'auth'),
+    ('/orders/', 'orders'),
+    ('/options/orders/x/cancel/', 'orders'),
+    ('/marketdata/options/?ids=x', 'quotes'),
+    ('/quotes/?symbols=AAPL', 'quotes'),
+    ('/options/instruments/x/', 'instruments'),
+    ('/accounts/', 'account'),
+    ('/midlands/news/AAPL/', 'other'),
+])
+def test_family(path, name):
+    assert ratelimit.family(API + path) == name
+
+
+#%% rate_limiter.send
+@pytest.fixture
+def limiter(monkeypatch):
+    settings = dict(config.settings['ratelimit'], retries=3, backoff_base=0.001, backoff_max=0.001)
+    monkeypatch.setattr(ratelimit.time, 'sleep', lambda seconds: None)
+    return ratelimit.rate_limiter(settings)
+
+def replies(*statuses):
+    'adapter_send stand-in answering statuses in turn'
+    sent = []
+    def send(request, **kwargs):
+        sent.append(kwargs)
+        return response(statuses[len(sent) - 1])
+    send.sent = sent
+    return send
+
+def test_429_retried_then_succeeds(limiter, capsys):
+    send = replies(429, 429, 200)
+    assert limiter.send(send, request('GET', '/quotes/')).status_code == 200
+    assert len(send.sent) == 3
+    stats = limiter.stats()
+    assert stats['throttled'] == 2 and stats['quotes']['retries'] == 2
+    assert stats['quotes']['rate'] < config.settings['ratelimit']['families']['quotes']['rate']
+
+def test_new_order_5xx_sent_once(limiter):
+    send = replies(503, 200)
+    assert limiter.send(send, request('POST', '/orders/')).status_code == 503
+    assert len(send.sent) == 1
+
+def test_cancel_5xx_resent(limiter, capsys):
+    send = replies(502, 200)
+    assert limiter.send(send, request('POST', '/orders/x/cancel/')).status_code == 200
+    assert len(send.sent) == 2
+
+def test_retries_exhausted_returns_last_response(limiter, capsys):
+    send = replies(503, 503, 503, 503, 200)
+    assert limiter.send(send, request('GET', '/accounts/')).status_code == 503
+    assert len(send.sent) == 4                                      # first try + 3 retries
+
+def test_retry_after_honoured(limiter):
+    delay = limiter.backoff(0, response(429, {'Retry-After':'0.001'}))
+    assert delay == pytest.approx(0.001)
+
+
+#%% token_bucket
+def test_bucket_burst_then_waits(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(ratelimit.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(ratelimit.time, 'sleep', lambda seconds: None)
+    bucket = ratelimit.token_bucket(rate=10, burst=2, min_rate=1)
+    assert [bucket.take(), bucket.take()] == [0.0, 0.0]
+    assert bucket.take() == pytest.approx(0.1)
+    assert bucket.take() == pytest.approx(0.2)                      # callers queue behind each other
+
+def test_bucket_slows_down_and_recovers():
+    bucket = ratelimit.token_bucket(rate=10, burst=2, min_rate=3)
+    assert bucket.slow_down() == 5
+    assert bucket.slow_down() == 3                                  # floor
+    for _ in range(20):
+        bucket.speed_up()
+    assert bucket.rate == 10                                        # back to configured rate, not above
+
+
+#%% limiter_adapter
+def test_adapter_sets_default_timeout(monkeypatch):
+    seen = {}
+    def send(self, request, **kwargs):
+        seen.update(kwargs)
+        return response(200)
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, 'send', send)
+    adapter = ratelimit.limiter_adapter(ratelimit.rate_limiter())
+    adapter.send(request('GET', '/quotes/'), timeout=None)
+    assert seen['timeout'] == config.settings['ratelimit']['timeout']
+    adapter.send(request('GET', '/quotes/'), timeout=3)
+    assert seen['timeout'] == 3                                     # caller's timeout kept
+
+def test_install_is_idempotent():
+    session = requests.Session()
+    limiter = ratelimit.rate_limiter()
+    assert ratelimit.install(session, limiter) is limiter
+    assert ratelimit.install(session, ratelimit.rate_limiter()) is limiter
+    assert isinstance(session.get_adapter(API), ratelimit.limiter_adapter)
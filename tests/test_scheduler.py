@@ -0,0 +1,138 @@
+''' Priority scheduler (Process_dispatch.py) -- reserved slots and priority order
+'''
+import asyncio
+import threading
+
+import RH.Process_dispatch as dispatch
+
+CLASSES = {'cancel':{'max_workers':1}, 'order':{'max_workers':1}, 'report':{'max_workers':1}}
+
+
+class command:
+    'Route function stand-in: records start order, blocks until released'
+    def __init__(self, log, name):
+        self.log = log
+        self.name = name
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.log.append(self.name)
+        self.release.wait(5)
+
+async def started(log, n):
+    'Wait until n commands have started'
+    for _ in range(500):
+        if len(log) >= n:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError('only {} of {} commands started: {}'.format(len(log), n, log))
+
+def run(test):
+    'Run test(scheduler, log) on a fresh event loop'
+    async def main():
+        scheduler = dispatch.scheduler(CLASSES)
+        try:
+            await test(scheduler, [])
+        finally:
+            scheduler.shutdown(wait=False)
+    asyncio.run(main())
+
+
+def test_cancel_runs_while_reports_hold_their_slot():
+    async def test(scheduler, log):
+        report = command(log, 'report')
+        scheduler.submit('CURRENT', report, route_class='report')
+        await started(log, 1)
+        cancel = command(log, 'cancel')
+        cancel.release.set()
+        task = scheduler.submit('CANCEL', cancel, route_class='cancel')
+        await asyncio.wait_for(task, 2)
+        assert log == ['report', 'cancel']
+        report.release.set()
+    run(test)
+
+def test_reports_never_take_cancel_slots():
+    async def test(scheduler, log):
+        reports = [command(log, 'report {}'.format(i)) for i in range(3)]
+        for report in reports:
+            scheduler.submit('CURRENT', report, route_class='report')
+        await started(log, 1)
+        await asyncio.sleep(0.1)
+        assert log == ['report 0']                                  # one report slot, no borrowing upward
+        assert scheduler.stats()['report']['queued'] == 2
+        assert scheduler.free == {'cancel':1, 'order':1, 'report':0}
+        for report in reports:
+            report.release.set()
+    run(test)
+
+def test_cancel_borrows_idle_lower_slots():
+    async def test(scheduler, log):
+        cancels = [command(log, 'cancel {}'.format(i)) for i in range(3)]
+        for cancel in cancels:
+            scheduler.submit('CANCEL', cancel, route_class='cancel')
+        await started(log, 3)                                       # own slot + order + report slots
+        assert scheduler.free == {'cancel':0, 'order':0, 'report':0}
+        for cancel in cancels:
+            cancel.release.set()
+    run(test)
+
+def test_freed_slot_goes_to_highest_priority_waiter():
+    async def test(scheduler, log):
+        first = command(log, 'report 1')
+        scheduler.submit('CURRENT', first, route_class='report')
+        blockers = [command(log, 'cancel'), command(log, 'order')]
+        scheduler.submit('CANCEL', blockers[0], route_class='cancel')
+        scheduler.submit('ORDER', blockers[1], route_class='order')
+        await started(log, 3)
+
+        second = command(log, 'report 2')
+        second.release.set()
+        late_cancel = command(log, 'late cancel')
+        late_cancel.release.set()
+        scheduler.submit('CURRENT', second, route_class='report')   # queued first ...
+        scheduler.submit('CANCEL', late_cancel, route_class='cancel')   # ... but higher priority
+        await asyncio.sleep(0.05)
+        assert len(log) == 3
+
+        first.release.set()                                         # frees the report slot
+        await started(log, 5)
+        assert log[3:] == ['late cancel', 'report 2']
+        for blocker in blockers:
+            blocker.release.set()
+    run(test)
+
+def test_slots_all_returned():
+    async def test(scheduler, log):
+        tasks = []
+        for route_class in ['report', 'cancel', 'order', 'cancel', 'report']:
+            job = command(log, route_class)
+            job.release.set()
+            tasks.append(scheduler.submit(route_class, job, route_class=route_class))
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+        assert scheduler.free == {'cancel':1, 'order':1, 'report':1}
+        assert sum(c['done'] for c in scheduler.stats().values()) == 5
+    run(test)
+
+def test_tasks_kept_until_done():
+    async def test(scheduler, log):
+        job = command(log, 'report')
+        scheduler.submit('CURRENT', job, route_class='report')      # caller drops the task, as RUN_ROUTE does
+        await started(log, 1)
+        [task] = scheduler.tasks
+        assert not task.done()
+        job.release.set()
+        await asyncio.wait_for(task, 2)
+        await asyncio.sleep(0)                                      # done callbacks run
+        assert scheduler.tasks == set()
+    run(test)
+
+def test_stats_logged_at_info(caplog):
+    caplog.set_level('INFO', logger='APP')
+    async def test(scheduler, log):
+        job = command(log, 'cancel')
+        job.release.set()
+        await asyncio.wait_for(scheduler.submit('CANCEL', job, route_class='cancel'), 2)
+    run(test)
+    [record] = [r for r in caplog.records if '[SCHEDULER]' in r.getMessage()]
+    assert record.levelname == 'INFO'
+    assert "'cancel': {'queued': 0, 'running': 0, 'done': 1" in record.getMessage()
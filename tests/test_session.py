@@ -0,0 +1,125 @@
+''' Robinhood session (RH_functions.py) with a stubbed robin_stocks
+    -- coalesced renewals, refresh fallback to login, 401 watch
+'''
+import threading
+import time
+import types
+
+import pytest
+import requests
+import robin_stocks
+
+import RH.Reports.RH_functions as rh
+
+
+class stub:
+    ''' robin_stocks stand-in: r.login() and the refresh-token POST
+        + refresh: reply to request_post(login_url), or None (failed request)
+        + delay: seconds each call takes
+    '''
+    def __init__(self, monkeypatch, refresh=None, delay=0.0):
+        self.logins = []
+        self.posts = []
+        self.refresh = refresh
+        self.delay = delay
+        monkeypatch.setattr(robin_stocks, 'login', self.login)
+        monkeypatch.setattr(robin_stocks.helper, 'request_post', self.request_post)
+        monkeypatch.setattr(robin_stocks.helper, 'update_session', lambda key, value: None)
+        monkeypatch.setattr(robin_stocks.helper, 'set_login_state', lambda state: None)
+
+    def login(self, username, password, expiresIn):
+        time.sleep(self.delay)
+        self.logins.append(username)
+        return {'access_token':'a{}'.format(len(self.logins)), 'refresh_token':'r', 'expires_in':expiresIn}
+
+    def request_post(self, url, payload):
+        time.sleep(self.delay)
+        self.posts.append((url, payload))
+        return self.refresh
+
+@pytest.fixture
+def session(monkeypatch, tmp_path):
+    monkeypatch.setattr(rh, 'TOKEN_PATH', str(tmp_path / 'robinhood.pickle'))
+    session = rh.session()
+    session.hooked = True                                           # no rate limiter / 401 hook on robin_stocks' SESSION
+    return session
+
+def expire(session):
+    session.expires_at = time.time()
+
+
+#%% ensure()
+def test_valid_token_needs_no_request(session, monkeypatch):
+    backend = stub(monkeypatch)
+    session.ensure()
+    session.ensure()
+    assert len(backend.logins) == 1
+    assert session.valid()
+
+def test_concurrent_callers_share_one_login(session, monkeypatch):
+    backend = stub(monkeypatch, delay=0.2)
+    start = threading.Barrier(8)
+    def ensure():
+        start.wait()
+        session.ensure()
+    threads = [threading.Thread(target=ensure) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(backend.logins) == 1
+    assert session.stats['coalesced'] == 7
+    assert session.generation == 1
+
+def test_refresh_token_used_when_due(session, monkeypatch):
+    backend = stub(monkeypatch, refresh={'access_token':'fresh', 'expires_in':600})
+    session.ensure()
+    expire(session)
+    session.ensure()
+    assert len(backend.logins) == 1
+    assert backend.posts[0][1]['grant_type'] == 'refresh_token'
+    assert session.token['access_token'] == 'fresh'
+    assert session.metrics()['refreshes'] == 1
+
+@pytest.mark.parametrize('reply', [None, {'detail':'invalid_grant'}])
+def test_failed_refresh_falls_back_to_login(session, monkeypatch, reply):
+    backend = stub(monkeypatch, refresh=reply)
+    session.ensure()
+    expire(session)
+    session.ensure()
+    assert len(backend.posts) == 1
+    assert len(backend.logins) == 2
+    assert session.valid()
+    metrics = session.metrics()
+    assert (metrics['refresh_failures'], metrics['logins'], metrics['refreshes']) == (1, 2, 0)
+    assert metrics['login_avg_s'] is not None and metrics['expires_in_s'] > 0
+
+
+#%% 401 watch
+def response(status, url='https://api.robinhood.com/positions/'):
+    return types.SimpleNamespace(status_code=status, url=url)
+
+def test_401_marks_session_stale(session, monkeypatch):
+    backend = stub(monkeypatch, refresh={'access_token':'fresh'})
+    session.ensure()
+    session.observe(response(200))
+    assert session.valid()
+    session.observe(response(401))
+    assert not session.valid() and session.seconds_to_refresh() == 0.0
+    session.ensure()
+    assert session.valid() and not session.unauthorized
+    assert session.stats['unauthorized'] == 1
+
+def test_401_from_token_endpoint_ignored(session):
+    session.observe(response(401, 'https://api.robinhood.com/oauth2/token/'))
+    assert not session.unauthorized
+
+def test_hook_watches_robin_stocks_session(monkeypatch):
+    monkeypatch.setattr(robin_stocks.helper, 'SESSION', requests.Session())
+    session = rh.session()
+    session.hook()
+    session.hook()                                                  # idempotent
+    hooks = robin_stocks.helper.SESSION.hooks['response']
+    assert hooks.count(session.observe) == 1
+    requests.hooks.dispatch_hook('response', robin_stocks.helper.SESSION.hooks, response(401))
+    assert session.unauthorized